@@ -0,0 +1,200 @@
+from datetime import date, datetime
+from sqlalchemy import event, inspect, select, update, insert, delete
+from models import User, Receipt, UserAggregate, MonthlyAggregate
+
+# The dashboard reads totals from UserAggregate / MonthlyAggregate instead of
+# running SUM over every receipt on each page view. Both tables are kept
+# current by ORM events on Receipt, inside the same flush (and transaction)
+# as the receipt change. Only processed ('done') receipts are counted.
+# Amounts are summed in the home currency (Receipt.home_amount, see
+# fx_rates.py); receipts without a conversion add to unconverted_count only.
+#
+# UserAggregate.version counts every change to a user's receipts (any
+# column, any status) so artifacts derived from them, such as cached exports,
+# can tell whether they are stale.
+#
+# Writes that bypass the ORM (query.update()/delete(), raw SQL) are not seen;
+# `flask --app main reconcile-aggregates` rebuilds everything from scratch.
+# This module must be imported by every process that writes receipts.
+
+TRACKED = ('user_id', 'home_amount', 'home_tax_amount', 'date', 'category', 'status', 'created_at')
+
+def receipt_month(receipt_date, created_at=None):
+    """YYYY-MM bucket for a receipt: its own date, else when it was uploaded"""
+    if isinstance(receipt_date, (date, datetime)):
+        return receipt_date.strftime('%Y-%m')
+    if receipt_date and len(receipt_date) >= 7 and receipt_date[4] == '-':
+        return receipt_date[:7]
+    return (created_at or datetime.utcnow()).strftime('%Y-%m')
+
+def _contribution(values):
+    """(user_id, month, category, amount, tax, unconverted) a receipt adds to
+    the totals, or None"""
+    if values['status'] not in (None, 'done'):
+        return None
+    return (
+        values['user_id'],
+        receipt_month(values['date'], values['created_at']),
+        values['category'] or 'Other',
+        values['home_amount'] or 0.0,
+        values['home_tax_amount'] or 0.0,
+        1 if values['home_amount'] is None else 0
+    )
+
+def _current(receipt):
+    return {name: getattr(receipt, name) for name in TRACKED}
+
+def _previous(receipt):
+    """Tracked column values as they were before this flush"""
+    state = inspect(receipt)
+    values = {}
+    for name in TRACKED:
+        history = state.attrs[name].history
+        if history.deleted:
+            values[name] = history.deleted[0]
+        elif history.unchanged:
+            values[name] = history.unchanged[0]
+        else:
+            values[name] = None
+    return values
+
+def _add(connection, table, key, count, amount, tax, **extra):
+    """UPDATE the row for key by the deltas, INSERT it if it does not exist yet"""
+    deltas = {'receipt_count': count, 'total_amount': amount, 'total_tax': tax, **extra}
+    result = connection.execute(
+        update(table)
+        .where(*[table.c[name] == value for name, value in key.items()])
+        .values(**{name: table.c[name] + delta for name, delta in deltas.items()})
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(table).values(**key, **deltas))
+
+def _apply(connection, contribution, sign):
+    user_id, month, category, amount, tax, unconverted = contribution
+    _add(connection, UserAggregate.__table__, {'user_id': user_id}, sign, sign * amount, sign * tax,
+         unconverted_count=sign * unconverted)
+    monthly = MonthlyAggregate.__table__
+    key = {'user_id': user_id, 'month': month, 'category': category}
+    _add(connection, monthly, key, sign, sign * amount, sign * tax)
+    if sign < 0:
+        # Drop emptied buckets so they do not linger as zero slices in the chart
+        connection.execute(
+            delete(monthly)
+            .where(*[monthly.c[name] == value for name, value in key.items()])
+            .where(monthly.c.receipt_count <= 0)
+        )
+
+def _bump_version(connection, user_id):
+    table = UserAggregate.__table__
+    result = connection.execute(
+        update(table).where(table.c.user_id == user_id).values(version=table.c.version + 1)
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(table).values(user_id=user_id, receipt_count=0, total_amount=0.0, total_tax=0.0,
+                                                unconverted_count=0, version=1))
+
+# Load the old value when a tracked column is overwritten on an expired
+# instance, so after_update can subtract what the receipt used to contribute
+for _name in TRACKED:
+    event.listen(getattr(Receipt, _name), 'set', lambda target, value, oldvalue, initiator: value,
+                 active_history=True, retval=True)
+
+@event.listens_for(Receipt, 'after_insert')
+def _receipt_inserted(mapper, connection, target):
+    new = _contribution(_current(target))
+    if new:
+        _apply(connection, new, 1)
+    _bump_version(connection, target.user_id)
+
+@event.listens_for(Receipt, 'after_update')
+def _receipt_updated(mapper, connection, target):
+    previous = _previous(target)
+    old = _contribution(previous)
+    new = _contribution(_current(target))
+    if old != new:
+        if old:
+            _apply(connection, old, -1)
+        if new:
+            _apply(connection, new, 1)
+    _bump_version(connection, target.user_id)
+    if previous['user_id'] not in (None, target.user_id):
+        _bump_version(connection, previous['user_id'])
+
+@event.listens_for(Receipt, 'after_delete')
+def _receipt_deleted(mapper, connection, target):
+    previous = _previous(target)
+    old = _contribution(previous)
+    if old:
+        _apply(connection, old, -1)
+    _bump_version(connection, previous['user_id'])
+
+@event.listens_for(User, 'before_delete')
+def _user_deleted(mapper, connection, target):
+    for table in (UserAggregate.__table__, MonthlyAggregate.__table__):
+        connection.execute(delete(table).where(table.c.user_id == target.id))
+
+def totals(connection, user_id=None):
+    """Stored aggregate rows keyed (user_id,) and (user_id, month, category),
+    for comparing the running totals with a rebuild"""
+    rows = {}
+    user_table, monthly = UserAggregate.__table__, MonthlyAggregate.__table__
+    for table, key in ((user_table, [user_table.c.user_id]),
+                       (monthly, [monthly.c.user_id, monthly.c.month, monthly.c.category])):
+        query = select(*key, table.c.receipt_count, table.c.total_amount, table.c.total_tax)
+        if user_id is not None:
+            query = query.where(table.c.user_id == user_id)
+        for row in connection.execute(query):
+            count, amount, tax = row[len(key):]
+            rows[tuple(row[:len(key)])] = (count, round(amount or 0, 2), round(tax or 0, 2))
+    return rows
+
+def rebuild(connection, user_id=None):
+    """Recompute the aggregates from the receipt table, for one user or all.
+    Returns the number of receipts counted."""
+    receipts = Receipt.__table__
+    query = select(*[receipts.c[name] for name in TRACKED])
+    if user_id is not None:
+        query = query.where(receipts.c.user_id == user_id)
+
+    users, months = {}, {}
+    counted = 0
+    for row in connection.execution_options(yield_per=1000).execute(query).mappings():
+        contribution = _contribution(row)
+        if contribution is None:
+            continue
+        amount, tax, unconverted = contribution[3:]
+        for totals in (users.setdefault(contribution[0], [0, 0.0, 0.0, 0]),
+                       months.setdefault(contribution[:3], [0, 0.0, 0.0, 0])):
+            totals[0] += 1
+            totals[1] += amount
+            totals[2] += tax
+            totals[3] += unconverted
+        counted += 1
+
+    # Versions only ever move forward, so nothing cached before the rebuild is reused
+    user_table = UserAggregate.__table__
+    versions = select(user_table.c.user_id, user_table.c.version)
+    if user_id is not None:
+        versions = versions.where(user_table.c.user_id == user_id)
+    versions = dict(connection.execute(versions).all())
+    for key in versions:
+        users.setdefault(key, [0, 0.0, 0.0, 0])
+
+    for table in (UserAggregate.__table__, MonthlyAggregate.__table__):
+        statement = delete(table)
+        if user_id is not None:
+            statement = statement.where(table.c.user_id == user_id)
+        connection.execute(statement)
+    if users:
+        connection.execute(insert(UserAggregate.__table__), [
+            {'user_id': key, 'receipt_count': count, 'total_amount': amount, 'total_tax': tax,
+             'unconverted_count': unconverted, 'version': versions.get(key, 0) + 1}
+            for key, (count, amount, tax, unconverted) in users.items()
+        ])
+    if months:
+        connection.execute(insert(MonthlyAggregate.__table__), [
+            {'user_id': key[0], 'month': key[1], 'category': key[2],
+             'receipt_count': count, 'total_amount': amount, 'total_tax': tax}
+            for key, (count, amount, tax, _) in months.items()
+        ])
+    return counted
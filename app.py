@@ -1,17 +1,27 @@
 import os
 import logging
-from flask import Flask, render_template, request, redirect, jsonify, send_file, url_for, flash, session
+from flask import Flask, Response, render_template, request, redirect, jsonify, send_file, url_for, flash, session, stream_with_context, g
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
-from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 import pandas as pd
-from ocr_processor import extract_receipt_data
-from export_utils import create_excel_export
+from job_queue import get_job, init_queue
+from export_utils import stream_excel_export, stream_csv_export
+from export_cache import export_cache
+from receipt_queries import page_json, parse_filters, parse_fields, InvalidQuery, PAGE_SIZE
+from search import search_receipts, SEARCH_LIMIT
+import receipt_service
+import metrics
+from storage import save_upload, save_stream, InvalidUpload
+import image_store
+import fx_rates
+from batch_processor import expand_uploads, extract_batch, BATCH_WORKERS
+from ocr_processor import cache_stats
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import time
+import click
 from db import db
 
 # Configure logging
@@ -27,12 +37,10 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
 # Configure the database
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///receipts.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = dict(receipt_service.ENGINE_OPTIONS)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+BATCH_MAX_CONTENT_LENGTH = 256 * 1024 * 1024  # multi-file / ZIP batch uploads
+IMAGE_MAX_AGE = 365 * 24 * 3600  # receipt images and thumbnails are immutable
 
 # Initialize the app with the extension
 db.init_app(app)
@@ -44,12 +52,13 @@ limiter = Limiter(
     default_limits=["200 per day", "50 per hour"]
 )
 
-# Ensure upload directory exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs('exports', exist_ok=True)
-
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 
+EXPORT_FORMATS = {
+    'xlsx': (stream_excel_export, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv': (stream_csv_export, 'text/csv'),
+}
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -59,11 +68,25 @@ def require_auth():
     return session.get('user_email') is not None
 
 def get_current_user():
-    """Get current user from session"""
-    if not require_auth():
-        return None
-    email = session.get('user_email')
-    return User.query.filter_by(email=email).first()
+    """Snapshot (id, email, plan, receipt_count) of the session's user, or None.
+    Resolved once per request, usually from user_cache without a query."""
+    if 'current_user' not in g:
+        email = session.get('user_email')
+        user = user_cache.get(email) if email else None
+        if email and user is None:
+            user = load_current_user()
+        g.current_user = user
+    return g.current_user
+
+def load_current_user():
+    """The session's User row, for routes that change it or enforce plan limits"""
+    if 'current_user_row' not in g:
+        email = session.get('user_email')
+        user = User.query.filter_by(email=email).first() if email else None
+        if user:
+            user_cache.put(email, snapshot(user))
+        g.current_user_row = user
+    return g.current_user_row
 
 def create_session(email):
     """Create user session"""
@@ -74,8 +97,88 @@ def create_session(email):
 
 with app.app_context():
     # Import models here
-    from models import User, Receipt
+    from models import User, Receipt, UserAggregate
+    from migrations import upgrade
+    import aggregates
+    from user_cache import user_cache, snapshot
+    from page_cache import page_cache
     db.create_all()
+    upgrade(db.engine)
+    with db.engine.connect() as conn:
+        missing_rates = receipt_service.missing_rates_warning(conn)
+    if missing_rates:
+        app.logger.warning(missing_rates)
+    init_queue()
+    metrics.install_hooks()
+
+if metrics.ENABLED:
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_time(response):
+        if 'request_start' in g:
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            metrics.http_request_seconds.observe(
+                time.perf_counter() - g.request_start, endpoint, request.method, response.status_code)
+        return response
+
+@app.cli.command('reconcile-aggregates')
+@click.option('--user-id', type=int, default=None, help='Only rebuild this user')
+def reconcile_aggregates(user_id):
+    """Rebuild dashboard totals from the receipt table, reporting any drift"""
+    with db.engine.begin() as conn:
+        before = aggregates.totals(conn, user_id)
+        counted = aggregates.rebuild(conn, user_id)
+        after = aggregates.totals(conn, user_id)
+    click.echo(f"Rebuilt aggregates from {counted} receipts")
+    drifted = sorted({key[0] for key in before.keys() | after.keys() if before.get(key) != after.get(key)})
+    if drifted:
+        click.echo(f"Totals had drifted for user(s): {', '.join(str(user) for user in drifted)}")
+    else:
+        click.echo("No drift found")
+
+@app.cli.command('load-fx-rates')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--no-reconvert', is_flag=True, help='Only store the rates; leave receipt amounts as they are')
+def load_fx_rates(path, no_reconvert):
+    """Merge a date,currency,rate or ECB eurofxref CSV into the FX rate table"""
+    click.echo(f"Loaded {fx_rates.load(path)} rates into {fx_rates.FX_RATES_PATH}")
+    if not no_reconvert:
+        reconvert_receipts.callback(None)
+
+@app.cli.command('reconvert-amounts')
+@click.option('--user-id', type=int, default=None, help='Only reconvert this user')
+def reconvert_receipts(user_id):
+    """Recompute home-currency amounts and totals, e.g. after HOME_CURRENCY changes"""
+    with db.engine.begin() as conn:
+        converted = receipt_service.reconvert_amounts(conn, user_id)
+        aggregates.rebuild(conn, user_id)
+    click.echo(f"Converted {converted} receipts to {fx_rates.HOME_CURRENCY}")
+
+@app.cli.command('archive-images')
+@click.option('--delete-originals', is_flag=True, help='Remove each legacy upload once archived')
+def archive_images(delete_originals):
+    """Move receipts uploaded before the image archive into it"""
+    filenames = [name for (name,) in db.session.query(Receipt.filename).distinct() if image_store.is_legacy(name)]
+    archived = 0
+    for filename in filenames:
+        path = os.path.join(image_store.LEGACY_UPLOAD_FOLDER, filename)
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, 'rb') as f:
+                key = image_store.promote(save_stream(f)[0])
+        except InvalidUpload as e:
+            click.echo(f"Skipped {filename}: {e}")
+            continue
+        Receipt.query.filter_by(filename=filename).update({'filename': key})
+        db.session.commit()
+        if delete_originals:
+            os.remove(path)
+        archived += 1
+    click.echo(f"Archived {archived} of {len(filenames)} legacy images")
 
 @app.route('/')
 def home():
@@ -96,15 +199,10 @@ def login():
                 flash('Please enter a valid email address', 'error')
                 return render_template('login.html')
             
-            # Get or create user
-            user = User.query.filter_by(email=email).first()
-            if not user:
-                user = User(email=email)
-                db.session.add(user)
-                db.session.commit()
-                app.logger.info(f"New user registered: {email}")
+            user = receipt_service.get_or_create_user(db.session, email)
             
             create_session(email)
+            user_cache.put(email, snapshot(user))
             app.logger.info(f"User logged in: {email}")
             return redirect(url_for('dashboard', user_id=user.id))
             
@@ -121,6 +219,7 @@ def logout():
     email = session.get('user_email')
     session.clear()
     if email:
+        user_cache.invalidate(email)
         app.logger.info(f"User logged out: {email}")
     return redirect(url_for('home'))
 
@@ -131,12 +230,12 @@ def upload_receipt():
     if not require_auth():
         return jsonify({'error': 'Authentication required. Please log in.'}), 401
     
-    user = get_current_user()
+    user = load_current_user()
     if not user:
         return jsonify({'error': 'User not found. Please log in again.'}), 401
     
     # Check limits
-    if user.plan == 'free' and user.receipt_count >= 10:
+    if receipt_service.remaining_uploads(user) == 0:
         app.logger.warning(f"User {user.email} hit free plan limit")
         return jsonify({'error': 'Free limit reached. Upgrade to Pro for unlimited receipts.'}), 429
     
@@ -148,63 +247,275 @@ def upload_receipt():
         return jsonify({'error': 'No file selected'}), 400
     
     if file and allowed_file(file.filename):
-        filename = secure_filename(f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}")
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        # Identical images share one archived copy keyed by their content hash
+        try:
+            with metrics.timed('file_save'):
+                key, sha256, created = save_upload(file)
+        except InvalidUpload as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Extract receipt data using OCR + AI
+        # Persist a pending receipt and hand extraction to the OCR worker pool
         try:
             start_time = time.time()
-            receipt_data = extract_receipt_data(filepath)
-            processing_time = time.time() - start_time
+            receipt, job_id = receipt_service.queue_receipt(db.session, user, key)
+            user_cache.invalidate(user.email)
+            page_cache.invalidate(user.id)
             
-            app.logger.info(f"Receipt processed in {processing_time:.2f}s for user {user.email}")
+            app.logger.info(f"Receipt queued in {time.time() - start_time:.2f}s for user {user.email} (job {job_id})")
             
-            if receipt_data:
-                # Save to database with transaction
-                try:
-                    receipt = Receipt(
-                        user_id=user.id,
-                        filename=filename,
-                        vendor=receipt_data.get('vendor', 'Unknown'),
-                        amount=receipt_data.get('amount', 0.0),
-                        currency=receipt_data.get('currency', 'USD'),
-                        date=receipt_data.get('date', datetime.now().strftime('%Y-%m-%d')),
-                        category=receipt_data.get('category', 'Other'),
-                        tax_amount=receipt_data.get('tax', 0.0)
-                    )
-                    db.session.add(receipt)
-                    
-                    # Update user receipt count
-                    user.receipt_count += 1
-                    db.session.commit()
-                    
-                    app.logger.info(f"Receipt saved successfully for user {user.email}")
-                    
-                    return jsonify({
-                        'success': True,
-                        'data': receipt_data,
-                        'redirect': url_for('dashboard', user_id=user.id)
-                    })
-                    
-                except Exception as db_error:
-                    db.session.rollback()
-                    app.logger.error(f"Database error for user {user.email}: {str(db_error)}")
-                    return jsonify({'error': 'Failed to save receipt data. Please try again.'}), 500
-                    
-            else:
-                app.logger.warning(f"Failed to extract data from receipt for user {user.email}")
-                return jsonify({'error': 'Could not process receipt. Please try a clearer image.'}), 422
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status': 'pending',
+                'status_url': url_for('job_status', job_id=job_id),
+                'redirect': url_for('dashboard', user_id=user.id)
+            }), 202
                 
         except Exception as e:
-            app.logger.error(f"Error processing receipt for user {user.email}: {str(e)}")
-            # Clean up uploaded file on error
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            db.session.rollback()
+            app.logger.error(f"Error queueing receipt for user {user.email}: {str(e)}")
+            # Clean up the stored image on error unless an earlier receipt shares it
+            if created:
+                image_store.delete(sha256)
             return jsonify({'error': 'Error processing receipt. Please try again.'}), 500
     
     return jsonify({'error': 'Invalid file format. Please upload PNG or JPG.'}), 400
 
+@app.route('/upload/batch', methods=['POST'])
+@limiter.limit("10 per hour")
+def upload_batch():
+    """Upload many receipts (images and/or ZIP archives) and extract them in parallel"""
+    # Month-end batches are far larger than a single receipt
+    request.max_content_length = BATCH_MAX_CONTENT_LENGTH
+    
+    if not require_auth():
+        return jsonify({'error': 'Authentication required. Please log in.'}), 401
+    
+    user = load_current_user()
+    if not user:
+        return jsonify({'error': 'User not found. Please log in again.'}), 401
+    
+    files = [f for f in request.files.getlist('receipts') if f.filename]
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+    
+    start_time = time.time()
+    remaining = receipt_service.remaining_uploads(user)
+    
+    # Store every image first so extraction can fan out across processes
+    results = []
+    pending = []
+    for name, stream, error in expand_uploads(files):
+        if error is None and remaining is not None and len(pending) >= remaining:
+            error = 'Free limit reached. Upgrade to Pro for unlimited receipts.'
+        if error is None:
+            try:
+                with metrics.timed('file_save'):
+                    key, sha256, _ = save_stream(stream)
+            except InvalidUpload as e:
+                error = str(e)
+        if error:
+            results.append({'file': name, 'success': False, 'error': error})
+            continue
+        results.append({'file': name})
+        pending.append((results[-1], key))
+    
+    extracted = extract_batch([key for _, key in pending])
+    
+    # One transaction and a single receipt_count update for the whole batch
+    receipts = []
+    for (result, filename), (receipt_data, seconds, error, ocr_text) in zip(pending, extracted):
+        result['seconds'] = round(seconds, 3)
+        if error:
+            result.update({'success': False, 'error': error})
+            continue
+        receipts.append(receipt_service.build_receipt(user.id, image_store.archived_key(filename), receipt_data, ocr_text))
+        result.update({'success': True, 'data': receipt_data})
+    
+    try:
+        if receipt_service.save_receipts(db.session, user, receipts):
+            user_cache.invalidate(user.email)
+            page_cache.invalidate(user.id)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Database error saving batch for user {user.email}: {str(e)}")
+        return jsonify({'error': 'Failed to save receipt data. Please try again.'}), 500
+    
+    wall_time = time.time() - start_time
+    app.logger.info(f"Batch of {len(results)} files processed in {wall_time:.2f}s for user {user.email}")
+    
+    return jsonify({
+        'success': True,
+        'results': results,
+        'summary': {
+            'files': len(results),
+            'saved': len(receipts),
+            'failed': len(results) - len(receipts),
+            'workers': BATCH_WORKERS,
+            'wall_time': round(wall_time, 3),
+            'ocr_time': round(sum(r.get('seconds', 0) for r in results), 3)
+        },
+        'redirect': url_for('dashboard', user_id=user.id)
+    })
+
+@app.route('/jobs/<job_id>')
+@limiter.exempt
+def job_status(job_id):
+    """Poll the extraction status of a queued receipt"""
+    if not require_auth():
+        return jsonify({'error': 'Authentication required. Please log in.'}), 401
+    
+    user = get_current_user()
+    job = get_job(job_id)
+    receipt = db.session.get(Receipt, job['receipt_id']) if job else None
+    if not user or not receipt or receipt.user_id != user.id:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    response = {
+        'job_id': job_id,
+        'status': {'queued': 'pending'}.get(job['status'], job['status']),
+        'redirect': url_for('dashboard', user_id=user.id)
+    }
+    if job['status'] == 'done':
+        response['success'] = True
+        response['data'] = job['result']
+    elif job['status'] == 'failed':
+        response['error'] = 'Could not process receipt. Please try a clearer image.'
+    return jsonify(response)
+
+def _send_receipt_image(receipt_id, thumbnail):
+    if not require_auth():
+        return jsonify({'error': 'Authentication required. Please log in.'}), 401
+    
+    user = get_current_user()
+    row = db.session.query(Receipt.filename).filter_by(id=receipt_id, user_id=user.id).first() if user else None
+    if not row:
+        return jsonify({'error': 'Receipt not found'}), 404
+    
+    key = row.filename
+    if image_store.is_staged(key):
+        # Still queued: the original is served until the worker archives it
+        if thumbnail or not image_store.store.exists(key):
+            return jsonify({'error': 'Image not found'}), 404
+        url = image_store.store.url(key)
+        return redirect(url) if url else send_file(image_store.store.path(key), mimetype=image_store.content_type(key))
+    if image_store.is_legacy(key):
+        # Uploaded before the archive existed: original only, no thumbnail
+        path = os.path.join(image_store.LEGACY_UPLOAD_FOLDER, key)
+        if thumbnail or not os.path.exists(path):
+            return jsonify({'error': 'Image not found'}), 404
+        return send_file(path)
+    
+    if thumbnail:
+        key = image_store.thumbnail_key(image_store.content_hash(key))
+    url = image_store.store.url(key)
+    if url:
+        return redirect(url)
+    # Keys are content addressed, so a stored image never changes
+    response = send_file(image_store.store.path(key), mimetype=image_store.content_type(key), max_age=IMAGE_MAX_AGE)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+def _cached_page(page, variant, render, owner=None):
+    """Serve a page from page_cache (rendering it on a miss) with an ETag and
+    Last-Modified, answering browser revalidations with a 304"""
+    cached = page_cache.get(page, variant, owner)
+    metrics.count('cache.page.hit' if cached else 'cache.page.miss')
+    if cached is None:
+        cached = page_cache.put(page, variant, render(), owner)
+    response = Response(cached.body, mimetype='text/html')
+    response.set_etag(cached.etag)
+    response.last_modified = cached.last_modified
+    # Per-user pages: browsers keep them but must revalidate on every visit
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+@app.route('/receipts/<int:receipt_id>/thumbnail')
+@limiter.exempt
+def receipt_thumbnail(receipt_id):
+    return _send_receipt_image(receipt_id, thumbnail=True)
+
+@app.route('/receipts/<int:receipt_id>/image')
+@limiter.exempt
+def receipt_image(receipt_id):
+    return _send_receipt_image(receipt_id, thumbnail=False)
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    """Prometheus scrape endpoint: stage and request latency histograms, event counters"""
+    if not metrics.ENABLED:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/stats/cache')
+@limiter.exempt
+def extraction_cache_stats():
+    """Extraction cache effectiveness: hits, misses and API time/tokens saved"""
+    return jsonify({**cache_stats(), 'export': export_cache.stats(), 'user': user_cache.stats(), 'page': page_cache.stats()})
+
+@app.route('/api/receipts')
+@limiter.limit("120 per minute")
+def api_receipts():
+    """The logged-in user's receipts, newest first, one keyset page at a time.
+    
+    Query args: cursor (next_cursor of the previous page), limit, fields
+    (comma-separated), category, vendor, currency, status, date_from, date_to.
+    """
+    if not require_auth():
+        return jsonify({'error': 'Authentication required. Please log in.'}), 401
+    
+    user = get_current_user()
+    if not user:
+        return jsonify({'error': 'User not found. Please log in again.'}), 401
+    
+    try:
+        page = receipt_service.list_receipts(
+            db.session,
+            user.id,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', PAGE_SIZE, type=int),
+            filters=parse_filters(request.args),
+            fields=parse_fields(request.args.get('fields'))
+        )
+    except InvalidQuery as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page_json(page))
+
+@app.route('/api/search')
+@limiter.limit("60 per minute")
+def api_search():
+    """Full-text search over the logged-in user's receipts, best match first.
+    
+    Query args: q (every word is matched as a prefix against vendor, category
+    and OCR text), limit, category, currency, status, date_from, date_to.
+    """
+    if not require_auth():
+        return jsonify({'error': 'Authentication required. Please log in.'}), 401
+    
+    user = get_current_user()
+    if not user:
+        return jsonify({'error': 'User not found. Please log in again.'}), 401
+    
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    
+    try:
+        filters = parse_filters(request.args)
+    except InvalidQuery as e:
+        return jsonify({'error': str(e)}), 400
+    
+    start_time = time.perf_counter()
+    results = search_receipts(db.session, user.id, query, filters=filters,
+                              limit=request.args.get('limit', SEARCH_LIMIT, type=int))
+    took_ms = round((time.perf_counter() - start_time) * 1000, 1)
+    return jsonify({**page_json({'receipts': results}), 'took_ms': took_ms})
+
 @app.route('/dashboard/<int:user_id>')
 def dashboard(user_id):
     # Check authentication
@@ -219,21 +530,41 @@ def dashboard(user_id):
         return redirect(url_for('home'))
     
     try:
-        # Get recent receipts with error handling
-        receipts = Receipt.query.filter_by(user_id=user_id).order_by(Receipt.created_at.desc()).limit(20).all()
+        # First page of recent receipts; the page fetches the rest from /api/receipts
+        try:
+            filters = parse_filters(request.args)
+        except InvalidQuery as e:
+            flash(str(e), 'error')
+            filters = {}
         
-        # Calculate totals safely
-        total_amount = db.session.query(db.func.sum(Receipt.amount)).filter_by(user_id=user_id).scalar() or 0
-        total_tax = db.session.query(db.func.sum(Receipt.tax_amount)).filter_by(user_id=user_id).scalar() or 0
+        def render():
+            with metrics.timed('dashboard.receipts'):
+                page = receipt_service.list_receipts(db.session, user_id, filters=filters)
+            
+            # Totals are maintained incrementally (aggregates.py), not summed per view
+            with metrics.timed('dashboard.totals'):
+                totals = receipt_service.dashboard_totals(db.session, user_id)
+            
+            return render_template('dashboard.html', 
+                                 user=current_user, 
+                                 receipts=page['receipts'], 
+                                 next_cursor=page['next_cursor'],
+                                 filters=filters,
+                                 receipt_total=totals['receipt_total'],
+                                 total_amount=totals['total_amount'],
+                                 total_tax=totals['total_tax'],
+                                 unconverted_count=totals['unconverted_count'],
+                                 home_currency=totals['home_currency'],
+                                 category_totals=totals['category_totals'],
+                                 user_id=user_id)
         
-        app.logger.info(f"Dashboard accessed by user {current_user.email}")
+        # Unchanged receipts (same aggregate version) reuse the last render
+        version = receipt_service.data_version(db.session, user_id)
+        variant = (version, current_user.email, current_user.plan, current_user.receipt_count, sorted(request.args.items(multi=True)))
+        response = _cached_page('dashboard', variant, render, owner=user_id)
         
-        return render_template('dashboard.html', 
-                             user=current_user, 
-                             receipts=receipts, 
-                             total_amount=total_amount,
-                             total_tax=total_tax,
-                             user_id=user_id)
+        app.logger.info(f"Dashboard accessed by user {current_user.email}")
+        return response
                              
     except Exception as e:
         app.logger.error(f"Dashboard error for user {current_user.email}: {str(e)}")
@@ -254,17 +585,36 @@ def export_data(user_id):
         flash('Access denied. You can only export your own data.', 'error')
         return redirect(url_for('home'))
     
+    export_format = request.args.get('format', 'xlsx')
+    if export_format not in EXPORT_FORMATS:
+        flash('Unknown export format', 'error')
+        return redirect(url_for('dashboard', user_id=user_id))
+    
     try:
-        receipts = Receipt.query.filter_by(user_id=user_id).order_by(Receipt.date.desc()).all()
-        
-        if receipts:
-            filename = create_excel_export(receipts, user_id)
-            app.logger.info(f"Export created for user {current_user.email}: {len(receipts)} receipts")
-            return send_file(filename, as_attachment=True, 
-                           download_name=f'expenses_{datetime.now().strftime("%Y%m")}.xlsx')
-        else:
+        # The aggregate row says whether there is anything to export and which
+        # version of the user's receipts a cached file must match
+        totals = db.session.get(UserAggregate, user_id)
+        if not totals or not totals.receipt_count:
             flash('No receipts to export', 'info')
             return redirect(url_for('dashboard', user_id=user_id))
+        
+        writer, mimetype = EXPORT_FORMATS[export_format]
+        download_name = f'expenses_{datetime.now().strftime("%Y%m")}.{export_format}'
+        
+        cached = export_cache.get(user_id, totals.version, export_format)
+        metrics.count('cache.export.hit' if cached else 'cache.export.miss')
+        if cached:
+            app.logger.info(f"Serving cached {export_format} export for user {current_user.email}")
+            return send_file(cached, mimetype=mimetype, as_attachment=True, download_name=download_name)
+        
+        # Only the exported columns, fetched in batches as the response streams
+        rows = receipt_service.export_rows(db.session, user_id)
+        app.logger.info(f"Streaming {export_format} export for user {current_user.email}")
+        return Response(
+            stream_with_context(export_cache.store(user_id, totals.version, export_format, writer(rows))),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={download_name}'}
+        )
             
     except Exception as e:
         app.logger.error(f"Export error for user {current_user.email}: {str(e)}")
@@ -273,7 +623,8 @@ def export_data(user_id):
 
 @app.route('/pricing')
 def pricing():
-    return render_template('pricing.html')
+    # Static apart from the signed-in email in the navigation bar
+    return _cached_page('pricing', session.get('user_email'), lambda: render_template('pricing.html'))
 
 @app.errorhandler(413)
 def too_large(e):
@@ -0,0 +1,169 @@
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from storage import MAX_UPLOAD_SIZE
+import image_store
+
+# Month-end bulk imports: receipts are extracted in parallel across cores.
+# Tesseract is CPU-bound, so processes (not threads) are what scale here, and
+# each pool process keeps its own warm OCR engine. Structuring happens back in
+# this process once the texts are in, so model requests can be batched across
+# receipts.
+
+BATCH_WORKERS = int(os.environ.get("BATCH_OCR_WORKERS", os.cpu_count() or 2))
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", "200"))
+MAX_MEMBER_SIZE = MAX_UPLOAD_SIZE  # same cap as a single upload
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+
+_pool = None
+
+def _init_worker():
+    # An initializer that raises kills the pool process, so a missing engine
+    # must not escape here; scans create it lazily and fail per receipt
+    from ocr_processor import warm_engine
+    try:
+        warm_engine()
+    except Exception as e:
+        print(f"Error warming OCR engine: {str(e)}")
+
+def _get_pool():
+    """Process pool shared by all batches handled by this process"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS, initializer=_init_worker)
+    return _pool
+
+def _reset_pool(pool):
+    """Drop a pool whose worker died (OOM, a crash in the engine); the next
+    _get_pool() starts a fresh one"""
+    global _pool
+    if _pool is pool:
+        _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _scan_all(keys, retry=True):
+    """Scan every key on the pool: [(scan, seconds, timings) or Exception].
+    Keys lost to a broken pool are retried once on a fresh pool."""
+    pool = _get_pool()
+    futures = []
+    for key in keys:
+        try:
+            futures.append(pool.submit(_scan_timed, key))
+        except BrokenProcessPool as e:
+            futures.append(e)
+    scans = []
+    broken = []
+    for index, future in enumerate(futures):
+        try:
+            if isinstance(future, Exception):
+                raise future
+            scans.append(future.result())
+        except BrokenProcessPool as e:
+            scans.append(e)
+            broken.append(index)
+        except Exception as e:
+            scans.append(e)
+    if broken:
+        print(f"OCR worker pool broke; {'retrying' if retry else 'giving up on'} {len(broken)} receipts")
+        _reset_pool(pool)
+        if retry:
+            for index, scan in zip(broken, _scan_all([keys[i] for i in broken], retry=False)):
+                scans[index] = scan
+    return scans
+
+def _extension(name):
+    return name.rsplit('.', 1)[1].lower() if '.' in name else ''
+
+def expand_uploads(files):
+    """Yield (name, stream, error) for each image in the uploaded files,
+    unpacking ZIP archives. error is set (and stream None) for entries that
+    were skipped. ZIP members are read straight out of the archive, so each
+    stream must be consumed before the next entry is requested."""
+    count = 0
+    for file in files:
+        if count >= MAX_BATCH_FILES:
+            yield file.filename, None, f'Batch limit of {MAX_BATCH_FILES} receipts reached'
+            continue
+        ext = _extension(file.filename)
+        if ext in IMAGE_EXTENSIONS:
+            count += 1
+            yield file.filename, file.stream, None
+        elif ext == 'zip':
+            try:
+                archive = zipfile.ZipFile(file.stream)
+            except zipfile.BadZipFile:
+                yield file.filename, None, 'Invalid ZIP archive'
+                continue
+            with archive:
+                for info in archive.infolist():
+                    name = os.path.basename(info.filename)
+                    if info.is_dir() or not name or name.startswith('.') or _extension(name) not in IMAGE_EXTENSIONS:
+                        continue
+                    if count >= MAX_BATCH_FILES:
+                        yield name, None, f'Batch limit of {MAX_BATCH_FILES} receipts reached'
+                        continue
+                    # The declared size is checked up front; the real size is
+                    # capped again while the member is copied out
+                    if info.file_size > MAX_MEMBER_SIZE:
+                        yield name, None, 'File too large'
+                        continue
+                    count += 1
+                    with archive.open(info) as member:
+                        yield name, member, None
+        else:
+            yield file.filename, None, 'Invalid file format. Please upload PNG, JPG or ZIP.'
+
+def _scan_timed(key):
+    # Runs in a pool process: OCR reads the staged original, which is then
+    # archived here rather than on the request path
+    from ocr_processor import scan_receipt, extract_fallback
+    start_time = time.time()
+    timings = {}
+    try:
+        with image_store.open_image(key) as image:
+            scan = scan_receipt(image, content_hash=image_store.content_hash(key), timings=timings)
+    except Exception as e:
+        # Same outcome as extract_receipt_data for an unreadable image
+        print(f"Error in extract_receipt_data: {str(e)}")
+        scan = {'ocr_text': '', 'result': extract_fallback("")}
+    # A receipt whose image cannot be archived is reported as failed
+    archive_start = time.time()
+    image_store.promote(key)
+    timings['archive'] = time.time() - archive_start
+    # Stage timings travel back so they are recorded in this (the web) process
+    return scan, time.time() - start_time, timings
+
+def extract_batch(keys):
+    """Extract receipt data for stored images (image_store keys) in parallel
+    and archive them; save receipts under image_store.archived_key(key).
+    Returns [(data, seconds, error, ocr_text), ...] in input order."""
+    from ocr_processor import structure_scans, record_scan
+    if not keys:
+        return []
+    scans = _scan_all(keys)
+    
+    # One structuring pass for the whole batch; its time is shared out evenly
+    ready = [entry[0] for entry in scans if not isinstance(entry, Exception)]
+    for entry in scans:
+        if not isinstance(entry, Exception):
+            record_scan(entry[0], entry[2])
+    start_time = time.time()
+    try:
+        structure_scans(ready)
+        error = None
+    except Exception as e:
+        error = str(e)
+    structure_seconds = (time.time() - start_time) / len(ready) if ready else 0.0
+    
+    results = []
+    for entry in scans:
+        if isinstance(entry, Exception):
+            results.append((None, 0.0, str(entry), None))
+            continue
+        scan, seconds, _ = entry
+        data = scan.get('result')
+        results.append((data, seconds + structure_seconds, error or (None if data else 'Could not process receipt'), scan['ocr_text']))
+    return results
@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime, date, timedelta
+
+import pandas as pd
+
+# Benchmark: export frame building and summaries, columnar/groupby version
+# vs. the original per-receipt loop (kept below as legacy_summaries).
+#
+#     python benchmarks/bench_export.py --rows 10000,100000,1000000
+#
+# Rows are shaped like the export query result (Receipt attributes). Only
+# data preparation and summaries are timed; --write also times writing the
+# workbook, which dominates at large sizes and is the same for both.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from export_utils import receipts_frame, export_summaries, stream_excel_export  # noqa: E402
+
+Row = namedtuple('Row', 'vendor amount currency date category tax_amount created_at home_amount', defaults=[None])
+
+CATEGORIES = ['Food', 'Travel', 'Office', 'Entertainment', 'Other', None]
+CURRENCIES = ['USD', 'USD', 'USD', 'EUR', 'INR', 'GBP']
+
+def make_rows(count, seed=0):
+    rng = random.Random(seed)
+    start = date(2022, 1, 1)
+    uploaded = datetime(2024, 1, 1)
+    return [
+        Row(
+            f'Vendor {rng.randrange(500)}',
+            round(rng.uniform(1, 500), 2),
+            rng.choice(CURRENCIES),
+            start + timedelta(days=rng.randrange(1000)) if rng.random() > 0.02 else None,
+            rng.choice(CATEGORIES),
+            round(rng.uniform(0, 40), 2),
+            uploaded
+        )
+        for _ in range(count)
+    ]
+
+# --- Original implementation (data preparation and summaries), for comparison only ---
+
+def legacy_summaries(receipts):
+    receipts_data = []
+    for receipt in receipts:
+        if isinstance(receipt, dict):
+            receipts_data.append({
+                'Vendor': receipt.get('vendor', receipt.get('Vendor', '')),
+                'Amount': receipt.get('amount', receipt.get('Amount', 0)),
+                'Date': receipt.get('date', receipt.get('Date', '')),
+                'Category': receipt.get('category', receipt.get('Category', '')),
+                'Tax': receipt.get('tax', receipt.get('Tax', 0)),
+                'Uploaded': receipt.get('uploaded', receipt.get('Uploaded', datetime.now().strftime('%Y-%m-%d %H:%M')))
+            })
+        else:
+            receipts_data.append({
+                'Vendor': receipt.vendor,
+                'Amount': receipt.amount,
+                'Date': receipt.date,
+                'Category': receipt.category,
+                'Tax': receipt.tax_amount,
+                'Uploaded': receipt.created_at.strftime('%Y-%m-%d %H:%M') if hasattr(receipt, 'created_at') else ''
+            })
+    df = pd.DataFrame(receipts_data)
+    totals = pd.DataFrame([{
+        'Vendor': 'TOTAL',
+        'Amount': df['Amount'].sum() if not df.empty else 0,
+        'Date': '',
+        'Category': '',
+        'Tax': df['Tax'].sum() if not df.empty else 0,
+        'Uploaded': ''
+    }])
+    df = pd.concat([df, totals], ignore_index=True)
+    summary_df = df[df['Vendor'] != 'TOTAL'].groupby('Category')['Amount'].sum().reset_index()
+    summary_df = summary_df.sort_values('Amount', ascending=False)
+    monthly_data = df[df['Vendor'] != 'TOTAL'].copy()
+    monthly_data['Month'] = pd.to_datetime(monthly_data['Date'], errors='coerce').dt.to_period('M')
+    monthly_summary = monthly_data.groupby('Month')['Amount'].sum().reset_index()
+    monthly_summary['Month'] = monthly_summary['Month'].astype(str)
+    return df, summary_df, monthly_summary
+
+def current_summaries(receipts):
+    frame = receipts_frame(receipts)
+    return frame, export_summaries(frame)
+
+def _measure(func, rows):
+    """(seconds, peak traced bytes); timed separately since tracing slows Python code"""
+    start_time = time.perf_counter()
+    func(rows)
+    seconds = time.perf_counter() - start_time
+    tracemalloc.start()
+    func(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark export summaries')
+    parser.add_argument('--rows', default='10000,100000,1000000', help='comma-separated row counts')
+    parser.add_argument('--write', action='store_true', help='also time stream_excel_export end to end (slow)')
+    args = parser.parse_args()
+
+    results = []
+    for count in [int(n) for n in args.rows.split(',') if n.strip()]:
+        rows = make_rows(count)
+        legacy, legacy_peak = _measure(legacy_summaries, rows)
+        current, current_peak = _measure(current_summaries, rows)
+        result = {
+            'rows': count,
+            'legacy_s': round(legacy, 3),
+            'current_s': round(current, 3),
+            'speedup': round(legacy / current, 2),
+            'legacy_peak_mb': round(legacy_peak / 2 ** 20, 1),
+            'current_peak_mb': round(current_peak / 2 ** 20, 1)
+        }
+        if args.write:
+            start_time = time.perf_counter()
+            for _ in stream_excel_export(rows):
+                pass
+            result['write_s'] = round(time.perf_counter() - start_time, 3)
+        results.append(result)
+        print(json.dumps(result), flush=True)
+
+if __name__ == '__main__':
+    main()
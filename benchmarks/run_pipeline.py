@@ -0,0 +1,336 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+# Speed and accuracy benchmark for the receipt extraction pipeline.
+#
+#     python benchmarks/run_pipeline.py --stub --workers 1,2,4 --output bench.json
+#     python benchmarks/run_pipeline.py --baseline bench.json
+#
+# Measures per-stage latency (load, preprocessing, OCR, structuring), the
+# regex and model structuring paths on their own, end-to-end throughput at
+# N worker processes, peak RSS and field-level accuracy against the ground
+# truth in corpus.json. With the model enabled (e.g. --stub) it also measures
+# micro-batched structuring throughput and tokens per receipt at each
+# --llm-batch-sizes. Per-receipt OCR latency is measured for each of
+# --ocr-engines with a cold engine (created for every receipt) and a warm one
+# (created once and reused). Extraction caches are disabled for the run.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus.json')
+FIELDS = ['vendor', 'amount', 'currency', 'date', 'category', 'tax']
+
+def load_corpus(path=CORPUS_PATH):
+    with open(path) as f:
+        corpus = json.load(f)
+    for item in corpus:
+        item['image'] = os.path.join(ROOT, item['image'])
+    return corpus
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def _normalize(value):
+    return ''.join(ch for ch in str(value or '').casefold() if ch.isalnum())
+
+def field_matches(field, expected, actual):
+    """Whether an extracted field agrees with the ground truth"""
+    if field in ('amount', 'tax'):
+        try:
+            return abs(float(actual or 0) - float(expected or 0)) <= 0.01
+        except (TypeError, ValueError):
+            return False
+    if field == 'vendor':
+        want, got = _normalize(expected), _normalize(actual)
+        return bool(got) and (want in got or (len(got) >= 4 and got in want))
+    return str(actual) == str(expected)
+
+def score(expected, actual):
+    """{field: bool} for every field with a ground-truth value"""
+    return {
+        field: field_matches(field, expected[field], (actual or {}).get(field))
+        for field in FIELDS if expected.get(field) is not None
+    }
+
+def summarize(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'mean': round(statistics.fmean(ordered), 6),
+        'p50': round(ordered[len(ordered) // 2], 6),
+        'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 6),
+        'max': round(ordered[-1], 6)
+    }
+
+def profile_stages(corpus, repeat):
+    """Run each stage separately for every image. Runs in a fresh process
+    so peak RSS reflects this pass alone."""
+    import ocr_processor
+
+    engine = ocr_processor.get_engine()
+    use_ai = ocr_processor.openai_client is not None
+    stages = {}
+    images = []
+    texts = []
+
+    def record(name, seconds):
+        stages.setdefault(name, []).append(seconds)
+
+    for item in corpus:
+        entry = {'image': os.path.relpath(item['image'], ROOT)}
+        try:
+            for _ in range(repeat):
+                timings = {}
+                start_time = time.perf_counter()
+                image = ocr_processor.load_image(item['image'])
+                timings['load'] = time.perf_counter() - start_time
+                image = ocr_processor.preprocess_image(image, timings=timings)
+
+                start_time = time.perf_counter()
+                text = engine.text(image)
+                timings['ocr'] = time.perf_counter() - start_time
+
+                start_time = time.perf_counter()
+                fallback = ocr_processor.extract_fallback(text)
+                timings['structure.fallback'] = time.perf_counter() - start_time
+
+                structured = fallback
+                if use_ai:
+                    start_time = time.perf_counter()
+                    structured = ocr_processor.extract_with_ai(text)
+                    timings['structure.ai'] = time.perf_counter() - start_time
+
+                for name, seconds in timings.items():
+                    record(name, seconds)
+                record('preprocess', sum(v for k, v in timings.items() if k.startswith('preprocess.')))
+            texts.append(text)
+            entry['result'] = structured
+            entry['accuracy'] = score(item['expected'], structured)
+            entry['fallback_accuracy'] = score(item['expected'], fallback)
+        except Exception as e:
+            entry['error'] = str(e)
+        images.append(entry)
+
+    return {
+        'stages': {name: summarize(samples) for name, samples in sorted(stages.items())},
+        'images': images,
+        'peak_rss_mb': _peak_rss_mb(),
+        'structuring': 'ai' if use_ai else 'fallback',
+        'texts': texts
+    }
+
+def _warm(_):
+    import ocr_processor  # noqa: F401
+    return os.getpid()
+
+def _extract_one(image_path):
+    from ocr_processor import extract_receipt_data
+    start_time = time.perf_counter()
+    extract_receipt_data(image_path)
+    return time.perf_counter() - start_time, _peak_rss_mb()
+
+def measure_throughput(corpus, workers, repeat):
+    """End-to-end extract_receipt_data over the corpus with N processes"""
+    paths = [item['image'] for item in corpus] * repeat
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Exclude process start-up and imports from the timed section
+        list(pool.map(_warm, range(workers)))
+        start_time = time.perf_counter()
+        results = list(pool.map(_extract_one, paths))
+        wall_time = time.perf_counter() - start_time
+    return {
+        'workers': workers,
+        'receipts': len(paths),
+        'seconds': round(wall_time, 4),
+        'receipts_per_sec': round(len(paths) / wall_time, 3) if wall_time else None,
+        'latency': summarize([seconds for seconds, _ in results]),
+        'peak_rss_mb_per_worker': max(rss for _, rss in results) if results else None
+    }
+
+def measure_structuring(texts, batch_size, repeat):
+    """Model structuring of all corpus OCR texts submitted at once, at most
+    batch_size receipts per request (as a bulk import does)"""
+    import ocr_processor
+    from llm_client import MicroBatcher
+
+    ocr_processor._batcher = MicroBatcher(ocr_processor._structure_batch, max_batch_size=batch_size)
+    texts = texts * repeat
+    before = ocr_processor.llm.stats()
+    start_time = time.perf_counter()
+    outcomes = ocr_processor._structure_texts_with_ai(texts)
+    wall_time = time.perf_counter() - start_time
+    after = ocr_processor.llm.stats()
+    return {
+        'batch_size': batch_size,
+        'receipts': len(texts),
+        'requests': after['calls'] - before['calls'],
+        'failed': sum(isinstance(outcome, Exception) for outcome in outcomes),
+        'seconds': round(wall_time, 4),
+        'receipts_per_sec': round(len(texts) / wall_time, 3) if wall_time else None,
+        'prompt_tokens_per_receipt': round((after['prompt_tokens'] - before['prompt_tokens']) / len(texts), 1),
+        'completion_tokens_per_receipt': round((after['completion_tokens'] - before['completion_tokens']) / len(texts), 1)
+    }
+
+def measure_ocr_engine(corpus, name, repeat):
+    """Per-receipt OCR latency with a new engine for every receipt (cold) and
+    with one engine reused across receipts (warm)"""
+    import ocr_processor
+
+    try:
+        ocr_processor.create_engine(name).close()
+    except ImportError:
+        return {'engine': name, 'error': 'not installed'}
+    images = [ocr_processor.preprocess_image(ocr_processor.load_image(item['image'])) for item in corpus] * repeat
+
+    cold = []
+    for image in images:
+        start_time = time.perf_counter()
+        engine = ocr_processor.create_engine(name)
+        engine.text(image)
+        cold.append(time.perf_counter() - start_time)
+        engine.close()
+
+    engine = ocr_processor.create_engine(name)
+    engine.text(images[0])
+    warm = []
+    for image in images:
+        start_time = time.perf_counter()
+        engine.text(image)
+        warm.append(time.perf_counter() - start_time)
+    engine.close()
+    return {'engine': name, 'cold': summarize(cold), 'warm': summarize(warm)}
+
+def accuracy_report(images, key):
+    per_field = {}
+    for entry in images:
+        for field, ok in entry.get(key, {}).items():
+            per_field.setdefault(field, []).append(ok)
+    report = {field: round(sum(oks) / len(oks), 4) for field, oks in per_field.items()}
+    all_checks = [ok for oks in per_field.values() for ok in oks]
+    report['overall'] = round(sum(all_checks) / len(all_checks), 4) if all_checks else None
+    return report
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+def compare(current, baseline):
+    """Print stage latency and accuracy deltas against an earlier run"""
+    print(f"\nCompared with {baseline['meta'].get('revision')} ({baseline['meta'].get('timestamp')}):")
+    for name, stats in current['stages'].items():
+        before = baseline.get('stages', {}).get(name)
+        if stats and before:
+            change = (stats['p50'] - before['p50']) / before['p50'] * 100 if before['p50'] else 0.0
+            print(f"  {name:<24} p50 {before['p50'] * 1000:9.2f}ms -> {stats['p50'] * 1000:9.2f}ms ({change:+.1f}%)")
+    for key in ('accuracy', 'fallback_accuracy'):
+        before = baseline.get(key, {}).get('overall')
+        after = current.get(key, {}).get('overall')
+        if before is not None and after is not None:
+            print(f"  {key:<24} {before:.3f} -> {after:.3f}")
+    before_tp = {t['workers']: t for t in baseline.get('throughput', [])}
+    for tp in current['throughput']:
+        if tp['workers'] in before_tp:
+            print(f"  throughput @{tp['workers']:<3} workers {before_tp[tp['workers']]['receipts_per_sec']} -> {tp['receipts_per_sec']} receipts/s")
+    before_engines = {e['engine']: e for e in baseline.get('ocr_engines', []) if 'warm' in e}
+    for engine in current.get('ocr_engines', []):
+        before = before_engines.get(engine['engine'])
+        if before and 'warm' in engine:
+            print(f"  ocr {engine['engine']:<20} cold p50 {before['cold']['p50'] * 1000:.1f}ms -> {engine['cold']['p50'] * 1000:.1f}ms, "
+                  f"warm p50 {before['warm']['p50'] * 1000:.1f}ms -> {engine['warm']['p50'] * 1000:.1f}ms")
+    before_batches = {b['batch_size']: b for b in baseline.get('llm_batching', [])}
+    for batch in current.get('llm_batching', []):
+        before = before_batches.get(batch['batch_size'])
+        if before:
+            print(f"  llm batch of {batch['batch_size']:<3} {before['receipts_per_sec']} -> {batch['receipts_per_sec']} receipts/s, "
+                  f"{before['prompt_tokens_per_receipt']} -> {batch['prompt_tokens_per_receipt']} prompt tokens/receipt")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark receipt extraction speed and accuracy')
+    parser.add_argument('--corpus', default=CORPUS_PATH)
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated worker counts for the throughput runs')
+    parser.add_argument('--repeat', type=int, default=3, help='passes over the corpus per measurement')
+    parser.add_argument('--stub', action='store_true', help='route model calls to a local stub API server')
+    parser.add_argument('--stub-latency', type=float, default=0.5, help='seconds the stub waits per request')
+    parser.add_argument('--llm-batch-sizes', default='1,4,8', help='comma-separated receipts per model request to measure')
+    parser.add_argument('--ocr-engines', default='pytesseract,tesserocr', help='comma-separated OCR engines to time cold and warm')
+    parser.add_argument('--output', help='write results JSON here (default: stdout)')
+    parser.add_argument('--baseline', help='earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    # Configure the environment before ocr_processor is imported anywhere,
+    # including in the worker processes that inherit it
+    os.environ['EXTRACTION_CACHE_ENABLED'] = '0'
+    os.environ['LLM_CACHE_ENABLED'] = '0'
+    server = None
+    if args.stub:
+        from benchmarks.stub_openai import start_stub_server
+        server, base_url = start_stub_server(latency=args.stub_latency)
+        os.environ['OPENAI_BASE_URL'] = base_url
+        os.environ['OPENAI_API_KEY'] = 'stub'
+
+    corpus = load_corpus(args.corpus)
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        stages = pool.submit(profile_stages, corpus, args.repeat).result()
+
+    import ocr_processor
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'extractor_version': ocr_processor.EXTRACTOR_VERSION,
+            'pipeline': ocr_processor.OCR_PREPROCESS,
+            'ocr_engine': ocr_processor.get_engine().name,
+            'ocr_lang': ocr_processor.OCR_LANG,
+            'ocr_psm': ocr_processor.OCR_PSM,
+            'structuring': stages['structuring'],
+            'stub': args.stub,
+            'corpus_size': len(corpus),
+            'repeat': args.repeat
+        },
+        'stages': stages['stages'],
+        'peak_rss_mb': stages['peak_rss_mb'],
+        'throughput': [measure_throughput(corpus, int(n), args.repeat) for n in args.workers.split(',') if n.strip()],
+        'ocr_engines': [measure_ocr_engine(corpus, name.strip(), args.repeat) for name in args.ocr_engines.split(',') if name.strip()],
+        'accuracy': accuracy_report(stages['images'], 'accuracy'),
+        'fallback_accuracy': accuracy_report(stages['images'], 'fallback_accuracy'),
+        'images': stages['images']
+    }
+    if stages['structuring'] == 'ai':
+        results['llm_batching'] = [
+            measure_structuring(stages['texts'], int(n), args.repeat)
+            for n in args.llm_batch_sizes.split(',') if n.strip()
+        ]
+    if server:
+        server.shutdown()
+
+    payload = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(payload)
+        print(f"Wrote {args.output}")
+    else:
+        print(payload)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the OpenAI chat completions API so benchmarks never pay
+# for (or wait on) the real service. Point the app at it with
+#     OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 OPENAI_API_KEY=stub
+# Responses are built by running the regex parser over the OCR text embedded
+# in the prompt (or over each receipt of a batched prompt), after an optional
+# artificial latency / error rate.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _ocr_text(prompt):
+    """Pull the OCR text back out of the extraction prompt"""
+    start = prompt.find('return as JSON:\n')
+    end = prompt.find('\n\nReturn only JSON')
+    if start == -1 or end == -1:
+        return prompt
+    return prompt[start + len('return as JSON:\n'):end]
+
+_BATCH_SEPARATOR = re.compile(r'^--- Receipt \d+ ---$', re.MULTILINE)
+
+def _completion(prompt):
+    """JSON content the real model would be asked for"""
+    from ocr_processor import extract_fallback
+
+    text = _ocr_text(prompt)
+    if _BATCH_SEPARATOR.match(text):
+        receipts = [part.strip('\n') for part in _BATCH_SEPARATOR.split(text)[1:]]
+        return json.dumps({'receipts': [extract_fallback(receipt) for receipt in receipts]})
+    return json.dumps(extract_fallback(text))
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    error_rate = 0.0
+    requests = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        type(self).requests += 1
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if not self.path.endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self._send_json(random.choice([429, 500, 503]), {'error': {'message': 'Stubbed failure', 'type': 'server_error'}})
+            return
+
+        prompt = request['messages'][-1]['content']
+        content = _completion(prompt)
+        prompt_tokens = sum(len(m['content']) for m in request['messages']) // 4
+        completion_tokens = len(content) // 4
+        self._send_json(200, {
+            'id': f'chatcmpl-stub-{self.requests}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'stub'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens
+            }
+        })
+
+def start_stub_server(port=0, latency=0.0, error_rate=0.0):
+    """Serve the stub on a background thread; returns (server, base_url)"""
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'latency': latency, 'error_rate': error_rate})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local stub of the OpenAI chat completions API')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to sleep per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 429/5xx')
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(args.port, args.latency, args.error_rate)
+    print(f"Stub OpenAI API listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
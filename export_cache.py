@@ -0,0 +1,110 @@
+import os
+import re
+import tempfile
+
+# Built export files, reused while the user's receipts are unchanged.
+# Artifacts are keyed by user and UserAggregate.version (bumped on every
+# receipt change, see aggregates.py), so a hit never needs to look at the
+# receipts at all. The directory is bounded by file count and bytes, evicting
+# the least recently served artifact; a hit refreshes the file's mtime.
+
+LAYOUT_VERSION = "3"  # bump when the export format changes
+
+_ARTIFACT = re.compile(r'^expenses_(\d+)_v(\d+)_l\w+\.(\w+)$')
+
+class ExportCache:
+    def __init__(self, folder, max_files=200, max_bytes=512 * 1024 * 1024, enabled=True):
+        self.folder = folder
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+    def path(self, user_id, version, export_format):
+        return os.path.join(self.folder, f"expenses_{user_id}_v{version}_l{LAYOUT_VERSION}.{export_format}")
+
+    def get(self, user_id, version, export_format):
+        """Path of a ready artifact, or None"""
+        if not self.enabled:
+            return None
+        path = self.path(user_id, version, export_format)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def store(self, user_id, version, export_format, chunks):
+        """Pass chunks through while saving them; the artifact only becomes
+        visible once the whole stream has been written"""
+        if not self.enabled:
+            yield from chunks
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in chunks:
+                    out.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, self.path(user_id, version, export_format))
+        except BaseException:
+            # Includes GeneratorExit when the client disconnects mid-download
+            os.remove(tmp_path)
+            raise
+        self._drop_superseded(user_id, version, export_format)
+        self._evict()
+
+    def _artifacts(self):
+        try:
+            names = os.listdir(self.folder)
+        except FileNotFoundError:
+            return []
+        artifacts = []
+        for name in names:
+            match = _ARTIFACT.match(name)
+            if match:
+                artifacts.append((name, int(match.group(1)), int(match.group(2)), match.group(3)))
+        return artifacts
+
+    def _drop_superseded(self, user_id, version, export_format):
+        """Older versions of the same export can never be served again"""
+        for name, owner, artifact_version, artifact_format in self._artifacts():
+            if owner == user_id and artifact_format == export_format and artifact_version < version:
+                self._remove(name)
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.folder, name))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        files = []
+        for name, *_ in self._artifacts():
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        while files and (len(files) > self.max_files or total > self.max_bytes):
+            _, size, name = files.pop(0)
+            self._remove(name)
+            total -= size
+
+    def stats(self):
+        sizes = []
+        for name, *_ in self._artifacts():
+            try:
+                sizes.append(os.path.getsize(os.path.join(self.folder, name)))
+            except FileNotFoundError:
+                pass
+        return {'files': len(sizes), 'bytes': sum(sizes)}
+
+export_cache = ExportCache(
+    os.environ.get("EXPORT_CACHE_DIR", "exports/cache"),
+    max_files=int(os.environ.get("EXPORT_CACHE_MAX_FILES", "200")),
+    max_bytes=int(os.environ.get("EXPORT_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),
+    enabled=os.environ.get("EXPORT_CACHE_ENABLED", "1") == "1",
+)
@@ -1,91 +1,250 @@
 import pandas as pd
-from datetime import datetime
-import os
-
-def create_excel_export(receipts, user_id):
-    """Create Excel export from receipts data. Handles both Receipt objects and dicts."""
-    try:
-        # Convert receipts to list of dictionaries
-        receipts_data = []
-        for receipt in receipts:
-            if isinstance(receipt, dict):
-                # For free users (dicts)
-                receipts_data.append({
-                    'Vendor': receipt.get('vendor', receipt.get('Vendor', '')),
-                    'Amount': receipt.get('amount', receipt.get('Amount', 0)),
-                    'Date': receipt.get('date', receipt.get('Date', '')),
-                    'Category': receipt.get('category', receipt.get('Category', '')),
-                    'Tax': receipt.get('tax', receipt.get('Tax', 0)),
-                    'Uploaded': receipt.get('uploaded', receipt.get('Uploaded', datetime.now().strftime('%Y-%m-%d %H:%M')))
-                })
-            else:
-                # For logged-in users (Receipt objects)
-                receipts_data.append({
-                    'Vendor': receipt.vendor,
-                    'Amount': receipt.amount,
-                    'Date': receipt.date,
-                    'Category': receipt.category,
-                    'Tax': receipt.tax_amount,
-                    'Uploaded': receipt.created_at.strftime('%Y-%m-%d %H:%M') if hasattr(receipt, 'created_at') else ''
-                })
-        
-        # Convert to DataFrame
-        df = pd.DataFrame(receipts_data)
-        
-        if df.empty:
-            # Create empty DataFrame with proper columns
-            df = pd.DataFrame(columns=['Vendor', 'Amount', 'Date', 'Category', 'Tax', 'Uploaded'])
-        
-        # Add totals row
-        totals = pd.DataFrame([{
-            'Vendor': 'TOTAL',
-            'Amount': df['Amount'].sum() if not df.empty else 0,
-            'Date': '',
-            'Category': '',
-            'Tax': df['Tax'].sum() if not df.empty else 0,
-            'Uploaded': ''
-        }])
-        
-        df = pd.concat([df, totals], ignore_index=True)
-        
-        # Create Excel file
-        filename = f'exports/expenses_{user_id}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        os.makedirs('exports', exist_ok=True)
-        
-        with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-            # Main expenses sheet
-            df.to_excel(writer, sheet_name='Expenses', index=False)
-            
-            # Category summary sheet (only if we have data)
-            if not df.empty and len(df) > 1:  # More than just the totals row
-                summary_df = df[df['Vendor'] != 'TOTAL'].groupby('Category')['Amount'].sum().reset_index()
-                summary_df = summary_df.sort_values('Amount', ascending=False)
-                summary_df.to_excel(writer, sheet_name='Category Summary', index=False)
-            
-            # Monthly summary if we have multiple dates
-            if not df.empty and len(df) > 1:
-                monthly_data = df[df['Vendor'] != 'TOTAL'].copy()
-                if not monthly_data.empty:
-                    # Convert date strings to datetime for grouping
-                    monthly_data['Month'] = pd.to_datetime(monthly_data['Date'], errors='coerce').dt.to_period('M')
-                    monthly_summary = monthly_data.groupby('Month')['Amount'].sum().reset_index()
-                    monthly_summary['Month'] = monthly_summary['Month'].astype(str)
-                    monthly_summary.to_excel(writer, sheet_name='Monthly Summary', index=False)
-        
-        return filename
-        
-    except Exception as e:
-        print(f"Error creating Excel export: {str(e)}")
-        # Create a basic CSV as fallback
-        filename = f'exports/expenses_{user_id}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        
-        # Simple CSV creation
-        with open(filename, 'w') as f:
-            f.write('Vendor,Amount,Date,Category,Tax,Uploaded\n')
-            for receipt in receipts:
-                if isinstance(receipt, dict):
-                    f.write(f'"{receipt.get("vendor", receipt.get("Vendor", ""))}",{receipt.get("amount", receipt.get("Amount", 0))},{receipt.get("date", receipt.get("Date", ""))},{receipt.get("category", receipt.get("Category", ""))},{receipt.get("tax", receipt.get("Tax", 0))},{receipt.get("uploaded", receipt.get("Uploaded", datetime.now().strftime("%Y-%m-%d %H:%M")))}\n')
-                else:
-                    f.write(f'"{receipt.vendor}",{receipt.amount},{receipt.date},{receipt.category},{receipt.tax_amount},{receipt.created_at.strftime("%Y-%m-%d %H:%M") if hasattr(receipt, "created_at") else ""}\n')
-        
-        return filename
+import io
+import csv
+import time
+import operator
+import tempfile
+from openpyxl import Workbook
+import fx_rates
+
+# Amounts stay in their own currency; HOME_AMOUNT_COLUMN adds each one in the
+# home currency so the export has one meaningful grand total
+HOME_AMOUNT_COLUMN = f'Amount ({fx_rates.HOME_CURRENCY})'
+EXPORT_COLUMNS = ['Vendor', 'Amount', 'Currency', 'Date', 'Category', 'Tax', HOME_AMOUNT_COLUMN, 'Uploaded']
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Where each export column comes from on a Receipt (or query row) ...
+_ATTRIBUTES = {
+    'Vendor': 'vendor', 'Amount': 'amount', 'Currency': 'currency', 'Date': 'date',
+    'Category': 'category', 'Tax': 'tax_amount', 'Uploaded': 'created_at'
+}
+# ... and in dict records: extractor output, or the dashboard's display columns
+_DICT_KEYS = {
+    'Vendor': ['vendor', 'Vendor'],
+    'Amount': ['amount', 'Amount'],
+    'Currency': ['currency', 'Currency'],
+    'Date': ['date', 'Date'],
+    'Category': ['category', 'Category'],
+    'Tax': ['tax', 'Tax', 'tax_amount', 'Tax Amount'],
+    'Uploaded': ['uploaded', 'Uploaded', 'created_at']
+}
+
+# Instrumentation hooks, called as hook(name, seconds) once an export has
+# been generated. Nothing is timed while none are registered.
+_hooks = []
+
+def add_hook(hook):
+    _hooks.append(hook)
+
+def _emit(name, value=None):
+    for hook in _hooks:
+        hook(name, value)
+
+def _timed_chunks(name, chunks):
+    """Pass chunks through, reporting the time spent producing them (not the
+    time the consumer spent between chunks)"""
+    busy = 0.0
+    iterator = iter(chunks)
+    while True:
+        start_time = time.perf_counter()
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            busy += time.perf_counter() - start_time
+        yield chunk
+    _emit(name, busy)
+
+def _coalesce(raw, keys):
+    column = None
+    for key in keys:
+        if key in raw:
+            column = raw[key] if column is None else column.fillna(raw[key])
+    return column if column is not None else pd.Series(None, index=raw.index, dtype=object)
+
+def receipts_frame(receipts):
+    """One column per export field, built from a DataFrame, dict records,
+    or Receipt objects / query rows"""
+    if isinstance(receipts, pd.DataFrame):
+        raw = receipts
+    else:
+        receipts = list(receipts)
+        if receipts and not isinstance(receipts[0], dict):
+            getter = operator.attrgetter(*_ATTRIBUTES.values())
+            raw = pd.DataFrame.from_records(map(getter, receipts), columns=list(_ATTRIBUTES))
+        else:
+            raw = pd.DataFrame.from_records(receipts)
+    
+    if all(column in raw for column in _ATTRIBUTES):
+        frame = raw[list(_ATTRIBUTES)].copy()
+    else:
+        frame = pd.DataFrame({column: _coalesce(raw, keys) for column, keys in _DICT_KEYS.items()}, index=raw.index)
+    
+    frame['Amount'] = pd.to_numeric(frame['Amount'], errors='coerce').fillna(0.0)
+    frame['Tax'] = pd.to_numeric(frame['Tax'], errors='coerce').fillna(0.0)
+    frame['Currency'] = frame['Currency'].fillna('USD')
+    frame['Date'] = pd.to_datetime(frame['Date'], errors='coerce')
+    # One vectorized rate lookup per currency rather than per receipt
+    frame[HOME_AMOUNT_COLUMN] = fx_rates.get_rates().convert_many(frame['Amount'], frame['Currency'], frame['Date'])
+    # Kept as datetimes (rendered by the Excel writer's format) rather than
+    # formatted per element into strings
+    frame['Uploaded'] = pd.to_datetime(frame['Uploaded'], errors='coerce').dt.floor('min').fillna(pd.Timestamp.now().floor('min'))
+    return frame[EXPORT_COLUMNS].reset_index(drop=True)
+
+def export_summaries(frame):
+    """Per-currency, category and monthly totals from a single groupby over
+    (currency, category, month); the roll-ups only touch the grouped result"""
+    grouped = (
+        frame.assign(Month=frame['Date'].dt.to_period('M'), Receipts=1)
+        .groupby(['Currency', 'Category', 'Month'], dropna=False, observed=True)[['Receipts', 'Amount', 'Tax', HOME_AMOUNT_COLUMN]]
+        .sum(min_count=1)  # home amount stays blank for currencies without rates
+        .reset_index()
+    )
+    currency = grouped.groupby('Currency')[['Receipts', 'Amount', 'Tax', HOME_AMOUNT_COLUMN]].sum(min_count=1).reset_index()
+    category = (
+        grouped.dropna(subset=['Category'])
+        .groupby(['Category', 'Currency'])['Amount'].sum().reset_index()
+        .sort_values('Amount', ascending=False)
+    )
+    monthly = grouped.dropna(subset=['Month']).groupby(['Month', 'Currency'])['Amount'].sum().reset_index()
+    monthly['Month'] = monthly['Month'].astype(str)
+    return {'currency': currency, 'category': category, 'monthly': monthly}
+
+def _totals_rows(currency_summary):
+    """One TOTAL row per currency (amounts in different currencies are never
+    added up), then the grand total in the home currency"""
+    if currency_summary.empty:
+        return pd.DataFrame([{'Vendor': 'TOTAL', 'Amount': 0.0, 'Currency': '', 'Tax': 0.0, HOME_AMOUNT_COLUMN: 0.0}])
+    per_currency = pd.DataFrame({
+        'Vendor': 'TOTAL',
+        'Amount': currency_summary['Amount'],
+        'Currency': currency_summary['Currency'],
+        'Tax': currency_summary['Tax'],
+        HOME_AMOUNT_COLUMN: currency_summary[HOME_AMOUNT_COLUMN]
+    })
+    grand = pd.DataFrame([{'Vendor': f'TOTAL ({fx_rates.HOME_CURRENCY})',
+                           HOME_AMOUNT_COLUMN: currency_summary[HOME_AMOUNT_COLUMN].sum()}])
+    return pd.concat([per_currency, grand], ignore_index=True)
+
+# --- Streaming exports ---
+# Rows are written as they are read from the database cursor and the
+# summaries are accumulated on the way, so memory stays flat however many
+# receipts a user has. Pass any iterable of rows with Receipt's attributes.
+
+def _export_row(receipt):
+    return [
+        receipt.vendor,
+        receipt.amount or 0,
+        receipt.currency or 'USD',
+        receipt.date,
+        receipt.category,
+        receipt.tax_amount or 0,
+        receipt.home_amount,
+        receipt.created_at.strftime('%Y-%m-%d %H:%M') if receipt.created_at else ''
+    ]
+
+def _month(value):
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m')
+    return None
+
+class ExportSummary:
+    """Per-currency totals plus category and monthly sums, built in the same
+    pass as the rows. Same sheets as export_summaries() produces."""
+
+    def __init__(self):
+        self.currencies = {}
+        self.categories = {}
+        self.months = {}
+
+    def add(self, row):
+        _, amount, currency, receipt_date, category, tax, home_amount, _ = row
+        totals = self.currencies.setdefault(currency, [0, 0.0, 0.0, None])
+        totals[0] += 1
+        totals[1] += amount
+        totals[2] += tax
+        if home_amount is not None:  # left blank for currencies without rates
+            totals[3] = (totals[3] or 0.0) + home_amount
+        if category is not None:
+            key = (category, currency)
+            self.categories[key] = self.categories.get(key, 0.0) + amount
+        month = _month(receipt_date)
+        if month:
+            key = (month, currency)
+            self.months[key] = self.months.get(key, 0.0) + amount
+
+    def totals_rows(self):
+        if not self.currencies:
+            return [['TOTAL', 0.0, '', '', '', 0.0, 0.0, '']]
+        rows = [['TOTAL', amount, currency, '', '', tax, home, '']
+                for currency, (_, amount, tax, home) in sorted(self.currencies.items())]
+        grand = sum(home or 0.0 for _, _, _, home in self.currencies.values())
+        return rows + [[f'TOTAL ({fx_rates.HOME_CURRENCY})', '', '', '', '', '', grand, '']]
+
+    def currency_rows(self):
+        return [[currency, count, amount, tax, home] for currency, (count, amount, tax, home) in sorted(self.currencies.items())]
+
+    def category_rows(self):
+        return [[category, currency, amount] for (category, currency), amount
+                in sorted(self.categories.items(), key=lambda item: item[1], reverse=True)]
+
+    def month_rows(self):
+        return [[month, currency, amount] for (month, currency), amount in sorted(self.months.items())]
+
+def stream_excel_export(receipts):
+    """Yield an .xlsx export in chunks, using openpyxl's write-only mode"""
+    chunks = _excel_chunks(receipts)
+    return _timed_chunks('export.xlsx', chunks) if _hooks else chunks
+
+def _excel_chunks(receipts):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Expenses')
+    sheet.append(EXPORT_COLUMNS)
+    summary = ExportSummary()
+    for receipt in receipts:
+        row = _export_row(receipt)
+        summary.add(row)
+        sheet.append(row)
+    for row in summary.totals_rows():
+        sheet.append(row)
+    
+    if summary.currencies:
+        for title, header, rows in [
+            ('Category Summary', ['Category', 'Currency', 'Amount'], summary.category_rows()),
+            ('Monthly Summary', ['Month', 'Currency', 'Amount'], summary.month_rows()),
+            ('Currency Summary', ['Currency', 'Receipts', 'Amount', 'Tax', HOME_AMOUNT_COLUMN], summary.currency_rows()),
+        ]:
+            summary_sheet = workbook.create_sheet(title)
+            summary_sheet.append(header)
+            for row in rows:
+                summary_sheet.append(row)
+    
+    # The zip container is only complete once saved; spool it through an
+    # anonymous temp file rather than holding it in memory or in exports/
+    with tempfile.TemporaryFile() as out:
+        workbook.save(out)
+        out.seek(0)
+        for chunk in iter(lambda: out.read(STREAM_CHUNK_SIZE), b''):
+            yield chunk
+
+def stream_csv_export(receipts):
+    """Yield a CSV export in chunks, ending with the totals row"""
+    chunks = _csv_chunks(receipts)
+    return _timed_chunks('export.csv', chunks) if _hooks else chunks
+
+def _csv_chunks(receipts):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    summary = ExportSummary()
+    for receipt in receipts:
+        row = _export_row(receipt)
+        summary.add(row)
+        writer.writerow(row)
+        if buffer.tell() >= STREAM_CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    writer.writerows(summary.totals_rows())
+    yield buffer.getvalue().encode('utf-8')
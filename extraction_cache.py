@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import Counter
+
+# Persistent, content-addressed store for structured extraction results.
+# Backed by SQLite so the web process and every OCR worker share one cache,
+# with least-recently-used eviction once the entry or byte budget is exceeded.
+# Hit/miss counters live in the store too, so they cover every process.
+#
+# A hit is a read, not a write: last_access is only rewritten once it is more
+# than access_resolution seconds old (eviction order does not need finer
+# grain), and each process adds up its counters in memory and writes them at
+# most every flush_interval seconds (and before stats()). Counts a process
+# had not written when it exited are lost; they are statistics only.
+
+class ExtractionCache:
+    def __init__(self, path, max_entries=10000, max_bytes=50 * 1024 * 1024, ttl=None, enabled=True,
+                 access_resolution=60, flush_interval=5):
+        self.path = path
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.access_resolution = access_resolution
+        self.flush_interval = flush_interval
+        self._initialized = False
+        self._pending = Counter()
+        self._pending_lock = threading.Lock()
+        self._pending_pid = os.getpid()
+        self._flushed_at = time.monotonic()
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._initialized:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_last_access ON entries (last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._initialized = True
+        return conn
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value, created_at, last_access FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                if self._tally('misses'):
+                    self._flush(conn)
+                return None
+            if now - row[2] >= self.access_resolution:
+                conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            if self._tally('hits'):
+                self._flush(conn)
+        finally:
+            conn.close()
+        return json.loads(row[0])
+
+    def _count(self, conn, name, amount=1):
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount)
+        )
+
+    def _tally(self, name, amount=1):
+        """Add to a counter in memory; True once the totals are due to be written"""
+        with self._pending_lock:
+            if self._pending_pid != os.getpid():
+                # Forked: the parent still owns what it had not written yet
+                self._pending_pid = os.getpid()
+                self._pending.clear()
+            self._pending[name] += amount
+        return time.monotonic() - self._flushed_at >= self.flush_interval
+
+    def _flush(self, conn):
+        with self._pending_lock:
+            pending = dict(self._pending) if self._pending_pid == os.getpid() else {}
+            self._pending.clear()
+            self._flushed_at = time.monotonic()
+        for name, amount in pending.items():
+            self._count(conn, name, amount)
+
+    def incr(self, name, amount=1):
+        """Add to a named counter reported alongside hits and misses"""
+        if not self.enabled or not self._tally(name, int(amount)):
+            return
+        conn = self._connect()
+        try:
+            self._flush(conn)
+        finally:
+            conn.close()
+
+    def put(self, key, value):
+        """Store a JSON-serializable value and evict old entries if over budget"""
+        if not self.enabled:
+            return
+        payload = json.dumps(value)
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload), now, now)
+            )
+            self._evict(conn)
+        finally:
+            conn.close()
+
+    def _evict(self, conn):
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # Walk from least recently used until both budgets are satisfied
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            count -= 1
+            total -= size
+        conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            with self._pending_lock:
+                self._pending.clear()
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM counters")
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Hit/miss counters and the current size of the store"""
+        conn = self._connect()
+        try:
+            self._flush(conn)
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        finally:
+            conn.close()
+        hits, misses = counters.pop('hits', 0), counters.pop('misses', 0)
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'entries': count,
+            'bytes': total,
+            **counters,
+        }
+
+# {"result", "ocr_text"} keyed by
+# "<extractor version>:<ai|regex>:<pipeline>:<OCR signature>:<image sha256>",
+# where the OCR signature (ocr_processor._ocr_signature) covers the Tesseract
+# language, page segmentation mode and amount pass
+
+image_cache = ExtractionCache(
+    os.environ.get("EXTRACTION_CACHE_PATH", "instance/extraction_cache.db"),
+    max_entries=int(os.environ.get("EXTRACTION_CACHE_MAX_ENTRIES", "10000")),
+    max_bytes=int(os.environ.get("EXTRACTION_CACHE_MAX_BYTES", str(50 * 1024 * 1024))),
+    enabled=os.environ.get("EXTRACTION_CACHE_ENABLED", "1") == "1",
+)
+
+# Validated model output keyed by "<extractor version>:<model>:<normalized OCR text sha256>"
+text_cache = ExtractionCache(
+    os.environ.get("LLM_CACHE_PATH", "instance/llm_cache.db"),
+    max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "20000")),
+    max_bytes=int(os.environ.get("LLM_CACHE_MAX_BYTES", str(50 * 1024 * 1024))),
+    ttl=int(os.environ.get("LLM_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+    enabled=os.environ.get("LLM_CACHE_ENABLED", "1") == "1",
+)
@@ -0,0 +1,183 @@
+import os
+import csv
+import bisect
+import tempfile
+import threading
+from datetime import date, datetime
+import numpy as np
+
+# Home-currency conversion from a local, date-indexed table of reference
+# rates (no live FX service). Rates are quoted like the ECB's: units of each
+# currency per 1 EUR, one row per business day, so a conversion on a weekend
+# or holiday uses the latest earlier rate.
+#
+# The table lives in FX_RATES_PATH as date,currency,rate rows and is loaded
+# with `flask --app main load-fx-rates <file>`, which also accepts the ECB's
+# eurofxref CSVs (Date,USD,JPY,... columns) and merges into what is stored.
+# Each process keeps it in memory as per-currency sorted day arrays: bisect
+# for one receipt at ingest, numpy searchsorted for a whole export.
+#
+# Converted amounts are materialized on Receipt at ingest (see
+# receipt_service.apply_extraction), so dashboard totals stay a single
+# aggregate read. Receipts in a currency without rates get no home amount
+# and are counted separately instead of being summed as if they were
+# HOME_CURRENCY.
+
+HOME_CURRENCY = os.environ.get("HOME_CURRENCY", "USD").upper()
+FX_RATES_PATH = os.environ.get("FX_RATES_PATH", "instance/fx_rates.csv")
+BASE_CURRENCY = 'EUR'
+
+_EPOCH = date(1970, 1, 1)
+_DATE_FORMATS = ['%Y-%m-%d', '%d %B %Y', '%d %b %Y']
+
+def _day(value):
+    """Days since 1970-01-01 for a date, datetime or ISO string"""
+    if isinstance(value, datetime):
+        value = value.date()
+    elif isinstance(value, str):
+        value = _parse_date(value)
+    return (value - _EPOCH).days
+
+def _parse_date(value):
+    value = value.strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised rate date: {value!r}")
+
+def _rate(value):
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        return None  # ECB files use N/A or blanks for currencies not quoted that day
+    return rate if rate > 0 else None
+
+def read_csv(path):
+    """{currency: {day: rate}} from a date,currency,rate file or an
+    ECB-style file with one column per currency"""
+    series = {}
+    with open(path, newline='') as f:
+        rows = csv.reader(f)
+        header = [name.strip() for name in next(rows, [])]
+        long_format = [name.lower() for name in header[:3]] == ['date', 'currency', 'rate']
+        for row in rows:
+            if not row or not row[0].strip():
+                continue
+            day = _day(row[0])
+            if long_format:
+                pairs = [(row[1].strip().upper(), row[2])]
+            else:
+                pairs = [(currency.upper(), value) for currency, value in zip(header[1:], row[1:]) if currency]
+            for currency, value in pairs:
+                rate = _rate(value)
+                if rate is not None:
+                    series.setdefault(currency, {})[day] = rate
+    return series
+
+def write_csv(series, path):
+    """Store {currency: {day: rate}} as date,currency,rate rows, atomically"""
+    folder = os.path.dirname(path) or '.'
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.part')
+    with os.fdopen(fd, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['date', 'currency', 'rate'])
+        for currency in sorted(series):
+            for day, rate in sorted(series[currency].items()):
+                writer.writerow([date.fromordinal(_EPOCH.toordinal() + day).isoformat(), currency, repr(rate)])
+    os.replace(tmp_path, path)
+
+class RateTable:
+    def __init__(self, series=None):
+        self.series = series or {}
+        self._day_lists = {}
+        self._days = {}
+        self._rates = {}
+        for currency, rates in self.series.items():
+            days = sorted(rates)
+            self._day_lists[currency] = days
+            self._days[currency] = np.array(days, dtype=np.int64)
+            self._rates[currency] = np.array([rates[day] for day in days], dtype=np.float64)
+
+    def currencies(self):
+        return sorted(set(self._days) | {BASE_CURRENCY})
+
+    def rate(self, currency, on_date):
+        """Units of currency per EUR on (or last quoted before) on_date; the
+        earliest quote for dates before the table starts. None if unknown."""
+        if currency == BASE_CURRENCY:
+            return 1.0
+        days = self._day_lists.get(currency)
+        if days is None:
+            return None
+        day = _day(on_date) if on_date is not None else days[-1]
+        index = bisect.bisect_right(days, day) - 1
+        return float(self._rates[currency][max(index, 0)])
+
+    def _rates_on(self, currency, days):
+        if currency == BASE_CURRENCY:
+            return np.ones(len(days))
+        known = self._days.get(currency)
+        if known is None:
+            return np.full(len(days), np.nan)
+        index = np.searchsorted(known, days, side='right') - 1
+        return self._rates[currency][np.clip(index, 0, len(known) - 1)]
+
+    def convert(self, amount, currency, on_date, to=HOME_CURRENCY):
+        """amount in `to` at on_date's rate, rounded to cents; None without rates"""
+        if amount is None:
+            return None
+        if currency == to:
+            return round(float(amount), 2)
+        source, target = self.rate(currency, on_date), self.rate(to, on_date)
+        if source is None or target is None:
+            return None
+        return round(float(amount) * target / source, 2)
+
+    def convert_many(self, amounts, currencies, dates, to=HOME_CURRENCY):
+        """Vectorized convert over parallel sequences; NaN where no rate is
+        known. Missing dates use the latest rate."""
+        amounts = np.asarray(amounts, dtype=np.float64)
+        currencies = np.asarray(currencies, dtype=object)
+        days = np.asarray(dates, dtype='datetime64[D]')
+        days = np.where(np.isnat(days), np.datetime64('9999-12-31'), days).astype(np.int64)
+        result = np.full(len(amounts), np.nan)
+        target = self._rates_on(to, days)
+        for currency in set(currencies.tolist()):
+            mask = currencies == currency
+            if currency == to:
+                result[mask] = amounts[mask]
+            else:
+                result[mask] = amounts[mask] * target[mask] / self._rates_on(currency, days[mask])
+        return np.round(result, 2)
+
+_table = None
+_table_mtime = None
+_lock = threading.Lock()
+
+def get_rates():
+    """This process's rate table, reloaded when FX_RATES_PATH changes"""
+    global _table, _table_mtime
+    try:
+        mtime = os.path.getmtime(FX_RATES_PATH)
+    except OSError:
+        mtime = None
+    with _lock:
+        if _table is None or mtime != _table_mtime:
+            _table = RateTable(read_csv(FX_RATES_PATH) if mtime is not None else {})
+            _table_mtime = mtime
+        return _table
+
+def convert(amount, currency, on_date, to=HOME_CURRENCY):
+    return get_rates().convert(amount, currency, on_date, to)
+
+def load(path):
+    """Merge a rates file into FX_RATES_PATH; returns the number of quotes read"""
+    incoming = read_csv(path)
+    stored = read_csv(FX_RATES_PATH) if os.path.exists(FX_RATES_PATH) else {}
+    for currency, rates in incoming.items():
+        stored.setdefault(currency, {}).update(rates)
+    write_csv(stored, FX_RATES_PATH)
+    return sum(len(rates) for rates in incoming.values())
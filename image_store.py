@@ -0,0 +1,262 @@
+import io
+import os
+import shutil
+import tempfile
+from PIL import Image, ImageOps
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+# Archival storage for receipt images, keyed by the SHA-256 of the uploaded
+# bytes. Each receipt is kept once, re-encoded at a capped resolution, next to
+# a small thumbnail for the dashboard:
+#
+#     originals/ab/cd/<sha256>.jpg  the upload as received, until archived
+#     images/ab/cd/<sha256>.webp    archival copy
+#     thumbs/ab/cd/<sha256>.webp    dashboard thumbnail
+#
+# Uploads only stage the original bytes (stage()); decoding and re-encoding
+# happen off the request path, after OCR has read the original: the queue
+# worker or batch pool process calls promote() once the receipt is scanned.
+#
+# The two-level shard keeps directories small on local disk. Keys are the same
+# on every backend: IMAGE_STORE_BACKEND=local writes under IMAGE_STORE_PATH;
+# IMAGE_STORE_BACKEND=s3 writes to IMAGE_STORE_BUCKET (needs boto3) and
+# IMAGE_STORE_ENDPOINT_URL points it at any S3-compatible server, e.g. a
+# local MinIO.
+#
+# ARCHIVE_MAX_DIMENSION is kept at or above OCR_MAX_DIMENSION so OCR sees the
+# same resolution it would have downscaled the original to.
+
+IMAGE_STORE_BACKEND = os.environ.get("IMAGE_STORE_BACKEND", "local")
+IMAGE_STORE_PATH = os.environ.get("IMAGE_STORE_PATH", "instance/receipt_images")
+IMAGE_STORE_BUCKET = os.environ.get("IMAGE_STORE_BUCKET")
+IMAGE_STORE_PREFIX = os.environ.get("IMAGE_STORE_PREFIX", "")
+IMAGE_STORE_ENDPOINT_URL = os.environ.get("IMAGE_STORE_ENDPOINT_URL")
+
+ARCHIVE_FORMAT = os.environ.get("ARCHIVE_FORMAT", "WEBP").upper()  # WEBP or JPEG
+ARCHIVE_QUALITY = int(os.environ.get("ARCHIVE_QUALITY", "85"))
+ARCHIVE_MAX_DIMENSION = int(os.environ.get("ARCHIVE_MAX_DIMENSION", "2400"))
+THUMBNAIL_SIZE = int(os.environ.get("THUMBNAIL_SIZE", "320"))
+THUMBNAIL_QUALITY = int(os.environ.get("THUMBNAIL_QUALITY", "70"))
+
+# Receipts saved before the archive existed keep a flat filename in here
+LEGACY_UPLOAD_FOLDER = 'static/uploads'
+
+_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+CONTENT_TYPES = {'webp': 'image/webp', 'jpg': 'image/jpeg', 'png': 'image/png'}
+
+def _shard(sha256):
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}.{_EXTENSIONS[ARCHIVE_FORMAT]}"
+
+def image_key(sha256):
+    return f"images/{_shard(sha256)}"
+
+def thumbnail_key(sha256):
+    return f"thumbs/{_shard(sha256)}"
+
+def original_key(sha256, extension):
+    return f"originals/{sha256[:2]}/{sha256[2:4]}/{sha256}.{extension}"
+
+def is_archived(key):
+    """Whether a stored receipt filename is an archive key"""
+    return key.startswith('images/')
+
+def is_staged(key):
+    """Whether a stored receipt filename is an original waiting for promote()"""
+    return key.startswith('originals/')
+
+def is_legacy(key):
+    """Whether a receipt filename predates the image store"""
+    return not (is_archived(key) or is_staged(key))
+
+def content_hash(key):
+    """SHA-256 of the original upload from a store key (None for legacy files)"""
+    return None if is_legacy(key) else os.path.basename(key).rsplit('.', 1)[0]
+
+def archived_key(key):
+    """The archive key a staged original is promoted to (other keys unchanged)"""
+    return image_key(content_hash(key)) if is_staged(key) else key
+
+def content_type(key):
+    return CONTENT_TYPES.get(key.rsplit('.', 1)[-1], 'application/octet-stream')
+
+class LocalBackend:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data)
+        os.replace(tmp_path, path)
+
+    def put_file(self, key, source):
+        """Store a file (path or binary file) without reading it into memory"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        with os.fdopen(fd, 'wb') as out:
+            if isinstance(source, str):
+                with open(source, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+            else:
+                shutil.copyfileobj(source, out)
+        os.replace(tmp_path, path)
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def url(self, key):
+        """Direct download URL, or None when the app serves the file itself"""
+        return None
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+class S3Backend:
+    def __init__(self, bucket, prefix='', endpoint_url=None):
+        if boto3 is None:
+            raise RuntimeError("IMAGE_STORE_BACKEND=s3 requires boto3 (pip install boto3)")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except self.client.exceptions.ClientError:
+            return False
+        return True
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data,
+                               ContentType=content_type(key), CacheControl='private, max-age=31536000, immutable')
+
+    def put_file(self, key, source):
+        extra = {'ExtraArgs': {'ContentType': content_type(key)}}
+        if isinstance(source, str):
+            self.client.upload_file(source, self.bucket, self._key(key), **extra)
+        else:
+            self.client.upload_fileobj(source, self.bucket, self._key(key), **extra)
+
+    def open(self, key):
+        # Pillow needs a seekable file; archived images are small
+        body = self.client.get_object(Bucket=self.bucket, Key=self._key(key))['Body']
+        return io.BytesIO(body.read())
+
+    def url(self, key, expires=3600):
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self._key(key)}, ExpiresIn=expires)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+def create_backend():
+    if IMAGE_STORE_BACKEND == 's3':
+        return S3Backend(IMAGE_STORE_BUCKET, IMAGE_STORE_PREFIX, IMAGE_STORE_ENDPOINT_URL)
+    return LocalBackend(IMAGE_STORE_PATH)
+
+store = create_backend()
+
+def _encode(image, quality):
+    options = {'quality': quality}
+    dpi = image.info.get('dpi')
+    if dpi and dpi[0]:
+        # Keep the physical size for OCR's DPI-based downscale (JPEG only;
+        # WebP has no DPI field)
+        options['dpi'] = dpi
+    if ARCHIVE_FORMAT == 'JPEG':
+        options['optimize'] = True
+    else:
+        options['method'] = 4
+    out = io.BytesIO()
+    image.save(out, ARCHIVE_FORMAT, **options)
+    return out.getvalue()
+
+def _shrink(image, max_dimension):
+    """Downscale image in place to fit max_dimension, scaling its DPI along"""
+    scale = min(1.0, max_dimension / float(max(image.size)))
+    if scale < 1.0:
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        dpi = image.info.get('dpi')
+        if dpi and dpi[0]:
+            image.info['dpi'] = (dpi[0] * scale, dpi[1] * scale)
+
+def archive(source, sha256):
+    """Re-encode an image (path or binary file) and store it with its
+    thumbnail. Returns the archive key."""
+    with Image.open(source) as image:
+        width, height = image.size
+        # JPEGs decode straight at a reduced scale when that still covers
+        # the archive size
+        image.draft(None, (ARCHIVE_MAX_DIMENSION, ARCHIVE_MAX_DIMENSION))
+        dpi = image.info.get('dpi')
+        if dpi and dpi[0] and image.size != (width, height):
+            dpi = (dpi[0] * image.width / width, dpi[1] * image.height / height)
+        ImageOps.exif_transpose(image, in_place=True)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        if dpi:
+            image.info['dpi'] = dpi
+        # One decoded copy: shrunk to the archive size and encoded, then
+        # shrunk again from there for the thumbnail
+        _shrink(image, ARCHIVE_MAX_DIMENSION)
+        key = image_key(sha256)
+        archived = _encode(image, ARCHIVE_QUALITY)
+        _shrink(image, THUMBNAIL_SIZE)
+        store.put(thumbnail_key(sha256), _encode(image, THUMBNAIL_QUALITY))
+        store.put(key, archived)
+    return key
+
+def stage(source, sha256, extension):
+    """Store an upload's original bytes (path or binary file) until it is
+    promoted. Returns the staged key."""
+    key = original_key(sha256, extension)
+    store.put_file(key, source)
+    return key
+
+def promote(key):
+    """Archive a staged original and drop it; returns the archive key. Safe
+    to call again, or for an original another upload already promoted."""
+    if not is_staged(key):
+        return key
+    sha256 = content_hash(key)
+    if store.exists(key):
+        if not store.exists(image_key(sha256)):
+            with store.open(key) as original:
+                archive(original, sha256)
+        store.delete(key)
+    return image_key(sha256)
+
+def open_image(key):
+    """Readable binary file for a stored receipt image: staged, archived or legacy"""
+    if is_staged(key) and not store.exists(key):
+        # Promoted meanwhile (an identical upload's job got there first)
+        key = archived_key(key)
+    if not is_legacy(key):
+        return store.open(key)
+    # Legacy receipts store a bare filename; old queued jobs a full path
+    return open(key if os.path.dirname(key) else os.path.join(LEGACY_UPLOAD_FOLDER, key), 'rb')
+
+def delete(sha256):
+    store.delete(image_key(sha256))
+    store.delete(thumbnail_key(sha256))
+    for extension in ('png', 'jpg'):
+        store.delete(original_key(sha256, extension))
@@ -0,0 +1,281 @@
+import os
+import sys
+import time
+import uuid
+import json
+import signal
+import socket
+import sqlite3
+import logging
+import argparse
+import multiprocessing
+import metrics
+
+# SQLite-backed OCR job queue. The web process only enqueues work; a pool of
+# local worker processes claims jobs, runs extraction and updates the Receipt
+# row, so request threads never wait on Tesseract or the OpenAI round trip.
+
+QUEUE_PATH = os.environ.get("OCR_QUEUE_PATH", "instance/ocr_jobs.db")
+MAX_ATTEMPTS = int(os.environ.get("OCR_JOB_MAX_ATTEMPTS", "3"))
+STALE_AFTER = int(os.environ.get("OCR_JOB_STALE_SECONDS", "300"))  # reclaim jobs from crashed workers
+POLL_INTERVAL = float(os.environ.get("OCR_WORKER_POLL_SECONDS", "0.5"))
+METRICS_PORT = os.environ.get("METRICS_PORT")  # worker i serves /metrics on METRICS_PORT + i
+
+logger = logging.getLogger(__name__)
+
+def _connect():
+    os.makedirs(os.path.dirname(QUEUE_PATH) or '.', exist_ok=True)
+    conn = sqlite3.connect(QUEUE_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def init_queue():
+    """Create the jobs table if it does not exist"""
+    conn = _connect()
+    try:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                receipt_id INTEGER NOT NULL,
+                filepath TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                worker TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status_created ON jobs (status, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_receipt ON jobs (receipt_id)")
+    finally:
+        conn.close()
+
+def enqueue(receipt_id, filepath):
+    """Queue a receipt for extraction and return the job id"""
+    job_id = uuid.uuid4().hex
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO jobs (id, receipt_id, filepath, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+            (job_id, receipt_id, filepath, time.time())
+        )
+    finally:
+        conn.close()
+    return job_id
+
+def get_job(job_id):
+    """Return a job as a dict, or None if it does not exist"""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    job = dict(row)
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+def claim_job(worker_name):
+    """Atomically move the oldest queued job to 'processing' and return it"""
+    conn = _connect()
+    try:
+        # BEGIN IMMEDIATE takes the write lock up front so two workers can
+        # never claim the same row.
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'processing', attempts = attempts + 1, worker = ?, started_at = ? WHERE id = ?",
+            (worker_name, time.time(), row['id'])
+        )
+        conn.execute("COMMIT")
+        return dict(row)
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+def complete_job(job_id, result):
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, error = NULL, finished_at = ? WHERE id = ?",
+            (json.dumps(result), time.time(), job_id)
+        )
+    finally:
+        conn.close()
+
+def fail_job(job_id, error):
+    """Requeue a failed job, or mark it failed once it has used all attempts.
+    Returns True if the job is permanently failed."""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        final = row is None or row['attempts'] >= MAX_ATTEMPTS
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            ('failed' if final else 'queued', error, time.time() if final else None, job_id)
+        )
+        return final
+    finally:
+        conn.close()
+
+def requeue_stale():
+    """Put jobs whose worker died mid-extraction back on the queue"""
+    conn = _connect()
+    try:
+        cur = conn.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'processing' AND started_at < ?",
+            (time.time() - STALE_AFTER,)
+        )
+        return cur.rowcount
+    finally:
+        conn.close()
+
+def queue_depth():
+    """Number of jobs waiting for a worker"""
+    conn = _connect()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+    finally:
+        conn.close()
+
+def _apply_result(receipt_id, receipt_data, ocr_text=None, filename=None):
+    """Copy extracted fields (and the archived image key) onto the pending Receipt row"""
+    from app import app
+    from db import db
+    from models import Receipt
+    from receipt_service import apply_extraction
+
+    with app.app_context():
+        receipt = db.session.get(Receipt, receipt_id)
+        if receipt is None:
+            return
+        apply_extraction(receipt, receipt_data, ocr_text)
+        if filename:
+            receipt.filename = filename
+        with metrics.timed('db_commit'):
+            db.session.commit()
+
+def _mark_failed(receipt_id, filename=None):
+    """Flag the receipt as failed and give the upload back to the user's quota"""
+    from app import app
+    from db import db
+    from models import Receipt, User
+
+    with app.app_context():
+        receipt = db.session.get(Receipt, receipt_id)
+        if receipt is None:
+            return
+        receipt.status = 'failed'
+        if filename:
+            receipt.filename = filename
+        user = db.session.get(User, receipt.user_id)
+        if user and user.receipt_count:
+            user.receipt_count -= 1
+        db.session.commit()
+
+def process_job(job):
+    """Run extraction for a claimed job and record the outcome"""
+    from ocr_processor import extract_receipt_data
+    import image_store
+
+    start_time = time.time()
+    try:
+        details = {}
+        # filepath holds the image_store key (a plain path for jobs queued before
+        # it); OCR reads the staged original, which is archived afterwards
+        with image_store.open_image(job['filepath']) as image:
+            receipt_data = extract_receipt_data(image, content_hash=image_store.content_hash(job['filepath']),
+                                                details=details, raise_errors=True)
+        if not receipt_data:
+            raise ValueError('Could not extract receipt data')
+        with metrics.timed('archive'):
+            key = image_store.promote(job['filepath'])
+        _apply_result(job['receipt_id'], receipt_data, details.get('ocr_text'), key)
+        complete_job(job['id'], receipt_data)
+        metrics.observe('ocr_job', time.time() - start_time)
+        metrics.count('job.done')
+        logger.info(f"Job {job['id']} processed in {time.time() - start_time:.2f}s")
+    except Exception as e:
+        logger.error(f"Job {job['id']} failed: {str(e)}")
+        metrics.count('job.failed')
+        if fail_job(job['id'], str(e)):
+            _mark_failed(job['receipt_id'], _promote_quietly(job['filepath']))
+
+def _promote_quietly(key):
+    """Archive a failed job's image if it can be; None leaves the key as is"""
+    import image_store
+    try:
+        return image_store.promote(key)
+    except Exception as e:
+        logger.error(f"Could not archive {key}: {str(e)}")
+        return None
+
+def worker_loop(worker_name, stop_event=None):
+    """Claim and process jobs until stop_event is set"""
+    last_stale_check = 0
+    while stop_event is None or not stop_event.is_set():
+        if time.time() - last_stale_check > STALE_AFTER / 2:
+            requeue_stale()
+            last_stale_check = time.time()
+        job = claim_job(worker_name)
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        process_job(job)
+
+def _worker_main(index, stop_event):
+    # The parent handles Ctrl+C and tells workers to stop via stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO)
+    if METRICS_PORT and metrics.ENABLED:
+        metrics.install_hooks()
+        metrics.serve(int(METRICS_PORT) + index)
+    from ocr_processor import warm_engine
+    try:
+        logger.info(f"Worker {index} using the {warm_engine()} OCR engine")
+    except Exception as e:
+        # Jobs create the engine lazily and fail (and retry) on their own
+        logger.error(f"Worker {index} could not warm the OCR engine: {str(e)}")
+    worker_loop(f"{socket.gethostname()}:{os.getpid()}:{index}", stop_event)
+
+def start_workers(count, stop_event=None):
+    """Start `count` worker processes and return (processes, stop_event)"""
+    init_queue()
+    stop_event = stop_event or multiprocessing.Event()
+    processes = []
+    for i in range(count):
+        p = multiprocessing.Process(target=_worker_main, args=(i, stop_event), daemon=True)
+        p.start()
+        processes.append(p)
+    return processes, stop_event
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the OCR extraction worker pool')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('OCR_WORKERS', os.cpu_count() or 2)))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    processes, stop_event = start_workers(args.workers)
+    logger.info(f"Started {len(processes)} OCR workers on {QUEUE_PATH}")
+
+    def _shutdown(signum, frame):
+        stop_event.set()
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+
+    for p in processes:
+        p.join()
+    sys.exit(0)
@@ -0,0 +1,260 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+import openai
+
+# Guarded access to the chat completions API for receipt structuring.
+#
+# - At most LLM_MAX_CONCURRENCY calls are in flight per process; callers wait
+#   up to LLM_QUEUE_TIMEOUT seconds for a slot instead of piling onto a slow
+#   API.
+# - Each attempt is bounded by the client's timeout (LLM_TIMEOUT).
+# - 429, 5xx, timeouts and connection errors are retried with exponential
+#   backoff and full jitter (Retry-After is honoured when the API sends it).
+# - After LLM_BREAKER_FAILURES consecutive failed calls (transport errors,
+#   429s and 5xx only: a 4xx says the request was bad, not the API) the
+#   circuit opens and every call fails fast with LLMUnavailable for
+#   LLM_BREAKER_COOLDOWN seconds, so extraction goes straight to the regex
+#   parser. One trial call is then let through; success closes the circuit
+#   again.
+#
+# MicroBatcher groups texts submitted from any thread into one request of up
+# to LLM_BATCH_SIZE receipts, waiting at most LLM_BATCH_MAX_WAIT seconds for a
+# batch to fill, so bulk imports pay the instruction prompt and the round
+# trip once per batch instead of once per receipt.
+#
+# The OpenAI client honours OPENAI_BASE_URL, so all of this can be exercised
+# against benchmarks/stub_openai.py (see its --latency and --error-rate).
+
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "20"))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "4"))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "10"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", "8"))
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", "30"))
+LLM_BATCH_SIZE = int(os.environ.get("LLM_BATCH_SIZE", "8"))
+LLM_BATCH_MAX_WAIT = float(os.environ.get("LLM_BATCH_MAX_WAIT", "0.05"))
+
+class LLMUnavailable(Exception):
+    """The API is considered unhealthy or saturated; use the fallback parser"""
+
+def _retryable(error):
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def _retry_after(error):
+    """Seconds the API asked us to wait, if it said"""
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return 'open'
+            return 'half-open'
+
+    def allow(self):
+        """Whether a call may go out now; in half-open state only one trial at a time"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+    def release(self):
+        """End a call that says nothing about the API's health; a half-open
+        circuit lets the next trial through"""
+        with self._lock:
+            self._trial = False
+
+class LLMClient:
+    def __init__(self, client, max_concurrency=LLM_MAX_CONCURRENCY, queue_timeout=LLM_QUEUE_TIMEOUT,
+                 max_retries=LLM_MAX_RETRIES, backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX,
+                 breaker=None):
+        self.client = client
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._counts = {'calls': 0, 'retries': 0, 'failures': 0, 'rejected': 0,
+                        'prompt_tokens': 0, 'completion_tokens': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        hinted = _retry_after(error)
+        return min(self.backoff_max, max(delay, hinted)) if hinted is not None else delay
+
+    def chat(self, **kwargs):
+        """chat.completions.create with the concurrency cap, retries and breaker.
+        Raises LLMUnavailable when the call is refused, else the last API error."""
+        # Fail fast while open rather than queueing for a slot first
+        if self.breaker.state == 'open':
+            self._count('rejected')
+            raise LLMUnavailable('LLM circuit open')
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            # Saturation is not an API failure, so the breaker is left alone
+            self._count('rejected')
+            raise LLMUnavailable('No free LLM slot')
+        if not self.breaker.allow():
+            self._slots.release()
+            self._count('rejected')
+            raise LLMUnavailable('LLM circuit open')
+        try:
+            self._count('calls')
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = self.client.chat.completions.create(**kwargs)
+                except Exception as e:
+                    if not _retryable(e):
+                        # Client errors (400, 401, ...) would fail on any healthy API
+                        self.breaker.release()
+                        self._count('failures')
+                        raise
+                    if attempt == self.max_retries:
+                        self.breaker.failure()
+                        self._count('failures')
+                        raise
+                    self._count('retries')
+                    time.sleep(self._backoff(attempt, e))
+                    continue
+                self.breaker.success()
+                if response.usage:
+                    self._count('prompt_tokens', response.usage.prompt_tokens)
+                    self._count('completion_tokens', response.usage.completion_tokens)
+                return response
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {**self._counts, 'circuit': self.breaker.state}
+
+class MicroBatcher:
+    """Collects items from any thread and passes them to handler(items) in
+    batches of at most max_batch_size, dispatching a partial batch once its
+    oldest item has waited max_wait seconds. handler returns one outcome per
+    item; an Exception instance as an outcome fails just that item's future."""
+
+    def __init__(self, handler, max_batch_size=LLM_BATCH_SIZE, max_wait=LLM_BATCH_MAX_WAIT,
+                 max_in_flight=LLM_MAX_CONCURRENCY, result_timeout=None):
+        self.handler = handler
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.max_in_flight = max_in_flight
+        # Longest one batch can take through LLMClient: a wait for a slot, then
+        # every attempt timing out with the longest backoff between them
+        if result_timeout is None:
+            result_timeout = (LLM_QUEUE_TIMEOUT + LLM_TIMEOUT * (LLM_MAX_RETRIES + 1)
+                              + LLM_BACKOFF_MAX * LLM_MAX_RETRIES + max_wait)
+        self.result_timeout = result_timeout
+        self._pid = None
+        self._start_lock = threading.Lock()
+        # A fork can happen while another thread holds the lock
+        os.register_at_fork(after_in_child=self._reset_start_lock)
+
+    def _reset_start_lock(self):
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        # Also after a fork: the parent's thread and condition do not carry
+        # over. _pid is set last so no other thread sees a half-built batcher.
+        self._pending = []
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        threading.Thread(target=self._run, daemon=True).start()
+        self._pid = os.getpid()
+
+    def submit(self, item):
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._start()
+        future = Future()
+        with self._cond:
+            self._pending.append((time.monotonic(), item, future))
+            self._cond.notify()
+        return future
+
+    def map(self, items):
+        """Outcomes for items in order (results or Exception instances). An item
+        not answered within result_timeout gets LLMUnavailable instead."""
+        futures = [self.submit(item) for item in items]
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result(timeout=self.result_timeout))
+            except FutureTimeout:
+                outcomes.append(LLMUnavailable(f'No LLM result within {self.result_timeout:.0f}s'))
+            except Exception as e:
+                outcomes.append(e)
+        return outcomes
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = self._pending[0][0] + self.max_wait
+                while len(self._pending) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        try:
+            outcomes = self.handler([item for _, item, _ in batch])
+        except Exception as e:
+            outcomes = [e] * len(batch)
+        if len(outcomes) != len(batch):
+            outcomes = [ValueError(f'Expected {len(batch)} outcomes, got {len(outcomes)}')] * len(batch)
+        for (_, _, future), outcome in zip(batch, outcomes):
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
@@ -0,0 +1,161 @@
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# In-process Prometheus metrics: latency histograms per pipeline stage and
+# per HTTP endpoint, plus event counters (cache hits/misses, structuring path
+# taken). Rendered in the Prometheus text format at /metrics.
+#
+# ocr_processor and export_utils only time their stages while a hook is
+# registered (install_hooks), so with METRICS_ENABLED=0 they do no extra work.
+#
+# Each process has its own registry. The web app serves it on /metrics; OCR
+# worker processes serve theirs on METRICS_PORT + worker index when
+# METRICS_PORT is set (see job_queue.py).
+
+ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, labelvalues)} {_number(value)}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labelvalues -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labelvalues, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                    cumulative += count
+                    le = f'le="{_number(bound)}"'
+                    lines.append(f'{self.name}_bucket{_labels(self.labelnames, labelvalues, le)} {cumulative}')
+                lines.append(f'{self.name}_sum{_labels(self.labelnames, labelvalues)} {_number(series[-1])}')
+                lines.append(f'{self.name}_count{_labels(self.labelnames, labelvalues)} {cumulative}')
+        return lines
+
+REGISTRY = []
+
+def _register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+http_request_seconds = _register(Histogram(
+    'receipt_http_request_seconds', 'Time to handle an HTTP request', ['endpoint', 'method', 'status']))
+stage_seconds = _register(Histogram(
+    'receipt_stage_seconds', 'Time spent in one step of ingest, dashboard or export', ['stage']))
+events = _register(Counter(
+    'receipt_events_total', 'Pipeline events: cache hits/misses and the structuring path taken', ['event']))
+
+def observe(stage, seconds):
+    if ENABLED:
+        stage_seconds.observe(seconds, stage)
+
+def count(event, amount=1):
+    if ENABLED:
+        events.inc(event, amount=amount)
+
+@contextmanager
+def _timer(stage):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start_time, stage)
+
+def timed(stage):
+    """Context manager recording the block's duration under stage"""
+    return _timer(stage) if ENABLED else nullcontext()
+
+def hook(name, value):
+    """Hook for ocr_processor/export_utils: a duration, or None for an event"""
+    if value is None:
+        events.inc(name)
+    else:
+        stage_seconds.observe(value, name)
+
+_hooks_installed = False
+
+def install_hooks():
+    """Start receiving stage timings and events from the pipeline modules"""
+    global _hooks_installed
+    if not ENABLED or _hooks_installed:
+        return
+    import ocr_processor
+    import export_utils
+    ocr_processor.add_hook(hook)
+    export_utils.add_hook(hook)
+    _hooks_installed = True
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(port):
+    """Expose this process's metrics on a background HTTP server"""
+    server = ThreadingHTTPServer(('0.0.0.0', port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,108 @@
+from sqlalchemy import inspect, text
+
+# db.create_all() only creates missing tables, so columns added to existing
+# models need an explicit upgrade step for databases created by older builds.
+# Every step must be idempotent: fresh databases already have the new schema.
+
+def _has_column(conn, table, column):
+    return column in {c['name'] for c in inspect(conn).get_columns(table)}
+
+def add_receipt_status(conn):
+    """Receipts processed before the OCR job queue existed are complete"""
+    if not _has_column(conn, 'receipt', 'status'):
+        conn.execute(text("ALTER TABLE receipt ADD COLUMN status VARCHAR(20) DEFAULT 'done'"))
+        conn.execute(text("UPDATE receipt SET status = 'done' WHERE status IS NULL"))
+
+def _has_index(conn, table, name):
+    return name in {i['name'] for i in inspect(conn).get_indexes(table)}
+
+def type_receipt_date_and_amounts(conn):
+    """receipt.date becomes a real DATE (parsed from the old free-form strings),
+    amounts become NUMERIC(12, 2), and the per-user composite indexes are added"""
+    from models import parse_receipt_date
+    if _has_index(conn, 'receipt', 'ix_receipt_user_date'):
+        return
+    # Rewrite every stored date as ISO 8601, or NULL where it cannot be parsed
+    updates = []
+    rows = conn.execution_options(yield_per=5000).execute(text("SELECT id, date FROM receipt WHERE date IS NOT NULL"))
+    for receipt_id, value in rows:
+        parsed = parse_receipt_date(value)
+        iso = parsed.isoformat() if parsed else None
+        if iso != value:
+            updates.append({'id': receipt_id, 'date': iso})
+    if updates:
+        conn.execute(text("UPDATE receipt SET date = :date WHERE id = :id"), updates)
+    # SQLite columns are dynamically typed: ISO strings already read back as DATE
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("ALTER TABLE receipt ALTER COLUMN date TYPE DATE USING date::date"))
+        conn.execute(text("ALTER TABLE receipt ALTER COLUMN amount TYPE NUMERIC(12, 2)"))
+        conn.execute(text("ALTER TABLE receipt ALTER COLUMN tax_amount TYPE NUMERIC(12, 2)"))
+    conn.execute(text("CREATE INDEX ix_receipt_user_created ON receipt (user_id, created_at)"))
+    conn.execute(text("CREATE INDEX ix_receipt_user_date ON receipt (user_id, date)"))
+
+def add_aggregate_version(conn):
+    """Change counter used to key cached exports"""
+    if not _has_column(conn, 'user_aggregate', 'version'):
+        conn.execute(text("ALTER TABLE user_aggregate ADD COLUMN version INTEGER DEFAULT 0 NOT NULL"))
+
+def type_aggregate_totals(conn):
+    """Aggregate totals become NUMERIC(12, 2) like the receipt amounts they sum"""
+    # SQLite columns are dynamically typed: the model's Numeric type is enough
+    if conn.dialect.name != 'postgresql':
+        return
+    for table in ('user_aggregate', 'monthly_aggregate'):
+        types = {c['name']: c['type'] for c in inspect(conn).get_columns(table)}
+        for column in ('total_amount', 'total_tax'):
+            if not str(types[column]).startswith('NUMERIC'):
+                conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE NUMERIC(12, 2)"))
+
+def backfill_receipt_aggregates(conn):
+    """Dashboard totals for receipts saved before the aggregate tables existed"""
+    from aggregates import rebuild
+    has_aggregates = conn.execute(text("SELECT 1 FROM user_aggregate LIMIT 1")).first()
+    has_receipts = conn.execute(text("SELECT 1 FROM receipt LIMIT 1")).first()
+    if has_receipts and not has_aggregates:
+        rebuild(conn)
+
+def add_receipt_ocr_text(conn):
+    """Raw OCR text, kept for full-text search"""
+    if not _has_column(conn, 'receipt', 'ocr_text'):
+        conn.execute(text("ALTER TABLE receipt ADD COLUMN ocr_text TEXT"))
+
+def add_receipt_search_index(conn):
+    """Full-text index over vendor, category and OCR text (see search.py)"""
+    from search import install
+    install(conn)
+
+def add_receipt_home_amounts(conn):
+    """Home-currency amounts (see fx_rates.py); totals are rebuilt from them"""
+    from aggregates import rebuild
+    from receipt_service import reconvert_amounts, missing_rates_warning
+    if not _has_column(conn, 'user_aggregate', 'unconverted_count'):
+        conn.execute(text("ALTER TABLE user_aggregate ADD COLUMN unconverted_count INTEGER DEFAULT 0 NOT NULL"))
+    if not _has_column(conn, 'receipt', 'home_amount'):
+        conn.execute(text("ALTER TABLE receipt ADD COLUMN home_amount NUMERIC(12, 2)"))
+        conn.execute(text("ALTER TABLE receipt ADD COLUMN home_tax_amount NUMERIC(12, 2)"))
+        if reconvert_amounts(conn):
+            rebuild(conn)
+        warning = missing_rates_warning(conn)
+        if warning:
+            print(f"Warning: {warning}")
+
+MIGRATIONS = [
+    add_receipt_status,
+    type_receipt_date_and_amounts,
+    add_aggregate_version,
+    type_aggregate_totals,
+    # Before anything that rebuilds the aggregates, which read home_amount
+    add_receipt_home_amounts,
+    backfill_receipt_aggregates,
+    add_receipt_ocr_text,
+    add_receipt_search_index,
+]
+
+def upgrade(engine):
+    """Apply all schema upgrade steps in order"""
+    with engine.begin() as conn:
+        for step in MIGRATIONS:
+            step(conn)
@@ -1,5 +1,5 @@
 from db import db
-from datetime import datetime
+from datetime import datetime, date
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -19,12 +19,66 @@ class Receipt(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     filename = db.Column(db.String(255), nullable=False)
     vendor = db.Column(db.String(100))
-    amount = db.Column(db.Float, default=0.0)
+    # Exact to the cent in the database, plain floats in Python
+    amount = db.Column(db.Numeric(12, 2, asdecimal=False), default=0.0)
     currency = db.Column(db.String(10), default='USD')
-    date = db.Column(db.String(20))
+    date = db.Column(db.Date)
     category = db.Column(db.String(50))
-    tax_amount = db.Column(db.Float, default=0.0)
+    tax_amount = db.Column(db.Numeric(12, 2, asdecimal=False), default=0.0)
+    # amount / tax_amount in fx_rates.HOME_CURRENCY at the receipt date's
+    # rate; NULL when no rate is known for the currency
+    home_amount = db.Column(db.Numeric(12, 2, asdecimal=False))
+    home_tax_amount = db.Column(db.Numeric(12, 2, asdecimal=False))
+    # Raw OCR output, kept for full-text search (see search.py)
+    ocr_text = db.Column(db.Text)
+    # pending -> processing -> done/failed while the OCR worker pool handles it
+    status = db.Column(db.String(20), default='done')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Dashboard (recent first) and export (by receipt date) are always per user
+    __table_args__ = (
+        db.Index('ix_receipt_user_created', 'user_id', 'created_at'),
+        db.Index('ix_receipt_user_date', 'user_id', 'date'),
+    )
+    
     def __repr__(self):
         return f'<Receipt {self.vendor} - ${self.amount}>'
+
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%d.%m.%Y', '%d-%m-%Y', '%Y/%m/%d', '%d %b %Y', '%b %d, %Y']
+
+def parse_receipt_date(value):
+    """Receipt.date value for an extracted or legacy date string; None if unparseable"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date) or value is None:
+        return value
+    value = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+class UserAggregate(db.Model):
+    """Running totals over a user's processed receipts (see aggregates.py)"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    receipt_count = db.Column(db.Integer, default=0, nullable=False)
+    total_amount = db.Column(db.Numeric(12, 2, asdecimal=False), default=0.0, nullable=False)
+    total_tax = db.Column(db.Numeric(12, 2, asdecimal=False), default=0.0, nullable=False)
+    # Processed receipts left out of the totals for want of an FX rate
+    unconverted_count = db.Column(db.Integer, default=0, nullable=False)
+    # Bumped on every change to the user's receipts; keys cached exports
+    version = db.Column(db.Integer, default=0, nullable=False)
+
+class MonthlyAggregate(db.Model):
+    """Running totals per user, receipt month (YYYY-MM) and category"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    month = db.Column(db.String(7), nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    receipt_count = db.Column(db.Integer, default=0, nullable=False)
+    total_amount = db.Column(db.Numeric(12, 2, asdecimal=False), default=0.0, nullable=False)
+    total_tax = db.Column(db.Numeric(12, 2, asdecimal=False), default=0.0, nullable=False)
+    
+    __table_args__ = (db.UniqueConstraint('user_id', 'month', 'category', name='uq_monthly_aggregate'),)
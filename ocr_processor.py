@@ -1,58 +1,519 @@
 import pytesseract
-from PIL import Image
+import threading
+from PIL import Image, ImageFilter, ImageOps
+import numpy as np
 import re
 import json
 import os
+import time
+import hashlib
 from datetime import datetime
 from openai import OpenAI
+from extraction_cache import image_cache, text_cache
+from storage import file_sha256
+from llm_client import LLMClient, MicroBatcher, LLM_TIMEOUT
 
 # Get OpenAI API key from environment
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "your-openai-api-key")
-openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY != "your-openai-api-key" else None
+# Retries are done by llm_client (with backoff and a circuit breaker), not the SDK
+openai_client = OpenAI(api_key=OPENAI_API_KEY, timeout=LLM_TIMEOUT, max_retries=0) if OPENAI_API_KEY != "your-openai-api-key" else None
+llm = LLMClient(openai_client) if openai_client else None
 
-def extract_receipt_data(image_path):
-    """Extract structured data from receipt image using OCR and AI"""
+# Bump whenever OCR, structuring or the cached value layout changes so
+# cached results are not reused
+EXTRACTOR_VERSION = "4"
+
+# --- Instrumentation hooks ---
+# Callables run as hook(name, seconds) for each timed stage and as
+# hook(name, None) for events (cache hits/misses, structuring path taken).
+# Stages are only timed while at least one hook is registered.
+
+_hooks = []
+
+def add_hook(hook):
+    _hooks.append(hook)
+
+def _emit(name, value=None):
+    for hook in _hooks:
+        hook(name, value)
+
+# --- Image preprocessing ---
+# Full-resolution phone photos are slow and memory-hungry to OCR. Each stage
+# takes and returns a PIL image; the pipeline is configured by name with
+# OCR_PREPROCESS and every stage is timed.
+
+OCR_TARGET_DPI = int(os.environ.get("OCR_TARGET_DPI", "300"))
+OCR_MAX_DIMENSION = int(os.environ.get("OCR_MAX_DIMENSION", "2000"))
+DEFAULT_PIPELINE = "downscale,grayscale,crop"
+OCR_PREPROCESS = os.environ.get("OCR_PREPROCESS", DEFAULT_PIPELINE)
+
+def _target_scale(image):
+    """Scale factor (<= 1) that brings the image to the target DPI / size cap"""
+    scale = 1.0
+    dpi = image.info.get('dpi')
+    if dpi and dpi[0] and dpi[0] > OCR_TARGET_DPI:
+        scale = OCR_TARGET_DPI / float(dpi[0])
+    longest = max(image.size)
+    if longest * scale > OCR_MAX_DIMENSION:
+        scale = OCR_MAX_DIMENSION / float(longest)
+    return scale
+
+def downscale(image):
+    """Resize to the target DPI, capped at OCR_MAX_DIMENSION on the long side"""
+    scale = _target_scale(image)
+    if scale >= 1.0:
+        return image
+    size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+    return image.resize(size, Image.LANCZOS)
+
+def grayscale(image):
+    return image.convert('L')
+
+def _otsu_threshold(gray):
+    hist = np.asarray(gray.histogram()[:256], dtype=np.float64)
+    total = hist.sum()
+    if not total:
+        return 128
+    levels = np.arange(256)
+    weight_bg = np.cumsum(hist)
+    weight_fg = total - weight_bg
+    mean_bg = np.cumsum(hist * levels)
+    mean_total = mean_bg[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (mean_total * weight_bg / total - mean_bg) ** 2 / (weight_bg * weight_fg)
+    return int(np.nanargmax(between))
+
+def binarize(image):
+    """Otsu threshold to pure black/white"""
+    gray = image.convert('L')
+    threshold = _otsu_threshold(gray)
+    return gray.point(lambda p: 255 if p > threshold else 0)
+
+def crop(image):
+    """Crop to the bright paper region when the receipt sits on a darker background"""
+    gray = image.convert('L')
+    small = gray.copy()
+    small.thumbnail((400, 400))
+    threshold = _otsu_threshold(small)
+    # MinFilter erodes specks so only large bright areas define the box
+    mask = small.point(lambda p: 255 if p > threshold else 0).filter(ImageFilter.MinFilter(5))
+    bbox = mask.getbbox()
+    if not bbox:
+        return image
+    box_area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+    if box_area < 0.2 * small.width * small.height or box_area > 0.95 * small.width * small.height:
+        return image
+    sx, sy = image.width / small.width, image.height / small.height
+    margin = 4
+    return image.crop((
+        max(0, int(bbox[0] * sx) - margin), max(0, int(bbox[1] * sy) - margin),
+        min(image.width, int(bbox[2] * sx) + margin), min(image.height, int(bbox[3] * sy) + margin)
+    ))
+
+def deskew(image, max_angle=5, step=0.5):
+    """Rotate by the angle whose horizontal projection has the sharpest text lines"""
+    small = binarize(image)
+    small.thumbnail((800, 800))
+    ink = ImageOps.invert(small)
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step, step):
+        rows = np.asarray(ink.rotate(float(angle), fillcolor=0), dtype=np.float32).sum(axis=1)
+        score = float(np.var(rows))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    if abs(best_angle) < step:
+        return image
+    fill = 255 if image.mode == 'L' else (255, 255, 255)
+    return image.rotate(best_angle, resample=Image.BICUBIC, expand=True, fillcolor=fill)
+
+PREPROCESS_STAGES = {
+    'downscale': downscale,
+    'grayscale': grayscale,
+    'crop': crop,
+    'deskew': deskew,
+    'binarize': binarize,
+}
+
+def register_stage(name, func):
+    """Make a custom stage available to OCR_PREPROCESS"""
+    PREPROCESS_STAGES[name] = func
+
+def _pipeline(stages=None):
+    stages = OCR_PREPROCESS if stages is None else stages
+    if isinstance(stages, str):
+        stages = [name.strip() for name in stages.split(',') if name.strip()]
+    return stages
+
+def load_image(image_path, stages=None):
+    """Open an image (a path or a binary file object) for OCR, decoding
+    JPEGs at reduced size when the pipeline will downscale anyway"""
+    image = Image.open(image_path)
+    stages = _pipeline(stages)
+    if image.format in ('JPEG', 'MPO') and 'downscale' in stages:
+        scale = _target_scale(image)
+        if scale < 1.0:
+            mode = 'L' if 'grayscale' in stages else 'RGB'
+            image.draft(mode, (int(image.width * scale), int(image.height * scale)))
+    image = ImageOps.exif_transpose(image)
+    return image.convert('RGB') if image.mode not in ('RGB', 'L') else image
+
+def preprocess_image(image, stages=None, timings=None):
+    """Run the configured stages in order, recording seconds per stage"""
+    for name in _pipeline(stages):
+        start_time = time.perf_counter()
+        image = PREPROCESS_STAGES[name](image)
+        if timings is not None:
+            timings[f'preprocess.{name}'] = time.perf_counter() - start_time
+    return image
+
+# --- OCR engines ---
+# pytesseract runs the tesseract binary per call: a process start, temp image
+# files and a fresh language model load for every receipt. With tesserocr
+# installed, each process keeps a warm TessBaseAPI per thread instead
+# (OCR_ENGINE=auto picks it when importable). Both honour OCR_LANG (e.g.
+# "eng+deu") and OCR_PSM. OCR_AMOUNT_PASS=1 re-reads the lines mentioning a
+# total with a digits-only whitelist; the number found is used when
+# structuring could not find an amount.
+
+OCR_ENGINE = os.environ.get("OCR_ENGINE", "auto")  # auto, tesserocr or pytesseract
+OCR_LANG = os.environ.get("OCR_LANG", "eng")
+OCR_PSM = int(os.environ.get("OCR_PSM", "3"))  # tesseract's default: automatic page segmentation
+OCR_AMOUNT_PASS = os.environ.get("OCR_AMOUNT_PASS", "0") == "1"
+
+AMOUNT_WHITELIST = "0123456789.,"
+_AMOUNT_LINE = re.compile(r'(?<!sub)(?<!sub )total|amount')
+_AMOUNT_DIGITS = re.compile(r'(\d+)[.,](\d{2})(?!\d)')
+
+class PytesseractEngine:
+    name = 'pytesseract'
+
+    def __init__(self, lang=OCR_LANG, psm=OCR_PSM):
+        self.lang = lang
+        self.psm = psm
+
+    def _config(self, psm, whitelist):
+        config = f'--psm {psm or self.psm}'
+        return config + f' -c tessedit_char_whitelist={whitelist}' if whitelist else config
+
+    def text(self, image, psm=None, whitelist=None):
+        return pytesseract.image_to_string(image, lang=self.lang, config=self._config(psm, whitelist))
+
+    def lines(self, image):
+        """[(text, (left, top, right, bottom)), ...] for each recognised line"""
+        data = pytesseract.image_to_data(image, lang=self.lang, config=self._config(None, None),
+                                         output_type=pytesseract.Output.DICT)
+        lines = {}
+        for i, word in enumerate(data['text']):
+            if not word.strip():
+                continue
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            box = (data['left'][i], data['top'][i], data['left'][i] + data['width'][i], data['top'][i] + data['height'][i])
+            if key in lines:
+                words, (left, top, right, bottom) = lines[key]
+                words.append(word)
+                lines[key] = (words, (min(left, box[0]), min(top, box[1]), max(right, box[2]), max(bottom, box[3])))
+            else:
+                lines[key] = ([word], box)
+        return [(' '.join(words), box) for words, box in lines.values()]
+
+    def close(self):
+        pass
+
+class TesserocrEngine:
+    """Persistent tesseract API. One TessBaseAPI per thread (it is not thread
+    safe), created on first use so forked workers build their own."""
+    name = 'tesserocr'
+
+    def __init__(self, lang=OCR_LANG, psm=OCR_PSM):
+        import tesserocr
+        self._tesserocr = tesserocr
+        self.lang = lang
+        self.psm = psm
+        self._local = threading.local()
+        self._apis = []
+
+    def _api(self):
+        api = getattr(self._local, 'api', None)
+        if api is None or self._local.pid != os.getpid():
+            api = self._tesserocr.PyTessBaseAPI(lang=self.lang, psm=self.psm)
+            self._local.api, self._local.pid = api, os.getpid()
+            self._apis.append(api)
+        return api
+
+    def text(self, image, psm=None, whitelist=None):
+        api = self._api()
+        api.SetPageSegMode(psm or self.psm)
+        api.SetVariable('tessedit_char_whitelist', whitelist or '')
+        try:
+            api.SetImage(image)
+            return api.GetUTF8Text()
+        finally:
+            api.SetPageSegMode(self.psm)
+            api.SetVariable('tessedit_char_whitelist', '')
+
+    def lines(self, image):
+        api = self._api()
+        api.SetImage(image)
+        api.Recognize()
+        level = self._tesserocr.RIL.TEXTLINE
+        lines = []
+        for line in self._tesserocr.iterate_level(api.GetIterator(), level):
+            text = line.GetUTF8Text(level)
+            box = line.BoundingBox(level)
+            if text and text.strip() and box:
+                lines.append((text.strip(), box))
+        return lines
+
+    def close(self):
+        for api in self._apis:
+            api.End()
+        self._apis = []
+        self._local = threading.local()
+
+OCR_ENGINES = {
+    'pytesseract': PytesseractEngine,
+    'tesserocr': TesserocrEngine,
+}
+
+def create_engine(name=None, **options):
+    """A new OCR engine; 'auto' prefers tesserocr and falls back to pytesseract"""
+    name = name or OCR_ENGINE
+    if name == 'auto':
+        try:
+            return TesserocrEngine(**options)
+        except ImportError:
+            return PytesseractEngine(**options)
+    return OCR_ENGINES[name](**options)
+
+_engine = None
+
+def get_engine():
+    """This process's shared OCR engine"""
+    global _engine
+    if _engine is None:
+        _engine = create_engine()
+    return _engine
+
+def warm_engine():
+    """Load the language model now (e.g. at worker start) rather than on the first receipt"""
+    engine = get_engine()
+    engine.text(Image.new('L', (64, 32), 255))
+    return engine.name
+
+def read_amount(image, engine=None):
+    """Digits-only re-read of the lines that mention a total; the first
+    amount found, or None"""
+    engine = engine or get_engine()
+    for text, (left, top, right, bottom) in engine.lines(image):
+        if not _AMOUNT_LINE.search(text.lower()):
+            continue
+        margin = max(2, (bottom - top) // 4)
+        region = image.crop((max(0, left - margin), max(0, top - margin),
+                             min(image.width, right + margin), min(image.height, bottom + margin)))
+        match = _AMOUNT_DIGITS.search(engine.text(region, psm=7, whitelist=AMOUNT_WHITELIST))
+        if match:
+            return float(f"{match.group(1)}.{match.group(2)}")
+    return None
+
+def _ocr_signature():
+    return f"{OCR_LANG}:{OCR_PSM}{':amount' if OCR_AMOUNT_PASS else ''}"
+
+def extract_receipt_data(image_path, content_hash=None, timings=None, details=None, raise_errors=False):
+    """Extract structured data from receipt image using OCR and AI.
+    image_path may also be an open binary file (e.g. an upload still in
+    memory). Pass a dict as timings to collect per-stage seconds, and as
+    details to receive the raw OCR text ('ocr_text'). With raise_errors,
+    failures propagate instead of returning the empty fallback result, so
+    a caller that can retry (the job queue) sees them."""
     try:
-        # Extract text using OCR
-        image = Image.open(image_path)
-        # Enhance image for better OCR
-        image = image.convert('RGB')
-        text = pytesseract.image_to_string(image)
-        
-        if not text.strip():
-            return extract_fallback("No text detected")
-        
-        # Use AI to structure the data if OpenAI is available
-        if openai_client and OPENAI_API_KEY != "your-openai-api-key":
-            return extract_with_ai(text)
-        else:
-            return extract_fallback(text)
+        if timings is None and _hooks:
+            timings = {}
+        scan = scan_receipt(image_path, content_hash, timings)
+        if details is not None:
+            details['ocr_text'] = scan['ocr_text']
+        if 'result' not in scan:
+            start_time = time.perf_counter()
+            structure_scans([scan])
+            if timings is not None:
+                timings['structure'] = time.perf_counter() - start_time
+        record_scan(scan, timings)
+        return scan['result']
         
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Error in extract_receipt_data: {str(e)}")
         # Fallback: Basic regex extraction
         return extract_fallback("")
 
+def scan_receipt(image_path, content_hash=None, timings=None):
+    """OCR half of extract_receipt_data: {'cache_key', 'ocr_text'}, plus
+    'result' when the image was already extracted"""
+    # Identical images resolve from the content-addressed cache
+    mode = 'ai' if openai_client else 'regex'
+    cache_key = f"{EXTRACTOR_VERSION}:{mode}:{','.join(_pipeline())}:{_ocr_signature()}:{content_hash or file_sha256(image_path)}"
+    cached = image_cache.get(cache_key)
+    if cached is not None:
+        return {'cache_key': cache_key, 'ocr_text': cached['ocr_text'], 'result': cached['result'], 'cached': True}
+    
+    # Extract text using OCR
+    start_time = time.perf_counter()
+    image = load_image(image_path)
+    if timings is not None:
+        timings['load'] = time.perf_counter() - start_time
+    # Enhance image for better OCR
+    image = preprocess_image(image, timings=timings)
+    
+    engine = get_engine()
+    start_time = time.perf_counter()
+    text = engine.text(image)
+    if timings is not None:
+        timings['ocr'] = time.perf_counter() - start_time
+    scan = {'cache_key': cache_key, 'ocr_text': text}
+    
+    if OCR_AMOUNT_PASS:
+        start_time = time.perf_counter()
+        amount = read_amount(image, engine)
+        if timings is not None:
+            timings['ocr.amount'] = time.perf_counter() - start_time
+        if amount:
+            scan['amount_hint'] = amount
+    return scan
+
+def record_scan(scan, timings=None):
+    """Report a scan's image cache outcome and stage timings to the hooks"""
+    if not _hooks:
+        return
+    _emit('cache.image.hit' if scan.get('cached') else 'cache.image.miss')
+    for stage, seconds in (timings or {}).items():
+        _emit(stage, seconds)
+
+def structure_scans(scans):
+    """Structuring half: set 'result' on every scan that lacks one and cache
+    it. With the model enabled, all texts go out through the micro-batcher,
+    so a bulk import shares requests across receipts."""
+    pending = [scan for scan in scans if 'result' not in scan]
+    # Use AI to structure the data if OpenAI is available
+    ai_scans = [scan for scan in pending if scan['ocr_text'].strip()] if openai_client else []
+    outcomes = _structure_texts_with_ai([scan['ocr_text'] for scan in ai_scans]) if ai_scans else []
+    for scan, outcome in zip(ai_scans, outcomes):
+        if isinstance(outcome, Exception):
+            # Transient API failures are not cached
+            print(f"Error with AI extraction: {str(outcome)}")
+            scan['result'] = extract_fallback(scan['ocr_text'])
+            scan['transient'] = True
+            _emit('structure.ai_failed')
+        else:
+            scan['result'] = outcome
+            _emit('structure.ai')
+    
+    for scan in pending:
+        if 'result' not in scan:
+            scan['result'] = extract_fallback(scan['ocr_text'] if scan['ocr_text'].strip() else "No text detected")
+            _emit('structure.fallback')
+        if scan.get('amount_hint') and not scan['result'].get('amount'):
+            scan['result'] = {**scan['result'], 'amount': scan['amount_hint']}
+        if not scan.pop('transient', False):
+            image_cache.put(scan['cache_key'], {'result': scan['result'], 'ocr_text': scan['ocr_text']})
+    return scans
+
 def extract_with_ai(text):
     """Use OpenAI to extract structured data from OCR text"""
     try:
         if not openai_client:
             return extract_fallback(text)
-        prompt = f"""
-Extract receipt information from this text and return as JSON:
-{text}
+        return _structure_with_ai(text)
+        
+    except Exception as e:
+        print(f"Error with AI extraction: {str(e)}")
+        # Fallback to regex extraction
+        return extract_fallback(text)
 
-Return only JSON in this exact format:
-{{
+def _normalize_text(text):
+    """Case-fold and collapse whitespace so re-scans of one receipt share a key"""
+    return ' '.join(text.casefold().split())
+
+def _structure_with_ai(text):
+    """Structure OCR text with the model, memoized on the normalized text"""
+    outcome = _structure_texts_with_ai([text])[0]
+    if isinstance(outcome, Exception):
+        raise outcome
+    return outcome
+
+def _structure_texts_with_ai(texts):
+    """Model results (or the Exception that prevented one) for each text, in
+    order. Texts seen before come from the cache; the rest are batched."""
+    outcomes = [None] * len(texts)
+    misses = []
+    for i, text in enumerate(texts):
+        digest = hashlib.sha256(_normalize_text(text).encode('utf-8')).hexdigest()
+        cache_key = f"{EXTRACTOR_VERSION}:gpt-4o:{digest}"
+        cached = text_cache.get(cache_key)
+        if cached is not None:
+            # Track what the hit saved so the cache's value is visible
+            text_cache.incr('saved_ms', cached['latency_ms'])
+            text_cache.incr('saved_tokens', cached['tokens'])
+            outcomes[i] = cached['result']
+            _emit('cache.llm.hit')
+        else:
+            misses.append((i, cache_key))
+            _emit('cache.llm.miss')
+    
+    for (i, cache_key), outcome in zip(misses, _batcher.map([texts[i] for i, _ in misses])):
+        if isinstance(outcome, Exception):
+            outcomes[i] = outcome
+            continue
+        result, latency_ms, tokens = outcome
+        text_cache.put(cache_key, {'result': result, 'latency_ms': latency_ms, 'tokens': tokens})
+        outcomes[i] = result
+    return outcomes
+
+def _structure_batch(texts):
+    """MicroBatcher handler: one model request for the whole batch, falling
+    back to a request per receipt if the batched answer cannot be used.
+    Outcomes are (result, latency_ms, tokens) with cost split evenly."""
+    start_time = time.time()
+    try:
+        if len(texts) == 1:
+            results, tokens = _call_model(texts[0])
+            results = [results]
+        else:
+            results, tokens = _call_model_batch(texts)
+    except (ValueError, KeyError, TypeError) as e:
+        if len(texts) == 1:
+            return [e]
+        print(f"Batched AI extraction unusable, retrying per receipt: {str(e)}")
+        return [_structure_batch([text])[0] for text in texts]
+    except Exception as e:
+        # API errors (after llm_client's retries) apply to the whole batch
+        return [e] * len(texts)
+    latency = time.time() - start_time
+    _emit('llm', latency)
+    latency_ms = int(latency * 1000)
+    return [(result, latency_ms // len(texts), tokens // len(texts)) for result in results]
+
+_batcher = MicroBatcher(_structure_batch)
+
+def cache_stats():
+    """Hit/miss counters for the image-hash and OCR-text cache layers, plus LLM client health"""
+    stats = {
+        'image': image_cache.stats(),
+        'llm': text_cache.stats()
+    }
+    if llm:
+        stats['llm_client'] = llm.stats()
+    return stats
+
+_RECEIPT_FORMAT = """{
     "vendor": "store name",
     "amount": 123.45,
     "currency": "USD",
     "date": "YYYY-MM-DD",
     "category": "Food/Travel/Office/Entertainment/Other",
     "tax": 12.34
-}}
+}"""
 
-Guidelines:
+_GUIDELINES = """Guidelines:
 - If you can't find a value, use null
 - For amount, extract the total amount paid (numeric value only)
 - For currency, detect the currency symbol or code (USD, EUR, GBP, INR, CAD, AUD, etc.)
@@ -61,147 +522,245 @@ Guidelines:
 - For tax, extract any tax/GST amount mentioned
 - Common currency symbols: $ (USD), € (EUR), £ (GBP), ₹ (INR), ¥ (JPY), C$ (CAD), A$ (AUD)
 """
-        
-        # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-        # do not change this unless explicitly requested by the user
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are an expert at extracting structured data from receipt text. Always respond with valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=300,
-            temperature=0.1
-        )
-        
-        # Parse AI response
-        content = response.choices[0].message.content
-        if content:
-            result = json.loads(content)
+
+def _request_model(prompt, max_tokens):
+    """Send one extraction prompt; returns (parsed JSON, total tokens)"""
+    # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
+    # do not change this unless explicitly requested by the user
+    response = llm.chat(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": "You are an expert at extracting structured data from receipt text. Always respond with valid JSON."},
+            {"role": "user", "content": prompt}
+        ],
+        response_format={"type": "json_object"},
+        max_tokens=max_tokens,
+        temperature=0.1
+    )
+    
+    # Parse AI response
+    content = response.choices[0].message.content
+    if not content:
+        raise ValueError('Empty response from model')
+    tokens = response.usage.total_tokens if response.usage else 0
+    return json.loads(content), tokens
+
+def _call_model(text):
+    """Ask the model for structured JSON; returns (result, total tokens).
+    Raises if the call or parsing fails."""
+    prompt = f"""
+Extract receipt information from this text and return as JSON:
+{text}
+
+Return only JSON in this exact format:
+{_RECEIPT_FORMAT}
+
+{_GUIDELINES}"""
+    result, tokens = _request_model(prompt, 300)
+    return _clean_result(result), tokens
+
+def _call_model_batch(texts):
+    """One request for several receipts; returns ([result, ...] in input
+    order, total tokens). Raises ValueError if the answer does not line up."""
+    receipts = '\n\n'.join(f"--- Receipt {i} ---\n{text}" for i, text in enumerate(texts, 1))
+    prompt = f"""
+Extract receipt information from each of these {len(texts)} receipts and return as JSON:
+{receipts}
+
+Return only JSON in this exact format, with one object per receipt, in the same order:
+{{"receipts": [{_RECEIPT_FORMAT}, ...]}}
+
+{_GUIDELINES}"""
+    payload, tokens = _request_model(prompt, 300 * len(texts))
+    results = payload.get('receipts') if isinstance(payload, dict) else None
+    if not isinstance(results, list) or len(results) != len(texts):
+        raise ValueError(f'Expected {len(texts)} receipts in batched response')
+    return [_clean_result(result) for result in results], tokens
+
+def _clean_result(result):
+    if not isinstance(result, dict):
+        raise ValueError('Receipt is not a JSON object')
+    
+    # Validate and clean data
+    if result.get('date'):
+        # Ensure date format
+        try:
+            parsed_date = datetime.strptime(result['date'], '%Y-%m-%d')
+            result['date'] = parsed_date.strftime('%Y-%m-%d')
+        except:
+            result['date'] = datetime.now().strftime('%Y-%m-%d')
+    else:
+        result['date'] = datetime.now().strftime('%Y-%m-%d')
+    
+    # Ensure numeric values
+    result['amount'] = float(result.get('amount', 0.0)) if result.get('amount') else 0.0
+    result['tax'] = float(result.get('tax', 0.0)) if result.get('tax') else 0.0
+    
+    # Ensure valid category
+    valid_categories = ['Food', 'Travel', 'Office', 'Entertainment', 'Other']
+    if result.get('category') not in valid_categories:
+        result['category'] = 'Other'
+    
+    # Ensure currency is set (default to USD if not detected)
+    if not result.get('currency'):
+        result['currency'] = 'USD'
+    
+    return result
+
+# --- Regex fallback parser ---
+# When the AI path is disabled this parser handles every receipt, so all
+# patterns are compiled once at import and run over a text lowercased once
+# (instead of IGNORECASE, which disables re's literal-prefix fast scan),
+# and each scan stops at its first hit.
+
+_NUMBER = r'(\d+\.?\d*)'
+
+# Priority order: the first pattern with a match wins
+_AMOUNT_PATTERNS = [re.compile(p) for p in [
+    r'₹\s*' + _NUMBER,                      # Indian Rupee
+    r'\$\s*' + _NUMBER,                     # Dollar
+    r'€\s*' + _NUMBER,                      # Euro
+    r'£\s*' + _NUMBER,                      # Pound
+    r'total[:\s]*\$?₹?\s*' + _NUMBER,       # Total amount
+    r'amount[:\s]*\$?₹?\s*' + _NUMBER,      # Amount
+    r'(\d+\.\d{2})',                        # Any decimal number with 2 decimal places
+]]
+_TAX_PATTERNS = [re.compile(p) for p in [
+    r'tax[:\s]*\$?₹?\s*' + _NUMBER,
+    r'gst[:\s]*\$?₹?\s*' + _NUMBER,
+    r'vat[:\s]*\$?₹?\s*' + _NUMBER,
+]]
+
+# Symbol checks are plain substring tests, in priority order (USD last as fallback)
+_CURRENCY_SYMBOLS = [('₹', 'INR'), ('€', 'EUR'), ('£', 'GBP'), ('¥', 'JPY'), ('C$', 'CAD'), ('A$', 'AUD'), ('$', 'USD')]
+
+_MONTHS = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+# 2007-07-30, 30.07.2007, 25/05/25, 04/07/2017 ...
+_NUMERIC_DATE = re.compile(r'(?<!\d)(\d{1,4})([./-])(\d{1,2})\2(\d{2,4})(?!\d)')
+# 30 jul 2007 / jul 30, 2007 (only tried when no numeric date is found)
+_MONTH_NAME = r'\b(' + '|'.join(_MONTHS) + r')[a-z]*\.?'
+_TEXT_DATES = [
+    (re.compile(r'(?<!\d)(\d{1,2})\s+' + _MONTH_NAME + r',?\s+((?:19|20)\d{2})'), (1, 2, 3)),
+    (re.compile(_MONTH_NAME + r'\s+(\d{1,2}),?\s+((?:19|20)\d{2})'), (2, 1, 3)),
+]
+# Ambiguous dd/mm vs mm/dd: receipts priced in dollars are usually month-first
+_MONTH_FIRST_CURRENCIES = {'USD'}
+
+class KeywordMatcher:
+    """Labels a lowercase text by the keywords it contains.
+
+    Plain substring tests in label priority order, stopping at the first hit:
+    for keyword lists this short they beat a combined regex, which has to be
+    tried at every position of the text.
+    """
+
+    def __init__(self, keywords):
+        # keywords: {keyword: label}; label order is priority order
+        self.groups = {}
+        for keyword, label in keywords.items():
+            self.groups.setdefault(label, []).append(keyword)
+
+    def first(self, text):
+        """The highest-priority label with a keyword in text, or None"""
+        for label, words in self.groups.items():
+            for word in words:
+                if word in text:
+                    return label
+        return None
+
+    def contains_any(self, text):
+        return self.first(text) is not None
+
+_CATEGORY_MATCHER = KeywordMatcher({
+    **dict.fromkeys(['restaurant', 'cafe', 'food', 'dining', 'pizza', 'burger', 'coffee'], 'Food'),
+    **dict.fromkeys(['hotel', 'flight', 'taxi', 'uber', 'ola', 'gas', 'petrol'], 'Travel'),
+    **dict.fromkeys(['office', 'supplies', 'stationery', 'computer', 'software'], 'Office'),
+    **dict.fromkeys(['movie', 'cinema', 'game', 'entertainment', 'fun'], 'Entertainment'),
+})
+
+# Common header words that are never the vendor line
+_SKIP_MATCHER = KeywordMatcher(dict.fromkeys(['receipt', 'invoice', 'bill', 'tax', 'gst', 'date', 'time'], 'skip'))
+
+def _numeric_date(match, currency):
+    a, b, c = int(match.group(1)), int(match.group(3)), int(match.group(4))
+    if len(match.group(1)) == 4:
+        year, month, day = a, b, c
+    else:
+        year = c + 2000 if c < 100 else c
+        if a > 12:
+            day, month = a, b
+        elif b > 12:
+            month, day = a, b
+        elif match.group(2) == '/' and currency in _MONTH_FIRST_CURRENCIES:
+            month, day = a, b
         else:
-            return extract_fallback(text)
-        
-        # Validate and clean data
-        if result.get('date'):
-            # Ensure date format
+            day, month = a, b
+    return datetime(year, month, day).date()
+
+def _find_date(text_lower, currency):
+    """First plausible receipt date as (date, span), else (None, None)"""
+    today = datetime.now().date()
+    for match in _NUMERIC_DATE.finditer(text_lower):
+        try:
+            parsed = _numeric_date(match, currency)
+        except ValueError:
+            continue
+        if 1990 <= parsed.year and parsed <= today:
+            return parsed, match.span()
+    for pattern, (day_group, month_group, year_group) in _TEXT_DATES:
+        for match in pattern.finditer(text_lower):
             try:
-                parsed_date = datetime.strptime(result['date'], '%Y-%m-%d')
-                result['date'] = parsed_date.strftime('%Y-%m-%d')
-            except:
-                result['date'] = datetime.now().strftime('%Y-%m-%d')
-        else:
-            result['date'] = datetime.now().strftime('%Y-%m-%d')
-        
-        # Ensure numeric values
-        result['amount'] = float(result.get('amount', 0.0)) if result.get('amount') else 0.0
-        result['tax'] = float(result.get('tax', 0.0)) if result.get('tax') else 0.0
-        
-        # Ensure valid category
-        valid_categories = ['Food', 'Travel', 'Office', 'Entertainment', 'Other']
-        if result.get('category') not in valid_categories:
-            result['category'] = 'Other'
-        
-        # Ensure currency is set (default to USD if not detected)
-        if not result.get('currency'):
-            result['currency'] = 'USD'
-        
-        return result
-        
-    except Exception as e:
-        print(f"Error with AI extraction: {str(e)}")
-        # Fallback to regex extraction
-        return extract_fallback(text)
+                month = _MONTHS.index(match.group(month_group)) + 1
+                parsed = datetime(int(match.group(year_group)), month, int(match.group(day_group))).date()
+            except ValueError:
+                continue
+            if parsed <= today:
+                return parsed, match.span()
+    return None, None
+
+def _first_number(patterns, text_lower, skip_span):
+    """Value of the first pattern (in priority order) that matches outside skip_span"""
+    for pattern in patterns:
+        for match in pattern.finditer(text_lower):
+            if skip_span and match.start(1) < skip_span[1] and match.end(1) > skip_span[0]:
+                continue
+            return float(match.group(1))
+    return 0.0
 
 def extract_fallback(text):
     """Fallback method using regex if AI fails"""
     try:
-        # Basic amount extraction - look for currency symbols and decimal numbers
-        amount_patterns = [
-            r'₹\s*(\d+\.?\d*)',  # Indian Rupee
-            r'\$\s*(\d+\.?\d*)',  # Dollar
-            r'€\s*(\d+\.?\d*)',   # Euro
-            r'£\s*(\d+\.?\d*)',   # Pound
-            r'total[:\s]*\$?₹?\s*(\d+\.?\d*)', # Total amount
-            r'amount[:\s]*\$?₹?\s*(\d+\.?\d*)', # Amount
-            r'(\d+\.\d{2})'       # Any decimal number with 2 decimal places
-        ]
-        
-        amount = 0.0
-        for pattern in amount_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                amount = float(match.group(1))
-                break
+        text_lower = text.lower()
         
-        # Basic vendor extraction (first meaningful line)
-        lines = [line.strip() for line in text.strip().split('\n') if line.strip()]
-        vendor = "Unknown Vendor"
-        if lines:
-            # Skip common header words and take first substantial line
-            skip_words = ['receipt', 'invoice', 'bill', 'tax', 'gst', 'date', 'time']
-            for line in lines[:5]:  # Check first 5 lines
-                if len(line) > 3 and not any(word in line.lower() for word in skip_words):
-                    vendor = line[:50]  # Limit length
-                    break
+        # Basic currency detection
+        currency = next((code for symbol, code in _CURRENCY_SYMBOLS if symbol in text), 'USD')
         
-        # Basic tax extraction
-        tax_patterns = [
-            r'tax[:\s]*\$?₹?\s*(\d+\.?\d*)',
-            r'gst[:\s]*\$?₹?\s*(\d+\.?\d*)',
-            r'vat[:\s]*\$?₹?\s*(\d+\.?\d*)'
-        ]
+        # Receipt date; currency disambiguates dd/mm vs mm/dd
+        receipt_date, date_span = _find_date(text_lower, currency)
         
-        tax = 0.0
-        for pattern in tax_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                tax = float(match.group(1))
-                break
+        # Amount and tax; numbers inside the date (30.07 of 30.07.2007) are skipped
+        amount = _first_number(_AMOUNT_PATTERNS, text_lower, date_span)
+        tax = _first_number(_TAX_PATTERNS, text_lower, date_span)
         
         # If no tax found, estimate based on amount (18% GST common in India)
         if tax == 0.0 and amount > 0:
             tax = round(amount * 0.18, 2)
         
-        # Basic currency detection
-        currency = 'USD'  # Default
-        currency_patterns = [
-            (r'₹', 'INR'),
-            (r'€', 'EUR'),
-            (r'£', 'GBP'),
-            (r'¥', 'JPY'),
-            (r'C\$', 'CAD'),
-            (r'A\$', 'AUD'),
-            (r'\$', 'USD')  # USD last as fallback
-        ]
-        
-        for pattern, curr in currency_patterns:
-            if re.search(pattern, text):
-                currency = curr
+        # Basic vendor extraction (first meaningful line)
+        vendor = "Unknown Vendor"
+        lines = [line.strip() for line in text.strip().split('\n') if line.strip()]
+        for line in lines[:5]:  # Check first 5 lines
+            if len(line) > 3 and not _SKIP_MATCHER.contains_any(line.lower()):
+                vendor = line[:50]  # Limit length
                 break
         
-        # Basic category detection based on keywords
-        category = 'Other'
-        food_keywords = ['restaurant', 'cafe', 'food', 'dining', 'pizza', 'burger', 'coffee']
-        travel_keywords = ['hotel', 'flight', 'taxi', 'uber', 'ola', 'gas', 'petrol']
-        office_keywords = ['office', 'supplies', 'stationery', 'computer', 'software']
-        entertainment_keywords = ['movie', 'cinema', 'game', 'entertainment', 'fun']
-        
-        text_lower = text.lower()
-        if any(keyword in text_lower for keyword in food_keywords):
-            category = 'Food'
-        elif any(keyword in text_lower for keyword in travel_keywords):
-            category = 'Travel'
-        elif any(keyword in text_lower for keyword in office_keywords):
-            category = 'Office'
-        elif any(keyword in text_lower for keyword in entertainment_keywords):
-            category = 'Entertainment'
+        category = _CATEGORY_MATCHER.first(text_lower) or 'Other'
         
         return {
             'vendor': vendor,
             'amount': amount,
             'currency': currency,
-            'date': datetime.now().strftime('%Y-%m-%d'),
+            'date': (receipt_date or datetime.now().date()).strftime('%Y-%m-%d'),
             'category': category,
             'tax': tax
         }
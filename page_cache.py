@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import namedtuple, OrderedDict
+from sqlalchemy import event
+from models import Receipt
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Rendered HTML for the dashboard and pricing pages. A dashboard entry is
+# keyed by user, UserAggregate.version (bumped on every receipt write, even
+# from an OCR worker) and whatever else the page shows, so a visit with
+# nothing new costs one primary-key read instead of the receipt and totals
+# queries plus a template render. Each entry carries a content ETag and the
+# time it was rendered; the app answers If-None-Match / If-Modified-Since
+# with a 304 from those alone.
+#
+# invalidate(user_id) drops a user's entries at once. The upload routes call
+# it and deleting a Receipt does (see below); every key also includes the
+# user's generation counter, so a shared backend never needs a key scan.
+#
+# PAGE_CACHE_BACKEND=local keeps entries in this process (LRU, byte budget).
+# PAGE_CACHE_BACKEND=redis shares them between app servers (needs redis-py);
+# PAGE_CACHE_URL can point it at a local Redis or Valkey.
+
+PAGE_CACHE_BACKEND = os.environ.get("PAGE_CACHE_BACKEND", "local")
+PAGE_CACHE_URL = os.environ.get("PAGE_CACHE_URL", "redis://localhost:6379/0")
+PAGE_CACHE_PREFIX = os.environ.get("PAGE_CACHE_PREFIX", "receipts:page:")
+
+Page = namedtuple('Page', 'body etag last_modified')
+
+class LocalBackend:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] < time.monotonic():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (time.monotonic() + ttl if ttl else None, value)
+            self._bytes += len(value)
+            while self._entries and self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes}
+
+class RedisBackend:
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("PAGE_CACHE_BACKEND=redis requires redis-py (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=int(ttl) if ttl else None)
+
+    def counter(self, key):
+        return int(self.client.get(key) or 0)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+    def stats(self):
+        return {'backend': 'redis'}
+
+class PageCache:
+    def __init__(self, backend, ttl=300, prefix='', enabled=True):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, page, variant, owner):
+        parts = [page, hashlib.sha1(repr(variant).encode()).hexdigest()]
+        if owner is not None:
+            parts[1:1] = [str(owner), str(self.backend.counter(f"{self.prefix}gen:{owner}"))]
+        return self.prefix + ':'.join(parts)
+
+    def get(self, page, variant, owner=None):
+        """Cached Page for page/variant (and owner's current generation), or None.
+        variant is anything with a stable repr that the rendered page depends on."""
+        if not self.enabled:
+            return None
+        try:
+            raw = self.backend.get(self._key(page, variant, owner))
+        except Exception as e:
+            # A shared backend being down only costs a render
+            print(f"Page cache read failed: {str(e)}")
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry = json.loads(raw)
+        return Page(entry['body'], entry['etag'], entry['last_modified'])
+
+    def put(self, page, variant, body, owner=None):
+        """Store a rendered page and return it as a Page"""
+        entry = Page(body, hashlib.sha1(body.encode()).hexdigest(), int(time.time()))
+        if self.enabled:
+            try:
+                self.backend.set(self._key(page, variant, owner), json.dumps(entry._asdict()).encode(), self.ttl)
+            except Exception as e:
+                print(f"Page cache write failed: {str(e)}")
+        return entry
+
+    def invalidate(self, owner):
+        """Drop every cached page for owner (a user id)"""
+        if not self.enabled:
+            return
+        try:
+            self.backend.incr(f"{self.prefix}gen:{owner}")
+        except Exception as e:
+            print(f"Page cache invalidation failed: {str(e)}")
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, **self.backend.stats()}
+
+def create_backend():
+    if PAGE_CACHE_BACKEND == 'redis':
+        return RedisBackend(PAGE_CACHE_URL)
+    return LocalBackend(max_bytes=int(os.environ.get("PAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))))
+
+page_cache = PageCache(
+    create_backend(),
+    ttl=float(os.environ.get("PAGE_CACHE_TTL", "300")),
+    prefix=PAGE_CACHE_PREFIX,
+    enabled=os.environ.get("PAGE_CACHE_ENABLED", "1") == "1",
+)
+
+@event.listens_for(Receipt, 'after_delete')
+def _receipt_deleted(mapper, connection, target):
+    page_cache.invalidate(target.user_id)
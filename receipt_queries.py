@@ -0,0 +1,106 @@
+import json
+import base64
+import binascii
+from datetime import date, datetime
+from sqlalchemy import select, tuple_
+from models import Receipt
+
+# Keyset pagination over one user's receipts, newest first. A cursor is the
+# (created_at, id) of the last row served, so each page is a single range
+# scan of the (user_id, created_at) index no matter how deep the user has
+# scrolled; OFFSET would read and discard every earlier row.
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+FIELDS = ['id', 'vendor', 'amount', 'currency', 'date', 'category', 'tax_amount', 'status', 'filename', 'created_at']
+
+class InvalidQuery(ValueError):
+    """Malformed cursor, filter or field list"""
+
+def encode_cursor(created_at, receipt_id):
+    raw = json.dumps([created_at.isoformat(), receipt_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, receipt_id = json.loads(raw)
+        created_at, receipt_id = datetime.fromisoformat(created_at), int(receipt_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidQuery('Invalid cursor')
+    # Out of range for an INTEGER column: the driver would fail, not the query
+    if not 0 <= receipt_id < 2 ** 63:
+        raise InvalidQuery('Invalid cursor')
+    return created_at, receipt_id
+
+def parse_filters(args):
+    """Filters from query-string style args (category, vendor, currency, status, date_from, date_to)"""
+    filters = {}
+    for name in ('category', 'vendor', 'currency', 'status'):
+        value = (args.get(name) or '').strip()
+        if value:
+            filters[name] = value
+    for name in ('date_from', 'date_to'):
+        value = (args.get(name) or '').strip()
+        if value:
+            try:
+                filters[name] = date.fromisoformat(value)
+            except ValueError:
+                raise InvalidQuery(f'{name} must be YYYY-MM-DD')
+    return filters
+
+def parse_fields(value):
+    """Sparse field list from 'vendor,amount,...'; all fields when empty"""
+    if not value:
+        return list(FIELDS)
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in FIELDS]
+    if unknown:
+        raise InvalidQuery(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def receipts_page(session, user_id, cursor=None, limit=PAGE_SIZE, filters=None, fields=None):
+    """One page of a user's receipts as {'receipts', 'next_cursor', 'has_more'}.
+    Works with both the Flask-SQLAlchemy session and a plain SQLAlchemy one."""
+    fields = fields or FIELDS
+    filters = filters or {}
+    limit = max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+
+    # id and created_at are always read: they make up the cursor
+    columns = [getattr(Receipt, name) for name in dict.fromkeys(['id', 'created_at', *fields])]
+    query = select(*columns).where(Receipt.user_id == user_id)
+    if 'category' in filters:
+        query = query.where(Receipt.category == filters['category'])
+    if 'currency' in filters:
+        query = query.where(Receipt.currency == filters['currency'].upper())
+    if 'status' in filters:
+        query = query.where(Receipt.status == filters['status'])
+    if 'vendor' in filters:
+        query = query.where(Receipt.vendor.ilike(f"%{_escape_like(filters['vendor'])}%", escape='\\'))
+    if 'date_from' in filters:
+        query = query.where(Receipt.date >= filters['date_from'])
+    if 'date_to' in filters:
+        query = query.where(Receipt.date <= filters['date_to'])
+    if cursor:
+        created_at, receipt_id = decode_cursor(cursor)
+        query = query.where(tuple_(Receipt.created_at, Receipt.id) < (created_at, receipt_id))
+
+    # One extra row tells whether another page exists
+    query = query.order_by(Receipt.created_at.desc(), Receipt.id.desc()).limit(limit + 1)
+    rows = session.execute(query).mappings().all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'receipts': [{name: row[name] for name in fields} for row in rows],
+        'next_cursor': encode_cursor(rows[-1]['created_at'], rows[-1]['id']) if has_more else None,
+        'has_more': has_more
+    }
+
+def page_json(page):
+    """The page with dates as ISO 8601 strings"""
+    def convert(value):
+        return value.isoformat() if isinstance(value, (date, datetime)) else value
+    return {**page, 'receipts': [{name: convert(value) for name, value in receipt.items()} for receipt in page['receipts']]}
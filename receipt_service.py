@@ -0,0 +1,176 @@
+from datetime import datetime
+from sqlalchemy import create_engine, func, select, update, bindparam
+from sqlalchemy.orm import sessionmaker
+from models import User, Receipt, UserAggregate, MonthlyAggregate, parse_receipt_date
+import aggregates  # noqa: F401  keeps dashboard totals current on writes
+import metrics
+import fx_rates
+from job_queue import enqueue
+from receipt_queries import receipts_page, PAGE_SIZE
+
+# Receipt operations shared by the Flask app, the Streamlit app and the OCR
+# workers. Every function takes the caller's SQLAlchemy session (Flask's
+# db.session or a plain one from session_factory), so both front ends get the
+# same queries, limits and write batching.
+#
+# Anything derived from a user's receipts can be cached under
+# data_version(): it changes with every receipt write (see aggregates.py).
+
+ENGINE_OPTIONS = {
+    "pool_recycle": 300,
+    "pool_pre_ping": True,
+}
+FREE_RECEIPT_LIMIT = 10
+EXPORT_BATCH_SIZE = 1000
+
+def session_factory(database_url, pool_size=5, max_overflow=10):
+    """Sessions on a pooled engine configured like the Flask app's"""
+    engine = create_engine(database_url, pool_size=pool_size, max_overflow=max_overflow, **ENGINE_OPTIONS)
+    return sessionmaker(bind=engine)
+
+# --- Users ---
+
+def get_or_create_user(session, email):
+    user = session.query(User).filter_by(email=email).first()
+    if not user:
+        user = User(email=email)
+        session.add(user)
+        session.commit()
+    return user
+
+def remaining_uploads(user):
+    """Receipts the user may still add, or None when unlimited"""
+    if user.plan != 'free':
+        return None
+    return max(FREE_RECEIPT_LIMIT - (user.receipt_count or 0), 0)
+
+# --- Ingest ---
+
+def apply_extraction(receipt, receipt_data, ocr_text=None):
+    """Copy extracted fields onto a receipt and mark it processed"""
+    receipt.vendor = receipt_data.get('vendor', 'Unknown')
+    receipt.amount = receipt_data.get('amount', 0.0)
+    receipt.currency = receipt_data.get('currency', 'USD')
+    receipt.date = parse_receipt_date(receipt_data.get('date')) or datetime.now().date()
+    receipt.category = receipt_data.get('category', 'Other')
+    receipt.tax_amount = receipt_data.get('tax', 0.0)
+    # Materialized so totals are a plain SUM (see fx_rates.py)
+    rates = fx_rates.get_rates()
+    receipt.home_amount = rates.convert(receipt.amount, receipt.currency, receipt.date)
+    receipt.home_tax_amount = rates.convert(receipt.tax_amount, receipt.currency, receipt.date)
+    receipt.ocr_text = ocr_text
+    receipt.status = 'done'
+    return receipt
+
+def build_receipt(user_id, filename, receipt_data, ocr_text=None):
+    return apply_extraction(Receipt(user_id=user_id, filename=filename), receipt_data, ocr_text)
+
+def save_receipts(session, user, receipts):
+    """Add extracted receipts in one transaction with a single receipt_count update"""
+    if not receipts:
+        return 0
+    session.add_all(receipts)
+    user.receipt_count = (user.receipt_count or 0) + len(receipts)
+    with metrics.timed('db_commit'):
+        session.commit()
+    return len(receipts)
+
+def queue_receipt(session, user, key):
+    """Save a pending receipt for a stored image (image_store key) and queue
+    it for the OCR workers; returns (receipt, job_id)"""
+    receipt = Receipt(user_id=user.id, filename=key, status='pending')
+    session.add(receipt)
+    user.receipt_count = (user.receipt_count or 0) + 1
+    with metrics.timed('db_commit'):
+        session.commit()
+    try:
+        job_id = enqueue(receipt.id, key)
+    except Exception:
+        session.delete(receipt)
+        user.receipt_count -= 1
+        session.commit()
+        raise
+    return receipt, job_id
+
+def missing_rates_warning(connection):
+    """Warning text when receipts in other currencies exist but no FX rates
+    are loaded (so they are left out of the totals), else None"""
+    if fx_rates.get_rates().series:
+        return None
+    receipts = Receipt.__table__
+    foreign = connection.execute(
+        select(func.count()).select_from(receipts)
+        .where(func.upper(func.coalesce(receipts.c.currency, 'USD')) != fx_rates.HOME_CURRENCY)
+    ).scalar()
+    if not foreign:
+        return None
+    return (f"{foreign} receipts are not in {fx_rates.HOME_CURRENCY} but no FX rates are loaded from "
+            f"{fx_rates.FX_RATES_PATH}; they stay out of the totals until you run "
+            f"`flask --app main load-fx-rates <file>` and `flask --app main reconvert-amounts`")
+
+def reconvert_amounts(connection, user_id=None):
+    """Recompute every receipt's home amounts from the current rate table,
+    vectorized over all rows. Bypasses the ORM, so follow it with
+    aggregates.rebuild(). Returns the number of receipts updated."""
+    receipts = Receipt.__table__
+    query = select(receipts.c.id, receipts.c.amount, receipts.c.tax_amount, receipts.c.currency, receipts.c.date)
+    if user_id is not None:
+        query = query.where(receipts.c.user_id == user_id)
+    rows = connection.execute(query).all()
+    if not rows:
+        return 0
+    ids, amounts, taxes, currencies, dates = zip(*rows)
+    currencies = [currency or 'USD' for currency in currencies]
+    rates = fx_rates.get_rates()
+    home_amounts = rates.convert_many([amount or 0.0 for amount in amounts], currencies, dates)
+    home_taxes = rates.convert_many([tax or 0.0 for tax in taxes], currencies, dates)
+    connection.execute(
+        update(receipts).where(receipts.c.id == bindparam('receipt_id'))
+        .values(home_amount=bindparam('home'), home_tax_amount=bindparam('home_tax')),
+        [
+            {'receipt_id': receipt_id,
+             'home': None if home != home else float(home),
+             'home_tax': None if home_tax != home_tax else float(home_tax)}
+            for receipt_id, home, home_tax in zip(ids, home_amounts, home_taxes)
+        ]
+    )
+    return len(ids)
+
+# --- Reads ---
+
+def data_version(session, user_id):
+    totals = session.get(UserAggregate, user_id)
+    return totals.version if totals else 0
+
+def list_receipts(session, user_id, cursor=None, limit=PAGE_SIZE, filters=None, fields=None):
+    return receipts_page(session, user_id, cursor=cursor, limit=limit, filters=filters, fields=fields)
+
+def dashboard_totals(session, user_id):
+    """Receipt count, home-currency amount and tax totals plus per-category
+    amounts, from the aggregate tables"""
+    totals = session.get(UserAggregate, user_id)
+    category_totals = dict(
+        session.query(MonthlyAggregate.category, func.sum(MonthlyAggregate.total_amount))
+        .filter_by(user_id=user_id)
+        .group_by(MonthlyAggregate.category)
+        .all()
+    )
+    return {
+        'receipt_total': totals.receipt_count if totals else 0,
+        'total_amount': totals.total_amount if totals else 0,
+        'total_tax': totals.total_tax if totals else 0,
+        'unconverted_count': totals.unconverted_count if totals else 0,
+        'home_currency': fx_rates.HOME_CURRENCY,
+        'category_totals': category_totals,
+        'version': totals.version if totals else 0
+    }
+
+def export_rows(session, user_id):
+    """Processed receipts with only the exported columns, fetched in batches"""
+    return (
+        session.query(Receipt.vendor, Receipt.amount, Receipt.currency, Receipt.date,
+                      Receipt.category, Receipt.tax_amount, Receipt.home_amount, Receipt.created_at)
+        .filter_by(user_id=user_id, status='done')
+        .order_by(Receipt.date.desc())
+        .yield_per(EXPORT_BATCH_SIZE)
+    )
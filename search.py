@@ -0,0 +1,149 @@
+import re
+from sqlalchemy import text, inspect
+from models import Receipt
+
+# Full-text search over receipt vendor, category and OCR text.
+#
+# SQLite: an FTS5 table kept in sync by triggers on receipt. Each row also
+# carries an "owner" token (u<user_id>), so a user's search intersects the
+# posting lists inside the index instead of matching every user's receipts
+# and filtering afterwards.
+# PostgreSQL: a stored, generated tsvector column with a GIN index.
+# Anything else (or SQLite built without FTS5) falls back to LIKE scans.
+#
+# Every search term is prefix-matched ("ube" finds Uber); results are
+# ranked with vendor matches above category above OCR text.
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MAX_TERMS = 8
+
+RESULT_FIELDS = ['id', 'vendor', 'amount', 'currency', 'date', 'category', 'tax_amount', 'status', 'created_at']
+
+_SQLITE_SCHEMA = [
+    """CREATE VIRTUAL TABLE receipt_fts USING fts5(
+        owner, vendor, category, ocr_text,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )""",
+    """CREATE TRIGGER receipt_fts_insert AFTER INSERT ON receipt BEGIN
+        INSERT INTO receipt_fts (rowid, owner, vendor, category, ocr_text)
+        VALUES (new.id, 'u' || new.user_id, new.vendor, new.category, new.ocr_text);
+    END""",
+    """CREATE TRIGGER receipt_fts_delete AFTER DELETE ON receipt BEGIN
+        DELETE FROM receipt_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER receipt_fts_update AFTER UPDATE OF user_id, vendor, category, ocr_text ON receipt BEGIN
+        DELETE FROM receipt_fts WHERE rowid = old.id;
+        INSERT INTO receipt_fts (rowid, owner, vendor, category, ocr_text)
+        VALUES (new.id, 'u' || new.user_id, new.vendor, new.category, new.ocr_text);
+    END""",
+    """INSERT INTO receipt_fts (rowid, owner, vendor, category, ocr_text)
+        SELECT id, 'u' || user_id, vendor, category, ocr_text FROM receipt""",
+]
+
+_POSTGRES_SCHEMA = [
+    """ALTER TABLE receipt ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(vendor, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(category, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(ocr_text, '')), 'C')
+    ) STORED""",
+    "CREATE INDEX ix_receipt_search_vector ON receipt USING GIN (search_vector)",
+]
+
+def _has_fts5(conn):
+    try:
+        return conn.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar() == 1
+    except Exception:
+        return False
+
+def backend(conn):
+    """'fts5', 'postgres' or 'like' for this database"""
+    if conn.dialect.name == 'postgresql':
+        return 'postgres'
+    if conn.dialect.name == 'sqlite' and _has_fts5(conn):
+        return 'fts5'
+    return 'like'
+
+def install(conn):
+    """Create the search index (and fill it from existing receipts) if missing"""
+    kind = backend(conn)
+    if kind == 'fts5':
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'receipt_fts'")).first()
+        statements = [] if exists else _SQLITE_SCHEMA
+    elif kind == 'postgres':
+        columns = {c['name'] for c in inspect(conn).get_columns('receipt')}
+        statements = [] if 'search_vector' in columns else _POSTGRES_SCHEMA
+    else:
+        print("Full-text search index unavailable; receipt search will use LIKE scans")
+        statements = []
+    for statement in statements:
+        conn.execute(text(statement))
+
+def search_terms(query):
+    """Lowercased word tokens of a search box query"""
+    return re.findall(r'\w+', (query or '').lower())[:MAX_TERMS]
+
+def _date_clauses(filters, params):
+    clauses = []
+    if 'date_from' in filters:
+        clauses.append("r.date >= :date_from")
+        params['date_from'] = filters['date_from']
+    if 'date_to' in filters:
+        clauses.append("r.date <= :date_to")
+        params['date_to'] = filters['date_to']
+    for name in ('category', 'currency', 'status'):
+        if name in filters:
+            clauses.append(f"r.{name} = :{name}")
+            params[name] = filters[name].upper() if name == 'currency' else filters[name]
+    return clauses
+
+def search_receipts(session, user_id, query, filters=None, limit=SEARCH_LIMIT):
+    """Best matches first, as dicts of RESULT_FIELDS plus 'rank' (higher is better).
+    filters takes the same keys as receipt_queries.parse_filters."""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    filters = filters or {}
+    limit = max(1, min(int(limit or SEARCH_LIMIT), MAX_SEARCH_LIMIT))
+    conn = session.connection()
+    kind = backend(conn)
+    params = {'user_id': user_id, 'limit': limit}
+    columns = ', '.join(f"r.{name}" for name in RESULT_FIELDS)
+
+    if kind == 'fts5':
+        # Quoted terms cannot be read as FTS5 operators; * makes them prefixes.
+        # They only look at the text columns, so "u12" cannot match an owner token.
+        params['match'] = (f'owner : u{int(user_id)} AND {{vendor category ocr_text}} : ('
+                           + ' AND '.join(f'"{term}"*' for term in terms) + ')')
+        where = ["receipt_fts MATCH :match", "r.user_id = :user_id"] + _date_clauses(filters, params)
+        sql = f"""
+            SELECT {columns}, -bm25(receipt_fts, 0.0, 10.0, 4.0, 1.0) AS rank
+            FROM receipt_fts JOIN receipt r ON r.id = receipt_fts.rowid
+            WHERE {' AND '.join(where)}
+            ORDER BY rank DESC LIMIT :limit
+        """
+    elif kind == 'postgres':
+        params['tsquery'] = ' & '.join(f"{term}:*" for term in terms)
+        where = ["r.search_vector @@ to_tsquery('simple', :tsquery)", "r.user_id = :user_id"] + _date_clauses(filters, params)
+        sql = f"""
+            SELECT {columns}, ts_rank(r.search_vector, to_tsquery('simple', :tsquery)) AS rank
+            FROM receipt r
+            WHERE {' AND '.join(where)}
+            ORDER BY rank DESC, r.created_at DESC LIMIT :limit
+        """
+    else:
+        where = ["r.user_id = :user_id"] + _date_clauses(filters, params)
+        for i, term in enumerate(terms):
+            params[f'term{i}'] = f"%{term}%"
+            where.append(f"(lower(r.vendor) LIKE :term{i} OR lower(r.category) LIKE :term{i} OR lower(r.ocr_text) LIKE :term{i})")
+        sql = f"""
+            SELECT {columns}, 0.0 AS rank
+            FROM receipt r
+            WHERE {' AND '.join(where)}
+            ORDER BY r.created_at DESC LIMIT :limit
+        """
+
+    # Typed columns (dates, numerics) come back the same as through the ORM
+    statement = text(sql).columns(*[getattr(Receipt, name) for name in RESULT_FIELDS])
+    return [dict(row) for row in session.execute(statement, params).mappings()]
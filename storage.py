@@ -0,0 +1,106 @@
+import os
+import hashlib
+import tempfile
+from PIL import Image
+import image_store
+
+# Uploaded images are stored once per distinct content, keyed by the SHA-256
+# of the bytes, so re-uploading the same receipt reuses the stored copy. The
+# request only stages the original bytes; OCR reads them and the worker then
+# replaces them with the archival re-encode and thumbnail (image_store.promote).
+# Only the image header is parsed here, to reject unreadable files early.
+#
+# Uploads are copied to a temp file in CHUNK_SIZE pieces, hashed, size-checked
+# and checked for a PNG/JPEG signature on the way, so a request never holds a
+# second full copy of the image and bad files are rejected mid-stream.
+
+CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_SIZE = 16 * 1024 * 1024  # per image, same as the app's request cap
+
+IMAGE_SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'png',
+    b'\xff\xd8\xff': 'jpg',
+}
+
+class InvalidUpload(ValueError):
+    """The upload is not a PNG/JPEG image or is over the size limit"""
+
+def check_image(head):
+    """File extension ('png' or 'jpg') for head; raises InvalidUpload unless
+    it starts like a PNG or JPEG file"""
+    for signature, extension in IMAGE_SIGNATURES.items():
+        if bytes(head[:len(signature)]) == signature:
+            return extension
+    raise InvalidUpload('File is not a PNG or JPEG image')
+
+def check_size(size, max_size=MAX_UPLOAD_SIZE):
+    if size > max_size:
+        raise InvalidUpload('File too large')
+
+def file_sha256(path):
+    """Hex SHA-256 of a file (a path, or a binary file read from the
+    start and rewound), read in chunks"""
+    digest = hashlib.sha256()
+    f = open(path, 'rb') if isinstance(path, str) else path
+    try:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    finally:
+        if f is path:
+            f.seek(0)
+        else:
+            f.close()
+    return digest.hexdigest()
+
+def _commit(source, sha256, extension):
+    """Stage an upload unless its content is already stored.
+    Returns (key, sha256, created)."""
+    for key in (image_store.image_key(sha256), image_store.original_key(sha256, extension)):
+        if image_store.store.exists(key):
+            return key, sha256, False
+    try:
+        # Header only: no pixels are decoded on the request path
+        with Image.open(source):
+            pass
+    except (OSError, Image.DecompressionBombError):
+        raise InvalidUpload('Image could not be read')
+    if not isinstance(source, str):
+        source.seek(0)
+    return image_store.stage(source, sha256, extension), sha256, True
+
+def save_stream(stream, max_size=MAX_UPLOAD_SIZE):
+    """Store an upload read from a binary stream under its content hash.
+    Returns (key, sha256, created); raises InvalidUpload."""
+    fd, tmp_path = tempfile.mkstemp(suffix='.part')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                if size == 0:
+                    extension = check_image(chunk)
+                size += len(chunk)
+                check_size(size, max_size)
+                digest.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise InvalidUpload('File is empty')
+        return _commit(tmp_path, digest.hexdigest(), extension)
+    finally:
+        os.remove(tmp_path)
+
+def save_upload(file):
+    """Store a Werkzeug FileStorage under its content hash.
+    Returns (key, sha256, created)."""
+    return save_stream(file.stream)
+
+def save_buffer(buffer):
+    """Store an in-memory upload (an io.BytesIO, such as a Streamlit
+    UploadedFile) under its content hash without copying its bytes.
+    Returns (key, sha256, created)."""
+    with buffer.getbuffer() as data:
+        extension = check_image(data)
+        check_size(len(data))
+        sha256 = hashlib.sha256(data).hexdigest()
+    buffer.seek(0)
+    return _commit(buffer, sha256, extension)
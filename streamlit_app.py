@@ -1,37 +1,43 @@
 import streamlit as st
 import os
 import pandas as pd
-from datetime import datetime, timedelta
-from flask import Flask, session
-from models import User, Receipt
 from ocr_processor import extract_receipt_data
-from export_utils import create_excel_export
-import sqlite3
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
-
-# Initialize Flask app for session management
-flask_app = Flask(__name__)
-flask_app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
-
-# Configure the database
-flask_app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///receipts.db")
-flask_app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+from export_utils import stream_excel_export
+from receipt_queries import parse_filters
+from storage import save_buffer, InvalidUpload
+from batch_processor import extract_batch
+import image_store
+import receipt_service
 
 # Set up SQLAlchemy engine and session for Streamlit
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///receipts.db")
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
-session_db = Session()
+DB_POOL_SIZE = int(os.environ.get("STREAMLIT_DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("STREAMLIT_DB_MAX_OVERFLOW", "10"))
+QUERY_CACHE_TTL = int(os.environ.get("STREAMLIT_QUERY_CACHE_TTL", "600"))
 
-# Ensure upload directory exists
-os.makedirs('static/uploads', exist_ok=True)
-os.makedirs('exports', exist_ok=True)
+@st.cache_resource
+def get_session_factory():
+    """One pooled engine per server process, shared by every browser session"""
+    return receipt_service.session_factory(DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+
+Session = get_session_factory()
+
+# Query results below are keyed on the data version, so an upload from any
+# session or process makes the next run read fresh rows instead of waiting
+# out the TTL
+
+@st.cache_data(ttl=QUERY_CACHE_TTL, max_entries=1000)
+def load_receipts_page(user_id, version, filters, cursor=None):
+    with Session() as s:
+        return receipt_service.list_receipts(s, user_id, cursor=cursor, filters=filters, fields=DASHBOARD_FIELDS)
+
+@st.cache_data(ttl=QUERY_CACHE_TTL, max_entries=50)
+def load_excel_export(user_id, version):
+    with Session() as s:
+        return b''.join(stream_excel_export(receipt_service.export_rows(s, user_id)))
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+DASHBOARD_FIELDS = ['vendor', 'amount', 'currency', 'date', 'category', 'tax_amount']
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -54,132 +60,163 @@ if 'free_uploads' not in st.session_state:
 if 'free_receipts' not in st.session_state:
     st.session_state['free_receipts'] = []
 
-# --- LOGIN/LOGOUT ---
-login_col, spacer, logout_col = st.columns([2,1,2])
-with login_col:
-    if 'user_email' not in st.session_state or not st.session_state.user_email:
-        st.subheader("Login (optional)")
-        email = st.text_input("Email", key="login_email")
-        if st.button("Login"):
-            if email and '@' in email:
-                user = session_db.query(User).filter_by(email=email).first()
-                if not user:
-                    user = User(email=email)
-                    session_db.add(user)
-                    session_db.commit()
-                st.session_state.user_email = email
-                st.experimental_rerun()
-            else:
-                st.error("Please enter a valid email address.")
-    else:
-        st.subheader(f"Logged in as: {st.session_state.user_email}")
-with logout_col:
-    if 'user_email' in st.session_state and st.session_state.user_email:
-        if st.button("Logout"):
-            st.session_state.user_email = None
-            st.experimental_rerun()
-
-# --- FREE USER SECTION ---
-if 'user_email' not in st.session_state or not st.session_state.user_email:
-    st.info(f"You can upload and process {5 - st.session_state['free_uploads']} receipts for free without logging in.")
-    with st.container():
-        st.markdown("### Free Upload (No Login Required)")
-        if st.session_state['free_uploads'] < 5:
-            uploaded_file = st.file_uploader("Choose a receipt image (PNG, JPG, JPEG)", type=ALLOWED_EXTENSIONS, key='free_upload')
-            if uploaded_file is not None:
-                if allowed_file(uploaded_file.name):
-                    filename = f"free_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uploaded_file.name}"
-                    filepath = os.path.join('static/uploads', filename)
-                    with open(filepath, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    receipt_data = extract_receipt_data(filepath)
-                    if receipt_data:
-                        st.session_state['free_uploads'] += 1
-                        st.session_state['free_receipts'].append(receipt_data)
-                        st.success(f"Receipt processed successfully! You have {5 - st.session_state['free_uploads']} free uploads left.")
-                    else:
-                        st.error("Could not process receipt. Please try a clearer image.")
+# Each script run (one user interaction) gets its own session, closed when
+# the run ends, including on st.rerun() and on errors, so concurrent users
+# never share a transaction
+with Session() as session_db:
+    # --- LOGIN/LOGOUT ---
+    login_col, spacer, logout_col = st.columns([2,1,2])
+    with login_col:
+        if 'user_email' not in st.session_state or not st.session_state.user_email:
+            st.subheader("Login (optional)")
+            email = st.text_input("Email", key="login_email")
+            if st.button("Login"):
+                if email and '@' in email:
+                    receipt_service.get_or_create_user(session_db, email)
+                    st.session_state.user_email = email
+                    st.rerun()
                 else:
-                    st.error("File type not allowed. Please upload a PNG, JPG, or JPEG.")
+                    st.error("Please enter a valid email address.")
         else:
-            st.warning("You have reached the free upload limit. Please log in to continue using the app.")
-    # --- Free User Dashboard ---
-    if st.session_state['free_receipts']:
-        st.markdown("### Your Processed Receipts (This Session)")
-        df = pd.DataFrame(st.session_state['free_receipts'])
-        st.dataframe(df, use_container_width=True)
-        # Download Excel
-        if st.button("Download Excel of These Receipts"):
-            excel_file = create_excel_export(df.to_dict(orient="records"), "free_user")
-            with open(excel_file, "rb") as f:
+            st.subheader(f"Logged in as: {st.session_state.user_email}")
+    with logout_col:
+        if 'user_email' in st.session_state and st.session_state.user_email:
+            if st.button("Logout"):
+                st.session_state.user_email = None
+                st.rerun()
+
+    # --- FREE USER SECTION ---
+    if 'user_email' not in st.session_state or not st.session_state.user_email:
+        st.info(f"You can upload and process {5 - st.session_state['free_uploads']} receipts for free without logging in.")
+        with st.container():
+            st.markdown("### Free Upload (No Login Required)")
+            if st.session_state['free_uploads'] < 5:
+                uploaded_file = st.file_uploader("Choose a receipt image (PNG, JPG, JPEG)", type=ALLOWED_EXTENSIONS, key='free_upload')
+                if uploaded_file is not None:
+                    if allowed_file(uploaded_file.name):
+                        try:
+                            # Hashed and staged from the upload's own buffer; OCR reads
+                            # the same in-memory file, then the stored copy is archived
+                            key, sha256, _ = save_buffer(uploaded_file)
+                            uploaded_file.seek(0)
+                            receipt_data = extract_receipt_data(uploaded_file, content_hash=sha256)
+                            image_store.promote(key)
+                        except (InvalidUpload, OSError) as e:
+                            st.error(f"{e}. Please upload a PNG, JPG, or JPEG.")
+                            receipt_data = None
+                        if receipt_data:
+                            st.session_state['free_uploads'] += 1
+                            st.session_state['free_receipts'].append(receipt_data)
+                            st.success(f"Receipt processed successfully! You have {5 - st.session_state['free_uploads']} free uploads left.")
+                        else:
+                            st.error("Could not process receipt. Please try a clearer image.")
+                    else:
+                        st.error("File type not allowed. Please upload a PNG, JPG, or JPEG.")
+            else:
+                st.warning("You have reached the free upload limit. Please log in to continue using the app.")
+        # --- Free User Dashboard ---
+        if st.session_state['free_receipts']:
+            st.markdown("### Your Processed Receipts (This Session)")
+            df = pd.DataFrame(st.session_state['free_receipts'])
+            st.dataframe(df, use_container_width=True)
+            # Download Excel
+            if st.button("Download Excel of These Receipts"):
+                # Built in memory from unsaved receipts; nothing is written to disk
+                rows = [receipt_service.build_receipt(None, None, data) for data in st.session_state['free_receipts']]
                 st.download_button(
                     label="Download Excel",
-                    data=f,
+                    data=b''.join(stream_excel_export(rows)),
                     file_name="receipts.xlsx",
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                 )
 
-# --- LOGGED-IN USER SECTION ---
-else:
-    st.success(f"Welcome, {st.session_state.user_email}! You have unlimited uploads.")
-    with st.container():
-        st.markdown("### Upload Receipt")
-        uploaded_file = st.file_uploader("Choose a receipt image", type=ALLOWED_EXTENSIONS, key='loggedin_upload')
-        if uploaded_file is not None:
-            if allowed_file(uploaded_file.name):
-                filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uploaded_file.name}"
-                filepath = os.path.join('static/uploads', filename)
-                with open(filepath, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                receipt_data = extract_receipt_data(filepath)
-                if receipt_data:
-                    user = session_db.query(User).filter_by(email=st.session_state.user_email).first()
-                    receipt = Receipt(
-                        user_id=user.id,
-                        filename=filename,
-                        vendor=receipt_data.get('vendor', 'Unknown'),
-                        amount=receipt_data.get('amount', 0.0),
-                        currency=receipt_data.get('currency', 'USD'),
-                        date=receipt_data.get('date', datetime.now().strftime('%Y-%m-%d')),
-                        category=receipt_data.get('category', 'Other'),
-                        tax_amount=receipt_data.get('tax', 0.0)
-                    )
-                    session_db.add(receipt)
-                    if hasattr(user, 'receipt_count'):
-                        user.receipt_count += 1
-                    session_db.commit()
-                    st.success("Receipt uploaded and processed successfully!")
-                else:
-                    st.error("Could not process receipt. Please try a clearer image.")
-            else:
-                st.error("File type not allowed. Please upload a PNG, JPG, or JPEG.")
-    # --- Logged-in User Dashboard ---
-    user = session_db.query(User).filter_by(email=st.session_state.user_email).first()
-    if user:
-        receipts = session_db.query(Receipt).filter_by(user_id=user.id).all()
-        if receipts:
+    # --- LOGGED-IN USER SECTION ---
+    else:
+        user = receipt_service.get_or_create_user(session_db, st.session_state.user_email)
+        # Same plan limit as the Flask upload routes
+        remaining = receipt_service.remaining_uploads(user)
+        if remaining is None:
+            st.success(f"Welcome, {st.session_state.user_email}! You have unlimited uploads.")
+        else:
+            st.success(f"Welcome, {st.session_state.user_email}! You have {remaining} uploads left on the free plan.")
+        with st.container():
+            st.markdown("### Upload Receipts")
+            uploaded_files = st.file_uploader("Choose receipt images", type=ALLOWED_EXTENSIONS, key='loggedin_upload', accept_multiple_files=True)
+            # The uploader keeps its files across reruns (every filter or export
+            # click), so each selected file is processed only once
+            processed = st.session_state.setdefault('processed_uploads', set())
+            new_files = [f for f in uploaded_files or [] if f.file_id not in processed]
+            if new_files:
+                stored = []
+                for uploaded_file in new_files:
+                    if remaining is not None and len(stored) >= remaining:
+                        st.error(f"{uploaded_file.name}: free limit reached. Upgrade to Pro for unlimited receipts.")
+                    elif allowed_file(uploaded_file.name):
+                        try:
+                            key, _, _ = save_buffer(uploaded_file)
+                            stored.append((uploaded_file.name, key))
+                        except InvalidUpload as e:
+                            st.error(f"{uploaded_file.name}: {e}. Please upload a PNG, JPG, or JPEG.")
+                    else:
+                        st.error(f"{uploaded_file.name}: file type not allowed. Please upload a PNG, JPG, or JPEG.")
+                # Extract all selected receipts in parallel, then save them in one commit
+                extracted = extract_batch([key for _, key in stored])
+                receipts = []
+                for (name, key), (receipt_data, _, error, ocr_text) in zip(stored, extracted):
+                    if error:
+                        st.error(f"Could not process {name}. Please try a clearer image.")
+                        continue
+                    receipts.append(receipt_service.build_receipt(user.id, image_store.archived_key(key), receipt_data, ocr_text))
+                saved = receipt_service.save_receipts(session_db, user, receipts)
+                processed.update(f.file_id for f in new_files)
+                if saved:
+                    st.success(f"{saved} receipt(s) uploaded and processed successfully!")
+        # --- Logged-in User Dashboard ---
+        if user:
             st.markdown("### Your Receipts Dashboard")
-            data = []
-            for receipt in receipts:
-                data.append({
-                    "Vendor": receipt.vendor,
-                    "Amount": receipt.amount,
-                    "Currency": receipt.currency,
-                    "Date": receipt.date,
-                    "Category": receipt.category,
-                    "Tax Amount": receipt.tax_amount
-                })
-            df = pd.DataFrame(data)
-            st.dataframe(df, use_container_width=True)
-            # Download Excel
-            if st.button("Download Excel of All Receipts"):
-                excel_file = create_excel_export(df.to_dict(orient="records"), user.email)
-                with open(excel_file, "rb") as f:
+            filter_cols = st.columns(5)
+            vendor_filter = filter_cols[0].text_input("Vendor")
+            category_filter = filter_cols[1].selectbox("Category", ['', 'Food', 'Travel', 'Office', 'Entertainment', 'Other'])
+            currency_filter = filter_cols[2].text_input("Currency")
+            date_from = filter_cols[3].date_input("From", value=None)
+            date_to = filter_cols[4].date_input("To", value=None)
+            filters = parse_filters({
+                'vendor': vendor_filter,
+                'category': category_filter,
+                'currency': currency_filter,
+                'date_from': date_from.isoformat() if date_from else '',
+                'date_to': date_to.isoformat() if date_to else ''
+            })
+
+            # Pages already loaded are kept across reruns; only "Load more" fetches
+            # the next keyset page. Changing the filters or the data starts over.
+            version = receipt_service.data_version(session_db, user.id)
+            listing_key = (user.id, version, tuple(sorted((k, str(v)) for k, v in filters.items())))
+            listing = st.session_state.get('receipt_listing')
+            if not listing or listing['key'] != listing_key:
+                page = load_receipts_page(user.id, version, filters)
+                listing = {'key': listing_key, 'rows': list(page['receipts']), 'next_cursor': page['next_cursor']}
+                st.session_state['receipt_listing'] = listing
+
+            if listing['rows']:
+                # The table is drawn after the button so a click shows the new page right away
+                table = st.empty()
+                if listing['next_cursor'] and st.button("Load more"):
+                    page = load_receipts_page(user.id, version, filters, listing['next_cursor'])
+                    listing['rows'] += page['receipts']
+                    listing['next_cursor'] = page['next_cursor']
+                df = pd.DataFrame(listing['rows'])[DASHBOARD_FIELDS]
+                df.columns = ["Vendor", "Amount", "Currency", "Date", "Category", "Tax Amount"]
+                table.dataframe(df, use_container_width=True)
+                # Download Excel of every processed receipt, streamed from the database
+                if st.button("Download Excel of All Receipts"):
                     st.download_button(
                         label="Download Excel",
-                        data=f,
+                        data=load_excel_export(user.id, version),
                         file_name="receipts.xlsx",
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                     )
-        else:
-            st.info("No receipts found. Upload your first receipt!") 
\ No newline at end of file
+            elif filters:
+                st.info("No receipts match these filters.")
+            else:
+                st.info("No receipts found. Upload your first receipt!") 
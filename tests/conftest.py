@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+
+# Every store the app touches is configured from the environment at import
+# time, so point them all at a scratch directory before anything is imported
+_SCRATCH = tempfile.mkdtemp(prefix='receipt-tests-')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(_SCRATCH, 'receipts.db')}",
+    'OCR_QUEUE_PATH': os.path.join(_SCRATCH, 'ocr_jobs.db'),
+    'EXTRACTION_CACHE_PATH': os.path.join(_SCRATCH, 'extraction_cache.db'),
+    'LLM_CACHE_PATH': os.path.join(_SCRATCH, 'llm_cache.db'),
+    'IMAGE_STORE_PATH': os.path.join(_SCRATCH, 'receipt_images'),
+    'EXPORT_CACHE_DIR': os.path.join(_SCRATCH, 'export_cache'),
+    'FX_RATES_PATH': os.path.join(_SCRATCH, 'fx_rates.csv'),
+    'IMAGE_STORE_BACKEND': 'local',
+    'PAGE_CACHE_BACKEND': 'local',
+    'BATCH_OCR_WORKERS': '2',
+})
+os.environ.pop('OPENAI_API_KEY', None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import io
+import pytest
+from PIL import Image, ImageDraw
+
+@pytest.fixture
+def receipt_png():
+    """A small receipt-like PNG, as uploaded bytes"""
+    image = Image.new('RGB', (400, 600), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((20, 20, 380, 580), outline='black')
+    draw.text((50, 50), 'Berghotel  Total 54.50', fill='black')
+    out = io.BytesIO()
+    image.save(out, 'PNG')
+    return out.getvalue()
@@ -0,0 +1,78 @@
+from datetime import date
+import pytest
+from app import app
+from db import db
+from models import MonthlyAggregate
+import receipt_service
+
+@pytest.fixture
+def session():
+    with app.app_context():
+        yield db.session
+
+def _receipt(session, user, **data):
+    data = {'vendor': 'Cafe', 'amount': 10.0, 'currency': 'USD', 'date': '2024-03-02',
+            'category': 'Food', 'tax': 1.0, **data}
+    receipt = receipt_service.build_receipt(user.id, 'images/a.webp', data)
+    receipt_service.save_receipts(session, user, [receipt])
+    return receipt
+
+def _buckets(session, user_id):
+    return {
+        (row.month, row.category): (row.receipt_count, pytest.approx(row.total_amount))
+        for row in session.query(MonthlyAggregate).filter_by(user_id=user_id)
+    }
+
+def _reconcile(user_id):
+    result = app.test_cli_runner().invoke(args=['reconcile-aggregates', '--user-id', str(user_id)])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+def test_receipt_edits_move_the_totals(session):
+    user = receipt_service.get_or_create_user(session, 'aggregates-edit@example.com')
+    first = _receipt(session, user)
+    second = _receipt(session, user, amount=20.0, tax=2.0)
+    assert _buckets(session, user.id) == {('2024-03', 'Food'): (2, 30.0)}
+
+    # New extraction for the same receipt: amount and home amount change together
+    receipt_service.apply_extraction(first, {'vendor': 'Cafe', 'amount': 12.5, 'currency': 'USD',
+                                             'date': '2024-03-02', 'category': 'Food', 'tax': 1.0})
+    session.commit()
+    totals = receipt_service.dashboard_totals(session, user.id)
+    assert totals['total_amount'] == pytest.approx(32.5)
+
+    second.category = 'Travel'
+    session.commit()
+    assert _buckets(session, user.id) == {('2024-03', 'Food'): (1, 12.5), ('2024-03', 'Travel'): (1, 20.0)}
+
+    # The emptied March bucket is deleted, not left at zero
+    second.date = date(2024, 4, 1)
+    session.commit()
+    assert _buckets(session, user.id) == {('2024-03', 'Food'): (1, 12.5), ('2024-04', 'Travel'): (1, 20.0)}
+
+    first.status = 'failed'
+    session.commit()
+    totals = receipt_service.dashboard_totals(session, user.id)
+    assert totals['receipt_total'] == 1
+    assert totals['total_amount'] == pytest.approx(20.0)
+    assert totals['total_tax'] == pytest.approx(2.0)
+    assert _buckets(session, user.id) == {('2024-04', 'Travel'): (1, 20.0)}
+
+    session.delete(second)
+    session.commit()
+    totals = receipt_service.dashboard_totals(session, user.id)
+    assert (totals['receipt_total'], totals['total_amount'], totals['total_tax']) == (0, 0, 0)
+    assert _buckets(session, user.id) == {}
+
+    assert 'No drift found' in _reconcile(user.id)
+
+def test_reconcile_reports_writes_that_bypassed_the_orm(session):
+    user = receipt_service.get_or_create_user(session, 'aggregates-drift@example.com')
+    _receipt(session, user)
+    session.query(MonthlyAggregate).filter_by(user_id=user.id).update({'total_amount': 99.0})
+    session.commit()
+
+    assert f'drifted for user(s): {user.id}' in _reconcile(user.id)
+    session.expire_all()
+    assert _buckets(session, user.id) == {('2024-03', 'Food'): (1, 10.0)}
+    assert 'No drift found' in _reconcile(user.id)
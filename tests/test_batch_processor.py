@@ -0,0 +1,45 @@
+import os
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+import batch_processor
+
+def _fake_scan(key):
+    return {'ocr_text': key, 'result': {'vendor': key}}, 0.01, {}
+
+def _crash_once(key):
+    # The first scan takes its worker down, as an OOM kill would
+    marker = os.path.join(os.environ['IMAGE_STORE_PATH'], 'crashed')
+    if not os.path.exists(marker):
+        os.makedirs(os.path.dirname(marker), exist_ok=True)
+        open(marker, 'w').close()
+        os._exit(1)
+    return _fake_scan(key)
+
+@pytest.fixture
+def fresh_pool():
+    # Pool processes are forked, so they must start after the scan is patched
+    if batch_processor._pool is not None:
+        batch_processor._reset_pool(batch_processor._pool)
+    yield
+    if batch_processor._pool is not None:
+        batch_processor._reset_pool(batch_processor._pool)
+
+def test_next_batch_works_after_a_worker_dies(monkeypatch, fresh_pool):
+    monkeypatch.setattr(batch_processor, '_scan_timed', _fake_scan)
+    pool = batch_processor._get_pool()
+    with pytest.raises(BrokenProcessPool):
+        pool.submit(os._exit, 1).result()
+
+    results = batch_processor.extract_batch(['a.webp', 'b.webp'])
+
+    assert [data for data, *_ in results] == [{'vendor': 'a.webp'}, {'vendor': 'b.webp'}]
+    assert [error for _, _, error, _ in results] == [None, None]
+    assert batch_processor._pool is not pool
+
+def test_batch_retries_receipts_lost_to_a_crash(monkeypatch, fresh_pool):
+    monkeypatch.setattr(batch_processor, '_scan_timed', _crash_once)
+
+    results = batch_processor.extract_batch(['a.webp', 'b.webp', 'c.webp'])
+
+    assert [error for _, _, error, _ in results] == [None, None, None]
+    assert [data['vendor'] for data, *_ in results] == ['a.webp', 'b.webp', 'c.webp']
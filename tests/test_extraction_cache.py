@@ -0,0 +1,44 @@
+import os
+import sqlite3
+import tempfile
+from extraction_cache import ExtractionCache
+
+def _cache(**kwargs):
+    return ExtractionCache(os.path.join(tempfile.mkdtemp(), 'cache.db'), **kwargs)
+
+def _stored(cache, sql):
+    conn = sqlite3.connect(cache.path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+def test_hits_only_touch_last_access_past_the_resolution():
+    cache = _cache(access_resolution=3600)
+    cache.put('key', {'result': 1})
+    (stored,), = _stored(cache, "SELECT last_access FROM entries")
+
+    assert cache.get('key') == {'result': 1}
+    assert _stored(cache, "SELECT last_access FROM entries") == [(stored,)]
+
+    cache.access_resolution = 0
+    assert cache.get('key') == {'result': 1}
+    assert _stored(cache, "SELECT last_access FROM entries")[0][0] > stored
+
+def test_counters_are_written_in_batches():
+    cache = _cache(flush_interval=3600)
+    cache.put('key', {'result': 1})
+    for _ in range(5):
+        cache.get('key')
+    cache.get('other')
+    cache.incr('saved_ms', 250)
+
+    # Nothing written yet, but this process's stats include what is pending
+    assert _stored(cache, "SELECT name, value FROM counters") == []
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['saved_ms']) == (5, 1, 250)
+    assert dict(_stored(cache, "SELECT name, value FROM counters")) == {'hits': 5, 'misses': 1, 'saved_ms': 250}
+
+    cache.flush_interval = 0
+    cache.get('key')
+    assert dict(_stored(cache, "SELECT name, value FROM counters"))['hits'] == 6
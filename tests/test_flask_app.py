@@ -0,0 +1,206 @@
+import io
+import base64
+from datetime import datetime
+import pytest
+import job_queue
+import ocr_processor
+from app import app, limiter
+from db import db
+from models import User, Receipt
+import image_store
+from user_cache import user_cache
+import receipt_service
+
+BERGHOTEL = {'vendor': 'Berghotel', 'amount': 54.5, 'currency': 'USD', 'date': '2024-03-02', 'category': 'Travel', 'tax': 4.5}
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(limiter, 'enabled', False)
+    return app.test_client()
+
+def _login(client, email):
+    client.post('/login', data={'email': email})
+    with app.app_context():
+        return db.session.query(User).filter_by(email=email).one().id
+
+def _set_receipt_count(user_id, count):
+    with app.app_context():
+        db.session.get(User, user_id).receipt_count = count
+        db.session.commit()
+
+def _run_queued_jobs():
+    while (job := job_queue.claim_job('test-worker')) is not None:
+        job_queue.process_job(job)
+
+def test_upload_is_refused_once_the_free_quota_is_used(client, receipt_png):
+    user_id = _login(client, 'flask-quota@example.com')
+    _set_receipt_count(user_id, receipt_service.FREE_RECEIPT_LIMIT)
+
+    response = client.post('/upload', data={'receipt': (io.BytesIO(receipt_png), 'r.png')})
+
+    assert response.status_code == 429
+    assert 'Free limit reached' in response.json['error']
+
+def test_batch_upload_stops_at_the_free_quota(client, receipt_png, monkeypatch):
+    monkeypatch.setattr('app.extract_batch', lambda keys: [(dict(BERGHOTEL), 0.1, None, 'text') for _ in keys])
+    user_id = _login(client, 'flask-batch-quota@example.com')
+    _set_receipt_count(user_id, receipt_service.FREE_RECEIPT_LIMIT - 1)
+
+    response = client.post('/upload/batch', data={'receipts': [(io.BytesIO(receipt_png), 'a.png'),
+                                                               (io.BytesIO(receipt_png), 'b.png')]})
+
+    assert response.status_code == 200
+    assert response.json['summary']['saved'] == 1
+    assert 'Free limit reached' in response.json['results'][1]['error']
+    with app.app_context():
+        assert db.session.get(User, user_id).receipt_count == receipt_service.FREE_RECEIPT_LIMIT
+
+def test_uploaded_receipt_reaches_dashboard_and_export(client, receipt_png, monkeypatch):
+    monkeypatch.setattr(ocr_processor, 'extract_receipt_data', lambda *args, **kwargs: dict(BERGHOTEL))
+    user_id = _login(client, 'flask-flow@example.com')
+
+    response = client.post('/upload', data={'receipt': (io.BytesIO(receipt_png), 'r.png')})
+    assert response.status_code == 202
+    _run_queued_jobs()
+    assert job_queue.get_job(response.json['job_id'])['status'] == 'done'
+    with app.app_context():
+        receipt = db.session.query(Receipt).filter_by(user_id=user_id).one()
+        # The worker archived the staged original after reading it
+        assert image_store.is_archived(receipt.filename)
+        receipt_id = receipt.id
+    assert client.get(f'/receipts/{receipt_id}/thumbnail').status_code == 200
+
+    dashboard = client.get(f'/dashboard/{user_id}')
+    assert dashboard.status_code == 200
+    assert 'Berghotel' in dashboard.get_data(as_text=True)
+    with app.app_context():
+        totals = receipt_service.dashboard_totals(db.session, user_id)
+    assert totals['receipt_total'] == 1
+    assert totals['total_amount'] == pytest.approx(54.5)
+
+    export = client.get(f'/export/{user_id}?format=csv')
+    assert export.status_code == 200
+    lines = export.get_data(as_text=True).splitlines()
+    assert lines[1].startswith('Berghotel,54.5,USD,2024-03-02,Travel,4.5')
+
+def test_dashboard_revalidates_with_etags(client, receipt_png, monkeypatch):
+    monkeypatch.setattr(ocr_processor, 'extract_receipt_data', lambda *args, **kwargs: dict(BERGHOTEL))
+    user_id = _login(client, 'flask-etag@example.com')
+
+    first = client.get(f'/dashboard/{user_id}')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert 'private' in first.headers['Cache-Control'] and 'no-cache' in first.headers['Cache-Control']
+
+    repeat = client.get(f'/dashboard/{user_id}', headers={'If-None-Match': etag})
+    assert repeat.status_code == 304
+    assert repeat.get_data() == b''
+
+    # Queued upload: the pending receipt changes the page, then the finished job does
+    response = client.post('/upload', data={'receipt': (io.BytesIO(receipt_png), 'r.png')})
+    assert response.status_code == 202
+    pending = client.get(f'/dashboard/{user_id}', headers={'If-None-Match': etag})
+    assert pending.status_code == 200
+    assert pending.headers['ETag'] != etag
+
+    _run_queued_jobs()
+    done = client.get(f'/dashboard/{user_id}', headers={'If-None-Match': pending.headers['ETag']})
+    assert done.status_code == 200
+    assert done.headers['ETag'] not in (etag, pending.headers['ETag'])
+    assert 'Berghotel' in done.get_data(as_text=True)
+
+def test_cached_dashboard_is_never_served_to_another_user(client):
+    first_id = _login(client, 'flask-cache-a@example.com')
+    first = client.get(f'/dashboard/{first_id}')
+    assert first.status_code == 200
+
+    other = app.test_client()
+    other_id = _login(other, 'flask-cache-b@example.com')
+    # Both dashboards are empty, but each is rendered for its own user
+    second = other.get(f'/dashboard/{other_id}', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
+    body = second.get_data(as_text=True)
+    assert 'flask-cache-b@example.com' in body and 'flask-cache-a@example.com' not in body
+
+    # Nor when asking for the other user's page outright
+    stolen = other.get(f'/dashboard/{first_id}', headers={'If-None-Match': first.headers['ETag']})
+    assert stolen.status_code != 304
+    assert 'flask-cache-a@example.com' not in stolen.get_data(as_text=True)
+
+def test_api_receipts_pages_through_shared_timestamps(client):
+    user_id = _login(client, 'flask-paging@example.com')
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        # Five receipts saved in the same instant (one batch), plus older ones
+        stamps = [datetime(2024, 5, 1, 12, 0)] * 5 + [datetime(2024, 4, 1, 9, 0), datetime(2024, 3, 1, 9, 0)]
+        receipts = [receipt_service.build_receipt(user_id, f'images/{i}.webp', dict(BERGHOTEL, vendor=f'Vendor {i}'))
+                    for i in range(len(stamps))]
+        for receipt, stamp in zip(receipts, stamps):
+            receipt.created_at = stamp
+        receipt_service.save_receipts(db.session, user, receipts)
+        expected = [receipt.id for receipt in sorted(receipts, key=lambda r: (r.created_at, r.id), reverse=True)]
+
+    seen, cursor = [], None
+    while True:
+        response = client.get('/api/receipts', query_string={'limit': 2, 'fields': 'id', **({'cursor': cursor} if cursor else {})})
+        assert response.status_code == 200
+        seen += [receipt['id'] for receipt in response.json['receipts']]
+        cursor = response.json['next_cursor']
+        if not response.json['has_more']:
+            assert cursor is None
+            break
+
+    assert seen == expected
+
+@pytest.mark.parametrize('cursor', [
+    'not a cursor!',
+    'e30',  # {}
+    base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+    base64.urlsafe_b64encode(b'null').decode(),
+    base64.urlsafe_b64encode(b'[1, 2]').decode(),
+    base64.urlsafe_b64encode(b'["2024-05-01T12:00:00", "x"]').decode(),
+    base64.urlsafe_b64encode(b'["2024-05-01T12:00:00", 1, 2]').decode(),
+    base64.urlsafe_b64encode(b'["2024-05-01T12:00:00", 100000000000000000000000000000]').decode(),
+])
+def test_api_receipts_rejects_tampered_cursors(client, cursor):
+    _login(client, 'flask-cursor@example.com')
+
+    response = client.get('/api/receipts', query_string={'cursor': cursor})
+
+    assert response.status_code == 400
+    assert response.json['error'] == 'Invalid cursor'
+
+def test_quota_changes_reach_the_next_request(client, receipt_png, monkeypatch):
+    def unreadable(*args, **kwargs):
+        raise ValueError('unreadable')
+    monkeypatch.setattr(ocr_processor, 'extract_receipt_data', unreadable)
+    user_id = _login(client, 'flask-user-cache@example.com')
+    assert '0/10 used' in client.get(f'/dashboard/{user_id}').get_data(as_text=True)
+
+    # The upload counts against the quota straight away
+    assert client.post('/upload', data={'receipt': (io.BytesIO(receipt_png), 'r.png')}).status_code == 202
+    assert '1/10 used' in client.get(f'/dashboard/{user_id}').get_data(as_text=True)
+
+    # The worker gives a failed upload back
+    _run_queued_jobs()
+    assert '0/10 used' in client.get(f'/dashboard/{user_id}').get_data(as_text=True)
+
+    # So does a plan change saved through the ORM anywhere in this process
+    with app.app_context():
+        db.session.get(User, user_id).plan = 'pro'
+        db.session.commit()
+    assert 'Pro' in client.get(f'/dashboard/{user_id}').get_data(as_text=True)
+
+def test_changes_from_other_processes_expire_with_the_ttl(client, monkeypatch):
+    user_id = _login(client, 'flask-user-cache-ttl@example.com')
+    assert '0/10 used' in client.get(f'/dashboard/{user_id}').get_data(as_text=True)
+
+    # Raw SQL stands in for another process: no ORM event reaches this cache
+    with app.app_context():
+        db.session.execute(db.update(User).where(User.id == user_id).values(receipt_count=3))
+        db.session.commit()
+    assert '0/10 used' in client.get(f'/dashboard/{user_id}').get_data(as_text=True)
+
+    monkeypatch.setattr(user_cache, 'ttl', 0)
+    assert '3/10 used' in client.get(f'/dashboard/{user_id}').get_data(as_text=True)
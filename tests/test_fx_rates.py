@@ -0,0 +1,60 @@
+from datetime import date
+import pytest
+from app import app
+from db import db
+import fx_rates
+from fx_rates import RateTable, _day
+import receipt_service
+
+# ECB-style quotes: units per EUR, Friday 1 March then Monday 4 March 2024
+RATES = RateTable({
+    'USD': {_day('2024-03-01'): 1.08, _day('2024-03-04'): 1.09},
+    'GBP': {_day('2024-03-01'): 0.85, _day('2024-03-04'): 0.86},
+})
+
+def test_rate_on_a_quoted_day():
+    assert RATES.rate('USD', date(2024, 3, 4)) == 1.09
+    assert RATES.rate('EUR', date(2024, 3, 4)) == 1.0
+
+def test_rate_in_a_gap_uses_the_previous_quote():
+    # The weekend between the two quotes
+    assert RATES.rate('USD', date(2024, 3, 3)) == 1.08
+    assert RATES.rate('USD', date(2024, 12, 31)) == 1.09
+
+def test_rate_before_the_table_starts_uses_the_first_quote():
+    assert RATES.rate('USD', date(2020, 1, 1)) == 1.08
+
+def test_unknown_currency_has_no_rate():
+    assert RATES.rate('JPY', date(2024, 3, 4)) is None
+    assert RATES.convert(10, 'JPY', date(2024, 3, 4), to='USD') is None
+
+def test_cross_rate_goes_through_the_euro():
+    assert RATES.convert(100, 'GBP', date(2024, 3, 4), to='USD') == round(100 * 1.09 / 0.86, 2)
+    assert RATES.convert(100, 'EUR', date(2024, 3, 1), to='USD') == 108.0
+    assert RATES.convert(12.345, 'USD', date(2024, 3, 1), to='USD') == 12.35
+
+def test_convert_many_matches_convert():
+    amounts = [100, 55.5, 12.34, 7, 20, 1]
+    currencies = ['GBP', 'EUR', 'USD', 'GBP', 'JPY', 'EUR']
+    dates = [date(2024, 3, 4), date(2024, 3, 2), date(2024, 3, 1), date(2019, 5, 1), date(2024, 3, 4), None]
+
+    converted = RATES.convert_many(amounts, currencies, dates, to='USD')
+
+    expected = [RATES.convert(amount, currency, on_date, to='USD')
+                for amount, currency, on_date in zip(amounts, currencies, dates)]
+    assert [None if value != value else float(value) for value in converted] == pytest.approx(expected)
+
+def test_missing_rates_warning_names_the_fix(monkeypatch):
+    with app.app_context():
+        user = receipt_service.get_or_create_user(db.session, 'fx-warning@example.com')
+        receipt = receipt_service.build_receipt(user.id, 'images/eur.webp', {
+            'vendor': 'Bistro', 'amount': 30.0, 'currency': 'EUR', 'date': '2024-03-02',
+            'category': 'Food', 'tax': 0.0})
+        receipt_service.save_receipts(db.session, user, [receipt])
+
+        monkeypatch.setattr(fx_rates, 'get_rates', lambda: RateTable())
+        warning = receipt_service.missing_rates_warning(db.session.connection())
+        assert 'load-fx-rates' in warning and 'reconvert-amounts' in warning
+
+        monkeypatch.setattr(fx_rates, 'get_rates', lambda: RATES)
+        assert receipt_service.missing_rates_warning(db.session.connection()) is None
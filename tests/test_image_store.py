@@ -0,0 +1,42 @@
+import io
+import pytest
+from PIL import Image
+import image_store
+from storage import save_buffer, InvalidUpload
+
+def _jpeg(size=(3000, 4000), dpi=(300, 300)):
+    out = io.BytesIO()
+    Image.new('RGB', size, 'white').save(out, 'JPEG', dpi=dpi)
+    return out
+
+def test_upload_only_stages_the_original():
+    upload = _jpeg()
+    key, sha256, created = save_buffer(upload)
+
+    assert created
+    assert key == image_store.original_key(sha256, 'jpg')
+    assert not image_store.store.exists(image_store.image_key(sha256))
+    with image_store.open_image(key) as original:
+        assert original.read() == upload.getvalue()
+    # The same content again reuses the staged copy
+    assert save_buffer(io.BytesIO(upload.getvalue()))[:3] == (key, sha256, False)
+
+def test_promote_archives_once_and_drops_the_original():
+    key, sha256, _ = save_buffer(_jpeg(size=(3000, 4000), dpi=(300, 300)))
+
+    archived = image_store.promote(key)
+
+    assert archived == image_store.image_key(sha256) == image_store.archived_key(key)
+    assert not image_store.store.exists(key)
+    with Image.open(image_store.open_image(archived)) as image:
+        assert max(image.size) == image_store.ARCHIVE_MAX_DIMENSION
+    with Image.open(image_store.store.open(image_store.thumbnail_key(sha256))) as thumb:
+        assert max(thumb.size) == image_store.THUMBNAIL_SIZE
+    # Jobs for an identical upload still find the image once it is promoted
+    assert image_store.promote(key) == archived
+    with image_store.open_image(key) as image:
+        assert image.read()[:4] == b'RIFF'
+
+def test_corrupt_image_is_rejected_without_decoding():
+    with pytest.raises(InvalidUpload):
+        save_buffer(io.BytesIO(b'\xff\xd8\xff' + b'\x00' * 64))
@@ -0,0 +1,46 @@
+import io
+import pytest
+import job_queue
+import ocr_processor
+from storage import save_buffer
+from app import app
+from db import db
+from models import Receipt, User
+import receipt_service
+
+@pytest.fixture
+def queued_job(receipt_png):
+    with app.app_context():
+        user = receipt_service.get_or_create_user(db.session, 'queue-failure@example.com')
+        key, _, _ = save_buffer(io.BytesIO(receipt_png))
+        receipt, job_id = receipt_service.queue_receipt(db.session, user, key)
+        return job_id, receipt.id, user.id, user.receipt_count
+
+def _run_next_job():
+    job = job_queue.claim_job('test-worker')
+    assert job is not None
+    job_queue.process_job(job)
+
+def test_failing_extraction_is_retried_then_marked_failed(monkeypatch, queued_job):
+    def unavailable(*args, **kwargs):
+        raise RuntimeError('tesseract is not installed')
+    monkeypatch.setattr(ocr_processor, 'scan_receipt', unavailable)
+    job_id, receipt_id, user_id, receipt_count = queued_job
+
+    _run_next_job()
+    job = job_queue.get_job(job_id)
+    assert job['status'] == 'queued'
+    assert job['error'] == 'tesseract is not installed'
+
+    for _ in range(job_queue.MAX_ATTEMPTS - 1):
+        _run_next_job()
+
+    job = job_queue.get_job(job_id)
+    assert job['status'] == 'failed'
+    assert job['attempts'] == job_queue.MAX_ATTEMPTS
+    with app.app_context():
+        receipt = db.session.get(Receipt, receipt_id)
+        assert receipt.status == 'failed'
+        assert receipt.vendor is None
+        # The failed upload is given back to the user's quota
+        assert db.session.get(User, user_id).receipt_count == receipt_count - 1
@@ -0,0 +1,90 @@
+import threading
+import openai
+import pytest
+from types import SimpleNamespace
+from llm_client import LLMClient, CircuitBreaker, LLMUnavailable, MicroBatcher
+
+def _status_error(cls, status):
+    # Just what the SDK's error classes read from an HTTP response
+    response = SimpleNamespace(status_code=status, request=None, headers={})
+    return cls(f'HTTP {status}', response=response, body=None)
+
+class FakeClient:
+    """Raises the given errors in turn, then answers"""
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(usage=None)
+
+def _client(fake, breaker):
+    return LLMClient(fake, max_retries=2, backoff_base=0, backoff_max=0, breaker=breaker)
+
+def test_client_errors_do_not_open_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=60)
+    fake = FakeClient(*[_status_error(openai.BadRequestError, 400) for _ in range(3)],
+                      _status_error(openai.AuthenticationError, 401))
+    llm = _client(fake, breaker)
+
+    for _ in range(4):
+        with pytest.raises(openai.APIStatusError):
+            llm.chat(model='test')
+
+    assert fake.calls == 4  # never retried
+    assert breaker.state == 'closed'
+    assert llm.chat(model='test') is not None
+
+def test_server_errors_open_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=60)
+    fake = FakeClient(*[_status_error(openai.InternalServerError, 500) for _ in range(6)])
+    llm = _client(fake, breaker)
+
+    for _ in range(2):
+        with pytest.raises(openai.InternalServerError):
+            llm.chat(model='test')
+
+    assert fake.calls == 6  # each call used all its retries
+    assert breaker.state == 'open'
+    with pytest.raises(LLMUnavailable):
+        llm.chat(model='test')
+
+def test_client_error_during_a_trial_keeps_the_circuit_usable():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0)
+    breaker.failure()
+    assert breaker.state == 'half-open'
+    llm = _client(FakeClient(_status_error(openai.BadRequestError, 400)), breaker)
+
+    with pytest.raises(openai.BadRequestError):
+        llm.chat(model='test')
+
+    assert breaker.allow()
+
+def test_concurrent_map_calls_all_return():
+    batcher = MicroBatcher(lambda items: [item * 2 for item in items], max_batch_size=4, max_wait=0.01)
+    results = {}
+
+    def worker(n):
+        results[n] = batcher.map(list(range(n * 10, n * 10 + 5)))
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert results == {n: [i * 2 for i in range(n * 10, n * 10 + 5)] for n in range(8)}
+
+def test_map_gives_up_on_a_stuck_handler():
+    release = threading.Event()
+    batcher = MicroBatcher(lambda items: release.wait() and items, max_wait=0, result_timeout=0.2)
+
+    outcomes = batcher.map(['a', 'b'])
+    release.set()
+
+    assert all(isinstance(outcome, LLMUnavailable) for outcome in outcomes)
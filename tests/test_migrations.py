@@ -0,0 +1,90 @@
+import os
+import tempfile
+from datetime import date
+import pytest
+from sqlalchemy import create_engine, text
+from app import app  # noqa: F401  registers every model and listener
+from db import db
+import migrations
+
+# The user and receipt tables as the first release created them: free-form
+# date strings and FLOAT amounts, no status, aggregates or search index
+BASELINE_SCHEMA = [
+    """CREATE TABLE user (
+        id INTEGER PRIMARY KEY, email VARCHAR(120) NOT NULL UNIQUE,
+        plan VARCHAR(20), receipt_count INTEGER, created_at DATETIME)""",
+    """CREATE TABLE receipt (
+        id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES user (id),
+        filename VARCHAR(255) NOT NULL, vendor VARCHAR(100), amount FLOAT,
+        currency VARCHAR(10), date VARCHAR(20), category VARCHAR(50),
+        tax_amount FLOAT, created_at DATETIME)""",
+]
+
+LEGACY_RECEIPTS = [
+    # id, amount, tax, currency, date, category
+    (1, '12.50', '1.25', 'USD', '2024-03-02', 'Food'),
+    (2, '40', '0', 'USD', '05/03/2024', 'Food'),
+    (3, '7.5', '0.5', 'USD', 'Mar 09, 2024', 'Travel'),
+    (4, '20.00', '2.00', 'USD', 'sometime in spring', 'Travel'),
+    (5, '100', '19', 'EUR', '2024-04-10', 'Office'),
+]
+
+@pytest.fixture
+def legacy_engine():
+    path = os.path.join(tempfile.mkdtemp(), 'legacy.db')
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO user (id, email, plan, receipt_count, created_at) "
+                          "VALUES (1, 'legacy@example.com', 'free', 5, '2024-01-01 00:00:00')"))
+        conn.execute(
+            text("INSERT INTO receipt (id, user_id, filename, vendor, amount, tax_amount, currency, date, "
+                 "category, created_at) VALUES (:id, 1, 'uploads/r.png', 'Vendor', :amount, :tax, :currency, "
+                 ":date, :category, '2024-06-15 12:00:00')"),
+            [dict(zip(('id', 'amount', 'tax', 'currency', 'date', 'category'), row)) for row in LEGACY_RECEIPTS]
+        )
+    yield engine
+    engine.dispose()
+
+def test_upgrade_types_and_backfills_a_baseline_database(legacy_engine):
+    # What app startup does: create the missing tables, then upgrade
+    db.metadata.create_all(legacy_engine)
+    migrations.upgrade(legacy_engine)
+    migrations.upgrade(legacy_engine)
+
+    with legacy_engine.connect() as conn:
+        receipts = conn.execute(text("SELECT id, date, amount, status, home_amount FROM receipt ORDER BY id")).all()
+        users = conn.execute(text("SELECT receipt_count, total_amount, total_tax, unconverted_count "
+                                  "FROM user_aggregate")).all()
+        months = dict(conn.execute(text("SELECT month || ' ' || category, total_amount FROM monthly_aggregate")).all())
+
+    assert [(row.id, row.date) for row in receipts] == [
+        (1, '2024-03-02'),
+        (2, '2024-03-05'),
+        (3, '2024-03-09'),
+        (4, None),
+        (5, '2024-04-10'),
+    ]
+    assert [row.amount for row in receipts] == [12.5, 40.0, 7.5, 20.0, 100.0]
+    assert {row.status for row in receipts} == {'done'}
+    # No FX rates are loaded here, so only the USD receipts convert
+    assert [row.home_amount for row in receipts] == [12.5, 40.0, 7.5, 20.0, None]
+
+    assert len(users) == 1
+    assert users[0].receipt_count == 5
+    assert users[0].total_amount == pytest.approx(80.0)
+    assert users[0].total_tax == pytest.approx(3.75)
+    assert users[0].unconverted_count == 1
+    # The unparseable date falls back to the upload month
+    assert months == pytest.approx({'2024-03 Food': 52.5, '2024-03 Travel': 7.5,
+                                    '2024-06 Travel': 20.0, '2024-04 Office': 0.0})
+
+def test_upgraded_dates_read_back_as_dates(legacy_engine):
+    db.metadata.create_all(legacy_engine)
+    migrations.upgrade(legacy_engine)
+
+    with legacy_engine.connect() as conn:
+        dates = conn.execute(db.select(db.metadata.tables['receipt'].c.date).order_by(text('id'))).scalars().all()
+
+    assert dates == [date(2024, 3, 2), date(2024, 3, 5), date(2024, 3, 9), None, date(2024, 4, 10)]
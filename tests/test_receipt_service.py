@@ -0,0 +1,50 @@
+from datetime import date
+import pytest
+from app import app
+from db import db
+import receipt_service
+
+RECEIPTS = [
+    {'vendor': 'Berghotel', 'amount': 54.5, 'currency': 'USD', 'date': '2024-03-02', 'category': 'Travel', 'tax': 4.5},
+    {'vendor': 'Cafe Luna', 'amount': 12.0, 'currency': 'USD', 'date': '2024-03-05', 'category': 'Food', 'tax': 1.0},
+    {'vendor': 'Paper Co', 'amount': 30.25, 'currency': 'USD', 'date': '2024-04-01', 'category': 'Office', 'tax': 2.5},
+]
+
+@pytest.fixture
+def session():
+    with app.app_context():
+        yield db.session
+
+def test_remaining_uploads_follows_the_plan(session):
+    user = receipt_service.get_or_create_user(session, 'service-plan@example.com')
+    assert receipt_service.remaining_uploads(user) == receipt_service.FREE_RECEIPT_LIMIT
+    user.receipt_count = receipt_service.FREE_RECEIPT_LIMIT + 2
+    assert receipt_service.remaining_uploads(user) == 0
+    user.plan = 'pro'
+    assert receipt_service.remaining_uploads(user) is None
+    session.rollback()
+
+def test_save_receipts_updates_count_totals_and_export(session):
+    user = receipt_service.get_or_create_user(session, 'service-save@example.com')
+    version = receipt_service.data_version(session, user.id)
+    receipts = [receipt_service.build_receipt(user.id, f'images/{i}.webp', data, 'ocr text')
+                for i, data in enumerate(RECEIPTS)]
+
+    assert receipt_service.save_receipts(session, user, receipts) == 3
+    assert receipt_service.save_receipts(session, user, []) == 0
+
+    assert user.receipt_count == 3
+    assert receipt_service.data_version(session, user.id) > version
+    totals = receipt_service.dashboard_totals(session, user.id)
+    assert totals['receipt_total'] == 3
+    assert totals['total_amount'] == pytest.approx(96.75)
+    assert totals['total_tax'] == pytest.approx(8.0)
+    assert totals['unconverted_count'] == 0
+    assert totals['category_totals'] == pytest.approx({'Travel': 54.5, 'Food': 12.0, 'Office': 30.25})
+
+    rows = list(receipt_service.export_rows(session, user.id))
+    assert sorted((row.vendor, row.amount, row.date) for row in rows) == [
+        ('Berghotel', 54.5, date(2024, 3, 2)),
+        ('Cafe Luna', 12.0, date(2024, 3, 5)),
+        ('Paper Co', 30.25, date(2024, 4, 1)),
+    ]
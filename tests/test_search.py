@@ -0,0 +1,55 @@
+import pytest
+from app import app
+from db import db
+import receipt_service
+from search import search_receipts, backend
+
+def _save(session, email, receipts):
+    user = receipt_service.get_or_create_user(session, email)
+    receipt_service.save_receipts(session, user, [
+        receipt_service.build_receipt(user.id, f'images/{i}.webp', {
+            'vendor': vendor, 'amount': 10.0, 'currency': 'USD', 'date': '2024-03-02',
+            'category': category, 'tax': 0.0}, ocr_text)
+        for i, (vendor, category, ocr_text) in enumerate(receipts)
+    ])
+    return user.id
+
+@pytest.fixture
+def session():
+    with app.app_context():
+        yield db.session
+
+def test_fts5_is_available(session):
+    assert backend(session.connection()) == 'fts5'
+
+def test_vendor_matches_rank_above_ocr_text(session):
+    user_id = _save(session, 'search-rank@example.com', [
+        ('Corner Shop', 'Food', 'receipt via harbourline taxi voucher'),
+        ('Harbourline', 'Travel', 'ferry ticket'),
+    ])
+
+    results = search_receipts(session, user_id, 'harbourline')
+
+    assert [result['vendor'] for result in results] == ['Harbourline', 'Corner Shop']
+    assert results[0]['rank'] > results[1]['rank']
+
+def test_terms_are_prefixes_and_all_must_match(session):
+    user_id = _save(session, 'search-prefix@example.com', [
+        ('Berghotel Alpina', 'Travel', 'two nights half board'),
+        ('Bergbahn', 'Travel', 'day pass'),
+    ])
+
+    assert {result['vendor'] for result in search_receipts(session, user_id, 'berg')} == {'Berghotel Alpina', 'Bergbahn'}
+    assert [result['vendor'] for result in search_receipts(session, user_id, 'berg nig')] == ['Berghotel Alpina']
+    assert search_receipts(session, user_id, 'berg lunch') == []
+
+def test_search_only_sees_the_users_own_receipts(session):
+    mine = _save(session, 'search-mine@example.com', [('Quillfeather Books', 'Office', 'notebook')])
+    theirs = _save(session, 'search-theirs@example.com', [('Quillfeather Books', 'Office', 'pens')])
+
+    results = search_receipts(session, mine, 'quillfeather')
+    assert len(results) == 1 and results[0]['vendor'] == 'Quillfeather Books'
+    assert search_receipts(session, theirs, 'notebook') == []
+    # Owner tokens are not searchable text
+    assert search_receipts(session, mine, f'u{mine}') == []
+    assert search_receipts(session, mine, f'u{theirs}') == []
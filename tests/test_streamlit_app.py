@@ -0,0 +1,103 @@
+import os
+import pytest
+from streamlit.testing.v1 import AppTest
+import batch_processor
+from app import app  # noqa: F401  creates the tables the Streamlit app reads
+import receipt_service
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'streamlit_app.py')
+
+def _fake_extract_batch(keys):
+    return [({'vendor': f'Vendor {i}', 'amount': 10.0 + i, 'currency': 'USD', 'date': '2024-03-02',
+              'category': 'Food', 'tax': 1.0}, 0.1, None, 'text') for i, _ in enumerate(keys)]
+
+@pytest.fixture
+def logged_in(monkeypatch):
+    monkeypatch.setattr(batch_processor, 'extract_batch', _fake_extract_batch)
+
+    def start(email):
+        at = AppTest.from_file(APP_PATH, default_timeout=60)
+        at.session_state['user_email'] = email
+        return at.run()
+    return start
+
+def _user(email):
+    with receipt_service.session_factory(os.environ['DATABASE_URL'])() as session:
+        user = receipt_service.get_or_create_user(session, email)
+        return user.id, user.receipt_count, receipt_service.dashboard_totals(session, user.id)
+
+def test_upload_saves_receipts_and_shows_them(logged_in, receipt_png):
+    at = logged_in('streamlit-upload@example.com')
+    assert not at.exception
+
+    at.file_uploader(key='loggedin_upload').set_value([('a.png', receipt_png, 'image/png'),
+                                                       ('b.png', receipt_png, 'image/png')])
+    at.run()
+
+    assert not at.exception
+    assert any('2 receipt(s) uploaded' in message.value for message in at.success)
+    _, receipt_count, totals = _user('streamlit-upload@example.com')
+    assert receipt_count == 2
+    assert totals['receipt_total'] == 2
+    assert totals['total_amount'] == pytest.approx(21.0)
+    assert sorted(at.dataframe[0].value['Vendor']) == ['Vendor 0', 'Vendor 1']
+
+    # The workbook is built from receipt_service.export_rows
+    next(button for button in at.button if button.label == 'Download Excel of All Receipts').click()
+    at.run()
+    assert not at.exception
+    assert [button.label for button in at.download_button] == ['Download Excel']
+
+    # Reruns keep the selected files; they must not be saved again
+    next(box for box in at.text_input if box.label == 'Vendor').input('Vendor 0')
+    at.run()
+    assert not at.exception
+    _, receipt_count, totals = _user('streamlit-upload@example.com')
+    assert receipt_count == 2
+    assert totals['receipt_total'] == 2
+
+def test_upload_is_capped_at_the_free_quota(logged_in, receipt_png):
+    email = 'streamlit-quota@example.com'
+    with receipt_service.session_factory(os.environ['DATABASE_URL'])() as session:
+        user = receipt_service.get_or_create_user(session, email)
+        user.receipt_count = receipt_service.FREE_RECEIPT_LIMIT - 1
+        session.commit()
+    at = logged_in(email)
+
+    at.file_uploader(key='loggedin_upload').set_value([('a.png', receipt_png, 'image/png'),
+                                                       ('b.png', receipt_png, 'image/png')])
+    at.run()
+
+    assert not at.exception
+    assert any('free limit reached' in message.value for message in at.error)
+    _, receipt_count, totals = _user(email)
+    assert receipt_count == receipt_service.FREE_RECEIPT_LIMIT
+    assert totals['receipt_total'] == 1
+
+def test_login_reruns_into_the_dashboard():
+    at = AppTest.from_file(APP_PATH, default_timeout=60).run()
+
+    at.text_input(key='login_email').input('streamlit-login@example.com')
+    next(button for button in at.button if button.label == 'Login').click()
+    at.run()
+
+    assert not at.exception
+    assert at.session_state['user_email'] == 'streamlit-login@example.com'
+    assert any('Logged in as' in header.value for header in at.subheader)
+
+def test_free_export_is_built_in_memory():
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.session_state['free_uploads'] = 2
+    at.session_state['free_receipts'] = [
+        {'vendor': 'Cafe', 'amount': 4.5, 'currency': 'USD', 'date': '2024-03-02', 'category': 'Food', 'tax': 0.5},
+        {'vendor': 'Hotel', 'amount': 120.0, 'currency': 'EUR', 'date': 'not a date', 'category': 'Travel', 'tax': 0.0}
+    ]
+    at.run()
+    exported = os.listdir('exports') if os.path.isdir('exports') else []
+
+    next(button for button in at.button if button.label == 'Download Excel of These Receipts').click()
+    at.run()
+
+    assert not at.exception
+    assert [button.label for button in at.download_button] == ['Download Excel']
+    assert (os.listdir('exports') if os.path.isdir('exports') else []) == exported
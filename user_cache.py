@@ -0,0 +1,72 @@
+import os
+import time
+import threading
+from collections import namedtuple, OrderedDict
+from sqlalchemy import event, inspect
+from models import User
+
+# Process-local cache of who is logged in, so read-only routes can resolve the
+# session's user without a database round trip. Entries are keyed by the
+# session's email and expire after USER_CACHE_TTL seconds; any ORM change to
+# a user's plan or receipt_count in this process drops the entry at once.
+# Other processes (workers, a second app server) are only bounded by the TTL,
+# which is why routes that enforce the plan limit load the User row itself.
+
+UserSnapshot = namedtuple('UserSnapshot', 'id email plan receipt_count')
+
+def snapshot(user):
+    return UserSnapshot(user.id, user.email, user.plan, user.receipt_count)
+
+class UserCache:
+    def __init__(self, ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, email):
+        """Cached snapshot for email, or None"""
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def put(self, email, user_snapshot):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[email] = (time.monotonic() + self.ttl, user_snapshot)
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, email):
+        with self._lock:
+            self._entries.pop(email, None)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+user_cache = UserCache(
+    ttl=float(os.environ.get("USER_CACHE_TTL", "30")),
+    max_entries=int(os.environ.get("USER_CACHE_MAX_ENTRIES", "10000")),
+)
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, target):
+    # Also covers an email change: drop the entry under the old address too
+    history = inspect(target).attrs.email.history
+    for email in {target.email, *history.deleted}:
+        user_cache.invalidate(email)
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    user_cache.invalidate(target.email)